@@ -0,0 +1,65 @@
+# Benchmark for admission control under a burst, with its state in a DynamoDB table that every request updates
+# Starts many requests of different chat sessions at once against a fake DynamoDB client with a fixed latency,
+# so their optimistic-locking writes of the shared queue item collide. Counts the outcomes, the conditional
+# write conflicts and the store errors, and the requests admitted in the first second, which the global
+# bucket limits to its burst plus one second of its rate. The "no backoff" row retries conflicts at once.
+# Usage: python benchmarks/bench_admission_contention.py [requests]
+import contextlib
+import io
+import sys
+import threading
+import time
+
+from stubs import FakeDynamoDB, load_lambda
+
+ENV = {
+    "URL": "https://example.invalid/production",
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+LATENCY = 0.008
+GLOBAL_RATE = 5
+GLOBAL_BURST = 10
+
+def run(admission_control, ttl_store, requests, backoff):
+    client = FakeDynamoDB(latency=LATENCY)
+    sleep = time.sleep if backoff else (lambda seconds: None)
+    store = ttl_store.DynamoDBStore("admission", client=client, sleep=sleep)
+    controller = admission_control.AdmissionController(store=store, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                                                       max_wait_ms=5000, enabled=True)
+    started = time.monotonic()
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(requests)
+
+    def request(i):
+        barrier.wait()
+        admission = controller.admit(f"session-{i}")
+        with lock:
+            results.append((admission.outcome, time.monotonic() - started))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(requests)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    first_second = sum(1 for outcome, at in results if outcome in ('admitted', 'queued') and at <= 1.0)
+    return outcomes, first_second, client.conflicts, controller.stats()
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    load_lambda("get-response-from-bedrock", ENV)
+    import admission_control
+    import ttl_store
+    print(f"{requests} concurrent requests, {LATENCY * 1000:.0f} ms per DynamoDB call, global rate {GLOBAL_RATE}/s burst {GLOBAL_BURST}")
+    print(f"{'mode':<12}{'admitted':>10}{'queued':>8}{'busy':>6}{'timeout':>9}{'store errors':>14}{'conflicts':>11}{'admitted <1s':>14}")
+    for mode, backoff in (("no backoff", False), ("backoff", True)):
+        outcomes, first_second, conflicts, stats = run(admission_control, ttl_store, requests, backoff)
+        print(f"{mode:<12}{outcomes.get('admitted', 0):>10}{outcomes.get('queued', 0):>8}{outcomes.get('busy', 0):>6}{outcomes.get('timeout', 0):>9}"
+              f"{stats['store_errors']:>14}{conflicts:>11}{first_second:>14}")
+
+if __name__ == "__main__":
+    main()
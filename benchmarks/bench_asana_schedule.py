@@ -0,0 +1,88 @@
+# Benchmark for the Asana schedule fetch of the Slack bot against a local fake Asana server
+# Compares the previous sequential fetch with the concurrent pooled client and its snapshot cache
+# Usage: python benchmarks/bench_asana_schedule.py [latency_ms] [tasks_per_section]
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import urllib3
+
+from stubs import LAMBDA_ROOT, SHARED_LAYER
+
+sys.path[:0] = [SHARED_LAYER, os.path.join(LAMBDA_ROOT, "horizon-slackbot")]
+from asana_schedule import ScheduleClient
+
+SECTION_IDS = {"Monday": "1", "Tuesday": "2", "Wednesday": "3", "Thursday": "4", "Friday": "5"}
+NAMES = ["Jim", "Joe", "Pablo", "Maria", "Wei", "Aisha", "Tom", "Priya"]
+
+# Fake Asana tasks endpoint with per-request latency and offset pagination
+def fake_asana(latency, tasks_per_section):
+    class Handler(BaseHTTPRequestHandler):
+        requests = 0
+
+        def do_GET(self):
+            Handler.requests += 1
+            time.sleep(latency)
+            query = parse_qs(urlparse(self.path).query)
+            section = query["section"][0]
+            limit = int(query.get("limit", [tasks_per_section])[0])
+            offset = int(query.get("offset", ["0"])[0])
+            tasks = [{"gid": f"{section}{i}", "name": f"{NAMES[i % len(NAMES)]} 9 am - 5 pm"} for i in range(tasks_per_section)]
+            page = tasks[offset:offset + limit]
+            next_page = {"offset": str(offset + limit)} if offset + limit < len(tasks) else None
+            body = json.dumps({"data": page, "next_page": next_page}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, Handler
+
+# The fetch the Slack bot used before: a new pool per call and one section after another
+def legacy_fetch(base_url):
+    http = urllib3.PoolManager()
+    schedule = {}
+    for day, section_id in SECTION_IDS.items():
+        response = http.request('GET', f"{base_url}/tasks?section={section_id}", headers={"Authorization": "Bearer token"})
+        schedule[day] = [task.get("name") for task in json.loads(response.data.decode("utf-8")).get("data", [])]
+    return schedule
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+def main():
+    latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 80.0) / 1000.0
+    tasks_per_section = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    server, handler = fake_asana(latency, tasks_per_section)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    _, legacy_ms = timed(lambda: legacy_fetch(base_url))
+    legacy_requests = handler.requests
+
+    client = ScheduleClient("token", SECTION_IDS, base_url=base_url, ttl_seconds=300)
+    handler.requests = 0
+    schedule, cold_ms = timed(client.get_weekly_schedule)
+    cold_requests = handler.requests
+    _, warm_ms = timed(client.get_weekly_schedule)
+    assert all(len(tasks) == tasks_per_section for tasks in schedule.values())
+
+    print(f"Fake Asana latency: {latency * 1000:.0f} ms, tasks per section: {tasks_per_section}")
+    print(f"Sequential fetch (previous):  {legacy_ms:8.1f} ms  {legacy_requests} requests")
+    print(f"Concurrent fetch, cold:       {cold_ms:8.1f} ms  {cold_requests} requests")
+    print(f"Snapshot hit:                 {warm_ms:8.3f} ms  {handler.requests - cold_requests} requests")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Benchmark for the background websocket sender in streamResponseToAPI
+# Streams a model answer at a fixed token rate while every post_to_connection takes the injected latency,
+# and compares posting on the streaming thread with the background sender.
+# Usage: python benchmarks/bench_background_sender.py [post_latency_ms] [tokens_per_second] [answers]
+import contextlib
+import io
+import sys
+import time
+
+from stubs import FakeGateway, bedrock_stream, load_lambda, SAMPLE_ANSWER
+
+def run(index, mode, post_latency, token_rate, answers):
+    totals = {"wall": 0.0, "drain": 0.0, "posts": 0}
+    for i in range(answers):
+        gateway = FakeGateway(post_latency=post_latency)
+        stream = bedrock_stream(SAMPLE_ANSWER * 2, token_delay=1.0 / token_rate)
+        drained = {}
+
+        # Records when the last model event was read, i.e. how long the model stream was held open
+        def body():
+            for event in stream["body"]:
+                yield event
+            drained["at"] = time.perf_counter()
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            answer = index.streamResponseToAPI({"body": body()}, f"conn-{i}", gateway=gateway, sender_mode=mode)
+        totals["wall"] += time.perf_counter() - started
+        totals["drain"] += drained["at"] - started
+        totals["posts"] += len(gateway.frames)
+        assert answer == SAMPLE_ANSWER * 2 and gateway.text_for(f"conn-{i}") == answer
+    return {name: value / answers for name, value in totals.items()}
+
+def main():
+    post_latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 60.0) / 1000.0
+    token_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 150.0
+    answers = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    index = load_lambda("get-response-from-bedrock", {"URL": "https://example.invalid/production"})
+
+    print(f"Post latency: {post_latency * 1000:.0f} ms, model rate: {token_rate:.0f} tokens/s, answers: {answers}")
+    print(f"{'sender':<12}{'posts/answer':>14}{'stream drained ms':>20}{'wall ms/answer':>16}")
+    for mode in ("inline", "background"):
+        result = run(index, mode, post_latency, token_rate, answers)
+        print(f"{mode:<12}{result['posts']:>14.1f}{result['drain'] * 1000:>20.1f}{result['wall'] * 1000:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Benchmark for module import and per-invocation setup of the get-response-from-bedrock Lambda
+# Reports import time, setup time of the first invocation and steady-state setup time of a warm container
+# Usage: python benchmarks/bench_cold_start.py [invocations]
+import os
+import subprocess
+import sys
+import time
+
+from stubs import load_lambda
+
+ENV = {"URL": "https://example.invalid/production", "KNOWLEDGE_BASE_ID": "KB00000000", "AWS_DEFAULT_REGION": "us-west-2"}
+
+# Imports the Lambda in a fresh interpreter so nothing is already cached
+def measure_import():
+    code = (
+        "import time, sys; sys.path.insert(0, {here!r}); from stubs import load_lambda; "
+        "started = time.perf_counter(); load_lambda('get-response-from-bedrock', {env!r}); "
+        "print(time.perf_counter() - started)"
+    ).format(here=os.path.dirname(os.path.abspath(__file__)), env=ENV)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+# Everything the handler needs before it can talk to the knowledge base and the model
+def setup(index, language_code):
+    index.get_agent_client()
+    index.get_bedrock_client()
+    index.get_gateway_client()
+    language = index.LANGUAGE_MAP.get(language_code, "English")
+    index.get_language_prompt(language, language_code)
+
+# The setup the handler used to repeat on every invocation: fresh clients and a freshly formatted prompt
+def legacy_setup(index, language_code):
+    index.boto3.client("bedrock-agent-runtime")
+    index.boto3.client(service_name="bedrock-runtime", region_name=index.BEDROCK_REGION)
+    index.boto3.client("apigatewaymanagementapi", endpoint_url=os.environ["URL"])
+    language = dict(index.LANGUAGE_MAP).get(language_code, "English")
+    index.LANGUAGE_PROMPT_TEMPLATE.format(language=language, language_code=language_code)
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+def main():
+    invocations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    import_time = measure_import()
+    index = load_lambda("get-response-from-bedrock", ENV)
+
+    first = timed(setup, index, "es")
+    steady = sum(timed(setup, index, "es") for _ in range(invocations)) / invocations
+    legacy = sum(timed(legacy_setup, index, "es") for _ in range(invocations)) / invocations
+
+    print(f"Import time:                       {import_time * 1000:8.2f} ms")
+    print(f"First-invocation setup:            {first * 1000:8.2f} ms")
+    print(f"Steady-state setup:                {steady * 1000:8.3f} ms")
+    print(f"Previous per-invocation setup:     {legacy * 1000:8.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Benchmark for building the model prompt from knowledge base results in get-response-from-bedrock
+# Compares the previous loop (string concatenation with the prompt re-formatted on every result, every result
+# included) with the context assembler (score filter, near-duplicate removal, token budget, one format).
+# The synthetic results mix relevant chunks, overlapping copies of them and low scoring matches.
+# Usage: python benchmarks/bench_context_assembly.py [repetitions]
+import random
+import sys
+import time
+
+from stubs import load_lambda
+
+ENV = {"URL": "https://example.invalid/production", "KNOWLEDGE_BASE_ID": "KB00000000", "AWS_DEFAULT_REGION": "us-west-2"}
+WORDS = ("cloud innovation center students partners prototype public sector amazon web services arizona state "
+         "university project engagement solution open source github team challenge data machine learning").split()
+
+# Builds retrieval results: a third are overlapping copies of an earlier chunk, a third score below the threshold
+def make_results(count, rng, chunk_words=180):
+    results = []
+    for i in range(count):
+        if i % 3 == 1 and results:
+            words = results[-1]["content"]["text"].split()
+            shift = rng.randint(5, 20)
+            text = " ".join(words[shift:] + [rng.choice(WORDS) for _ in range(shift)])
+            score = results[-1]["score"] - 0.01
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(chunk_words))
+            score = rng.uniform(0.05, 0.15) if i % 3 == 2 else rng.uniform(0.4, 0.8)
+        results.append({"content": {"text": text}, "score": round(score, 3)})
+    return results
+
+# The prompt construction the handler used before the context assembler
+def legacy_prompt(results, full_prompt):
+    rag_info = "RELEVENT CLOUD INNOVATION CENTER INFORMATION:\n"
+    for response in results:
+        rag_info = rag_info + response["content"]["text"] + "\n"
+        final_prompt = f"""{rag_info}
+
+        {full_prompt}"""
+    return final_prompt
+
+def assembled_prompt(assemble_context, results, full_prompt):
+    context = assemble_context(results)
+    rag_info = context.text if context.chunks else "No relevant information was found in the knowledge base for this message."
+    return f"""RELEVENT CLOUD INNOVATION CENTER INFORMATION:
+{rag_info}
+
+        {full_prompt}"""
+
+def timed(fn, repetitions, *args):
+    started = time.perf_counter()
+    for _ in range(repetitions):
+        result = fn(*args)
+    return result, (time.perf_counter() - started) / repetitions
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    load_lambda("get-response-from-bedrock", ENV)
+    from context_assembler import assemble_context, estimate_tokens
+
+    rng = random.Random(7)
+    full_prompt = "Previous conversation messages: \n\n    New user message: What does the CIC do?\n    "
+    print(f"{'results':>8}{'legacy tokens':>15}{'legacy us':>11}{'new tokens':>12}{'new us':>9}{'used':>6}{'dropped (score/dup/budget)':>29}")
+    for count in (5, 10, 25, 100):
+        results = make_results(count, rng)
+        legacy, legacy_time = timed(legacy_prompt, repetitions, results, full_prompt)
+        new, new_time = timed(assembled_prompt, repetitions, assemble_context, results, full_prompt)
+        stats = assemble_context(results).stats()
+        dropped = f"{stats['low_score']}/{stats['duplicate']}/{stats['over_budget']}"
+        print(f"{count:>8}{estimate_tokens(legacy):>15}{legacy_time * 1e6:>11.1f}{estimate_tokens(new):>12}{new_time * 1e6:>9.1f}{stats['used']:>6}{dropped:>29}")
+
+if __name__ == "__main__":
+    main()
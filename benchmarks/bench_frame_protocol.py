@@ -0,0 +1,55 @@
+# Benchmark for the websocket frame protocols of streamResponseToAPI
+# Streams the same answers with the original frames (version 1) and the compact frames (version 2) and counts
+# the posts and bytes per answer, per token and with the default coalescing, for an English and a Spanish answer.
+# Also checks that both protocols deliver the same text and that compact sequence numbers have no gaps.
+# Usage: python benchmarks/bench_frame_protocol.py [answers]
+import contextlib
+import io
+import sys
+
+from stubs import FakeGateway, bedrock_stream, frame_text, load_lambda, SAMPLE_ANSWER
+
+SPANISH_ANSWER = (
+    "## El Centro de Innovación en la Nube\n\n"
+    "El **Centro de Innovación en la Nube de ASU (CIC)** es una colaboración entre la Universidad Estatal de Arizona "
+    "y Amazon Web Services. Reúne a estudiantes, personal y organizaciones del sector público para resolver "
+    "problemas reales con tecnología en la nube.\n\n"
+    "¿Le gustaría saber más sobre un proyecto específico o cómo participar?"
+)
+# API Gateway request IDs look like this, version 2 frames carry one
+REQUEST_ID = "Kx3bTFvJPHcEXsA="
+
+def run(index, frame_protocol, protocol, answer, flush_bytes, answers):
+    index.STREAM_FLUSH_BYTES = flush_bytes
+    posts = sent_bytes = 0
+    for i in range(answers):
+        gateway = FakeGateway()
+        connection_id = f"conn-{protocol}-{i}"
+        encoder = frame_protocol.create_encoder(protocol, REQUEST_ID)
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.streamResponseToAPI(bedrock_stream(answer), connection_id, gateway=gateway, sender_mode="inline", encoder=encoder)
+        assert gateway.text_for(connection_id) == answer, "the client would not see the whole answer"
+        frames = gateway.frames_for(connection_id)
+        if protocol == frame_protocol.PROTOCOL_V2:
+            assert [frame["s"] for frame in frames] == list(range(len(frames))), "sequence numbers have gaps"
+            assert all(frame_text(frame) or frame["t"] != "d" for frame in frames), "an empty delta was sent"
+        count, size = gateway.volume_for(connection_id)
+        posts += count
+        sent_bytes += size
+    return posts / answers, sent_bytes / answers
+
+def main():
+    answers = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    index = load_lambda("get-response-from-bedrock", {"URL": "https://example.invalid/production"})
+    import frame_protocol
+    default_flush = index.STREAM_FLUSH_BYTES
+
+    print(f"{'answer':<10}{'mode':<22}{'v1 posts':>10}{'v2 posts':>10}{'v1 bytes':>10}{'v2 bytes':>10}{'saved':>8}")
+    for name, answer in (("English", SAMPLE_ANSWER), ("Spanish", SPANISH_ANSWER)):
+        for mode, flush_bytes in (("per token", 1), ("coalesced (default)", default_flush)):
+            v1_posts, v1_bytes = run(index, frame_protocol, frame_protocol.PROTOCOL_V1, answer, flush_bytes, answers)
+            v2_posts, v2_bytes = run(index, frame_protocol, frame_protocol.PROTOCOL_V2, answer, flush_bytes, answers)
+            print(f"{name:<10}{mode:<22}{v1_posts:>10.1f}{v2_posts:>10.1f}{v1_bytes:>10.0f}{v2_bytes:>10.0f}{1 - v2_bytes / v1_bytes:>8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Answers and time to first delta of the web pipeline when the home Bedrock region degrades, with the model
+# pinned to us-west-2 and with a pool of three regions. Each region is a stubbed client with its own first token
+# latency, wrapped in a FaultInjector for throttling, server errors and streams failing before their first event.
+# Scenarios: all regions healthy, a slow home region, a throttled home region, home streams failing before the
+# first token, and a home region outage. "busy" counts requests that got the busy reply instead of an answer.
+# Usage: python benchmarks/bench_regions.py [requests]
+import contextlib
+import io
+import sys
+import threading
+import time
+
+from stubs import SAMPLE_ANSWER, FakeAgent, FakeBedrockRuntime, FakeGateway, FaultInjector, load_lambda
+
+ENV = {
+    "URL": "https://example.invalid/production",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "ANSWER_CACHE_ENABLED": "false",
+    "REQUEST_COALESCING_ENABLED": "false",
+    "ADMISSION_CONTROL_ENABLED": "false",
+}
+POOL = ["us-west-2", "us-east-1", "us-east-2"]
+# First token latency of each region when healthy, us-west-2 is closest
+LATENCY = {"us-west-2": 0.15, "us-east-1": 0.25, "us-east-2": 0.3}
+SCENARIOS = [
+    ("healthy", {}, {}),
+    ("home slow", {"us-west-2": 1.5}, {}),
+    ("home throttled", {}, dict(throttle_rate=0.4)),
+    ("home stream errors", {}, dict(stream_error_rate=0.3)),
+    ("home outage", {}, dict(error_rate=1.0, slow_seconds=0.5)),
+]
+WORKERS = 8
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+# Stubbed client of each region, the faults only hit the home region
+def regional_clients(latency_overrides, faults):
+    clients = {}
+    for i, region in enumerate(POOL):
+        client = FakeBedrockRuntime(first_token_latency=latency_overrides.get(region, LATENCY[region]))
+        if region == POOL[0] and faults:
+            client = FaultInjector(client, "invoke_model_with_response_stream", seed=11, **faults)
+        clients[region] = client
+    return clients
+
+def run(index, region_router, regions, latency_overrides, faults, requests):
+    gateway = FakeGateway()
+    clients = regional_clients(latency_overrides, faults)
+    index._clients.update(agent=FakeAgent(latency=0.05), gateway=gateway)
+    index.BEDROCK_ROUTER = region_router.RegionRouter(regions, lambda region: clients[region])
+    index.RETRIEVAL_CACHE.invalidate()
+    latencies, outcomes = [], {"answered": 0, "busy": 0, "failed": 0}
+    lock = threading.Lock()
+    pending = list(range(requests))
+
+    def request(i):
+        connection_id = f"{len(regions)}-{id(faults)}-{i}"
+        started = time.perf_counter()
+        try:
+            index.lambda_handler({"connectionId": connection_id, "prompt": f"What is the Cloud Innovation Center? ({i})", "language": "en"}, None)
+        except Exception:
+            return "failed", None
+        if gateway.text_for(connection_id) != SAMPLE_ANSWER:
+            return "busy", None
+        return "answered", gateway.first_delta[connection_id] - started
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i = pending.pop(0)
+            outcome, latency = request(i)
+            with lock:
+                outcomes[outcome] += 1
+                if latency is not None:
+                    latencies.append(latency)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, outcomes, index.BEDROCK_ROUTER.stats()
+
+def report(name, mode, latencies, outcomes, stats):
+    ms = [latency * 1000 for latency in latencies]
+    calls = "/".join(str(stats["regions"].get(region, {}).get("calls", 0)) for region in POOL)
+    print(f"{name:<20}{mode:<8}{outcomes['answered']:>9}{outcomes['busy']:>6}{outcomes['failed']:>8}{percentile(ms, 50):>8.0f}{percentile(ms, 95):>8.0f}"
+          f"{percentile(ms, 99):>8.0f}  {calls:<12} failovers {stats['failovers']}, retries {stats['retries']}, explored {stats['explored']}")
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    index = load_lambda("get-response-from-bedrock", ENV)
+    import region_router
+    print(f"{requests} requests per run, {WORKERS} at a time, time to first delta in ms, calls per region {'/'.join(POOL)}")
+    print(f"{'scenario':<20}{'mode':<8}{'answered':>9}{'busy':>6}{'failed':>8}{'p50':>8}{'p95':>8}{'p99':>8}  calls")
+    for name, latency_overrides, faults in SCENARIOS:
+        for mode, regions in (("pinned", POOL[:1]), ("pool", POOL)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(index, region_router, regions, latency_overrides, faults, requests)
+            report(name, mode, *result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Tail latency of the web pipeline under injected knowledge base and Translate faults, without and with the
+# resilience layer (deadlines, jittered retries, hedged requests, knowledge base circuit breaker).
+# "without" runs the same code with a policy that makes one attempt with no deadline, like the bare client.
+# Each run first sends WARMUP healthy requests (not measured), like a warm container that served traffic before
+# the fault started, so hedging and the adaptive deadline work from recent latencies.
+# Scenarios: a slow tail (5% of retrieves take 2.5 s), throttling (20% of retrieves throttled), an outage
+# (every retrieve fails after 1 s) and a slow Translate tail. Time is measured from the request to the first
+# delta frame (to the translation for Translate). Every request asks a unique question to bypass the caches.
+# "no KB" counts requests answered without the knowledge base (or a translation) because its call failed.
+# Usage: python benchmarks/bench_resilience.py [requests]
+import contextlib
+import io
+import sys
+import threading
+import time
+
+from stubs import FakeAgent, FakeBedrockRuntime, FakeGateway, FakeTranslate, FaultInjector, load_lambda
+
+ENV = {
+    "URL": "https://example.invalid/production",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "ANSWER_CACHE_ENABLED": "false",
+    "REQUEST_COALESCING_ENABLED": "false",
+    "ADMISSION_CONTROL_ENABLED": "false",
+    "RESPONSE_FUNCTION_ARN": "get-response-from-bedrock",
+}
+SCENARIOS = [
+    ("retrieve slow tail", dict(slow_rate=0.05, slow_seconds=2.5)),
+    ("retrieve throttled", dict(throttle_rate=0.2)),
+    ("retrieve outage", dict(error_rate=1.0, slow_seconds=1.0)),
+]
+WORKERS = 8
+WARMUP = 40
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+# Policies for a run: the defaults, or a single attempt without deadline, hedging or breaker
+def policies(resilience, enabled):
+    if enabled:
+        breaker = resilience.CircuitBreaker('knowledge_base', resilience.KB_BREAKER_FAILURES, resilience.KB_BREAKER_RESET_SECONDS)
+        return (resilience.CallPolicy('retrieve', resilience.RETRIEVE_DEADLINE_MS, hedge=True, breaker=breaker, min_deadline_ms=resilience.RETRIEVE_MIN_DEADLINE_MS),
+                resilience.CallPolicy('translate_text', resilience.TRANSLATE_DEADLINE_MS, hedge=True))
+    return (resilience.CallPolicy('retrieve', 600000, max_attempts=1),
+            resilience.CallPolicy('translate_text', 600000, max_attempts=1))
+
+# Runs requests on a few worker threads, returns the latency of each successful request and the failure count
+def run_concurrently(requests, fn):
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+    pending = list(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                i = pending.pop(0)
+            latency = fn(i)
+            with lock:
+                if latency is None:
+                    failures[0] += 1
+                else:
+                    latencies.append(latency)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures[0]
+
+def run_web(index, resilience, faults, enabled, requests):
+    gateway = FakeGateway()
+    index._clients.update(agent=FakeAgent(latency=0.12), gateway=gateway)
+    index.BEDROCK_ROUTER.clients[index.BEDROCK_REGION] = FakeBedrockRuntime(first_token_latency=0.05)
+    index.RETRIEVE_CALLS, _ = policies(resilience, enabled)
+    index.RETRIEVAL_CACHE.invalidate()
+    run_id = f"{'on' if enabled else 'off'}-{id(faults)}"
+
+    def request(i):
+        connection_id = f"{run_id}-{i}"
+        started = time.perf_counter()
+        try:
+            index.lambda_handler({"connectionId": connection_id, "prompt": f"What is the Cloud Innovation Center? ({run_id} {i})", "language": "en"}, None)
+        except Exception:
+            return None
+        return gateway.first_delta[connection_id] - started if connection_id in gateway.first_delta else None
+
+    run_concurrently(WARMUP, lambda i: request(f"warmup-{i}"))
+    warm = index.RETRIEVE_CALLS.stats()
+    agent = FaultInjector(FakeAgent(latency=0.12), "retrieve", seed=5, **faults)
+    index._clients.update(agent=agent)
+    latencies, failures = run_concurrently(requests, request)
+    return latencies, failures, agent.client.calls, since(index.RETRIEVE_CALLS.stats(), warm)
+
+def run_translate(handler, resilience, enabled, requests):
+    handler.translate_client = FakeTranslate(latency=0.06)
+    _, handler.TRANSLATE_CALLS = policies(resilience, enabled)
+
+    def request(i):
+        started = time.perf_counter()
+        try:
+            handler.translate_prompt(f"Where is the Cloud Innovation Center located? ({enabled}-{i})", "es")
+        except Exception:
+            return None
+        return time.perf_counter() - started
+
+    run_concurrently(WARMUP, lambda i: request(f"warmup-{i}"))
+    warm = handler.TRANSLATE_CALLS.stats()
+    handler.translate_client = FaultInjector(FakeTranslate(latency=0.06), "translate_text", slow_rate=0.05, slow_seconds=1.5, seed=9)
+    latencies, failures = run_concurrently(requests, request)
+    return latencies, failures, handler.translate_client.client.calls, since(handler.TRANSLATE_CALLS.stats(), warm)
+
+# Function to leave the warm-up calls out of the policy counters
+def since(stats, warm):
+    return {name: value - warm[name] if name in warm and name not in ('breaker', 'deadline_ms') and isinstance(value, int) else value
+            for name, value in stats.items()}
+
+def report(name, mode, latencies, failures, calls, stats):
+    ms = [latency * 1000 for latency in latencies]
+    extra = f"retries {stats['retries']}, hedged {stats['hedged']} (won {stats['hedge_wins']}), deadline {stats['deadline_exceeded']}, " \
+            f"short-circuited {stats['short_circuited']}, deadline now {stats['deadline_ms']} ms"
+    without_kb = stats['failures'] + stats['deadline_exceeded'] + stats['short_circuited']
+    print(f"{name:<20}{mode:<9}{len(latencies):>6}{failures:>7}{without_kb:>7}{percentile(ms, 50):>9.0f}{percentile(ms, 95):>9.0f}{percentile(ms, 99):>9.0f}{calls:>7}  {extra}")
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    index = load_lambda("get-response-from-bedrock", ENV)
+    handler = load_lambda("web-socket-handler", ENV)
+    import resilience
+    print(f"{requests} requests per run, {WORKERS} at a time, latencies in ms")
+    print(f"{'scenario':<20}{'mode':<9}{'ok':>6}{'failed':>7}{'no KB':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'calls':>7}")
+    for name, faults in SCENARIOS:
+        for enabled in (False, True):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_web(index, resilience, faults, enabled, requests)
+            report(name, "with" if enabled else "without", *result)
+    for enabled in (False, True):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_translate(handler, resilience, enabled, requests)
+        report("translate slow tail", "with" if enabled else "without", *result)
+
+if __name__ == "__main__":
+    main()
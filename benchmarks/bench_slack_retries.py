@@ -0,0 +1,88 @@
+# Replays Slack deliveries with retries and duplicates through horizon-slackbot-opener and horizon-slackbot,
+# with and without the event de-duplication, and counts the work each mention caused.
+# A share of the mentions is redelivered by Slack with X-Slack-Retry-Num 1 to 3 (as when the opener answers
+# late), another share arrives twice without a retry header. Both Lambdas share one event store, like the
+# DynamoDB table in the deployed stack. The "processor only" row shows the second check on its own, as when
+# the opener's claim is missed.
+# Usage: python benchmarks/bench_slack_retries.py [mentions]
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+import types
+
+from stubs import FakeAgent, FakeBedrockRuntime, FakeLambdaClient, FakeSlackClient, load_lambda
+
+ENV = {
+    "ASANA_PAT": "test",
+    "SLACK_BOT_TOKEN": "xoxb-test",
+    "SLACK_BOT_USER_ID": "UHORIZON",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "PROCESSING_LAMBDA_ARN": "horizon-slackbot",
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+RETRY_RATE = 0.3
+DUPLICATE_RATE = 0.1
+
+# Store that never remembers an event, every delivery is processed as before the de-duplication
+class ForgetfulStore:
+    def put_if_absent(self, key, value, ttl_seconds=None):
+        return True
+
+    def delete(self, key):
+        pass
+
+def deliveries(mentions, rng):
+    sent = []
+    for i in range(mentions):
+        body = {"type": "event_callback", "event_id": f"Ev{i:04d}", "event": {
+            "type": "app_mention", "channel": "C1", "user": "U1", "ts": f"{1700000000 + i}.000100",
+            "text": f"<@UHORIZON> What projects has the CIC worked on? ({i})"}}
+        sent.append((body, {}))
+        if rng.random() < RETRY_RATE:
+            sent.extend((body, {"X-Slack-Retry-Num": str(n), "X-Slack-Retry-Reason": "http_timeout"}) for n in range(1, rng.randint(1, 3) + 1))
+        elif rng.random() < DUPLICATE_RATE / (1 - RETRY_RATE):
+            sent.append((body, {}))
+    return sent
+
+# opener_dedup / processor_dedup turn the check of each stage on or off
+def run(opener, processor, sent, opener_dedup, processor_dedup):
+    from event_dedup import EventDeduplicator
+    from ttl_store import InMemoryStore
+    store = InMemoryStore()
+    opener.SLACK_EVENTS = EventDeduplicator(store if opener_dedup else ForgetfulStore())
+    processor.SLACK_EVENTS = EventDeduplicator(store if processor_dedup else ForgetfulStore())
+    processor.RETRIEVAL_CACHE.invalidate()
+    slack, bedrock, agent = FakeSlackClient(), FakeBedrockRuntime(), FakeAgent()
+    processor.slack_client = slack
+    processor.boto3 = types.SimpleNamespace(client=lambda service_name=None, **kwargs: bedrock if service_name == "bedrock-runtime" else agent)
+    processor.BEDROCK_ROUTER.clients.clear()
+    lambda_client = FakeLambdaClient({"horizon-slackbot": processor.lambda_handler})
+    opener.lambda_client = lambda_client
+    invokes = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for body, headers in sent:
+            response = opener.lambda_handler({"headers": headers, "body": json.dumps(body)}, None)
+            assert response["statusCode"] == 200
+            invokes += response.get("headers") is None
+        while len(lambda_client.durations) < invokes:
+            time.sleep(0.01)
+    return {"processor runs": len(lambda_client.durations), "model calls": bedrock.calls, "retrievals": agent.calls,
+            "slack messages": slack.calls["chat_postMessage"], "suppressed": opener.SLACK_EVENTS.stats()["suppressed"] + processor.SLACK_EVENTS.stats()["suppressed"]}
+
+def main():
+    mentions = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    opener = load_lambda("horizon-slackbot-opener", ENV)
+    processor = load_lambda("horizon-slackbot", ENV)
+    sent = deliveries(mentions, random.Random(3))
+    print(f"{mentions} mentions, {len(sent)} deliveries ({len(sent) - mentions} retries or duplicates)")
+    columns = ("processor runs", "model calls", "retrievals", "slack messages", "suppressed")
+    print(f"{'':<16}" + "".join(f"{name:>16}" for name in columns))
+    for name, opener_dedup, processor_dedup in (("without dedup", False, False), ("processor only", False, True), ("with dedup", True, True)):
+        counts = run(opener, processor, sent, opener_dedup, processor_dedup)
+        print(f"{name:<16}" + "".join(f"{counts[column]:>16}" for column in columns))
+
+if __name__ == "__main__":
+    main()
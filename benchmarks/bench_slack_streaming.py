@@ -0,0 +1,76 @@
+# Time to first visible text of Slack bot answers, blocking invoke_model against streamed replies.
+# The processor runs against a fake Slack API (a round trip of varying length per call, Slack seeing the call half way
+# through, chat.update refused with a 429 when the same message is edited more than once a second) and a fake Bedrock model generating tokens at a fixed rate.
+# Reported per mode: when the placeholder showed, when answer text first showed and when the full answer landed,
+# measured from the start of the event, plus the number of Slack calls and rate limited updates.
+# The 500 ms mode edits faster than the fake Slack allows, its 429s show the Retry-After backoff.
+# Usage: python benchmarks/bench_slack_streaming.py [questions]
+import contextlib
+import functools
+import io
+import sys
+import time
+import types
+
+from stubs import FakeAgent, FakeBedrockRuntime, FakeSlackClient, load_lambda
+
+ENV = {
+    "ASANA_PAT": "test",
+    "SLACK_BOT_TOKEN": "xoxb-test",
+    "SLACK_BOT_USER_ID": "UHORIZON",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+QUESTIONS = [
+    "What is the CIC?",
+    "What projects has the Cloud Innovation Center worked on with public sector partners?",
+    "How do students join the CIC and what do they work on?",
+]
+MODES = [("blocking", False, None), ("streaming 1000ms", True, 1000), ("streaming 500ms", True, 500)]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def run(index, streaming, interval_ms, questions):
+    from slack_stream import SLACK_PLACEHOLDER_TEXT, SlackMessageStream
+    placeholder, first_text, complete = [], [], []
+    slack = None
+    totals = {"chat_postMessage": 0, "chat_update": 0, "rate_limited": 0}
+    for i in range(questions):
+        slack = FakeSlackClient(post_latency=0.05, min_update_interval=1.0, latency_jitter=0.15, seed=i)
+        bedrock = FakeBedrockRuntime(tokens_per_second=60, first_token_latency=0.4)
+        agent = FakeAgent(latency=0.15)
+        index.slack_client = slack
+        index.boto3 = types.SimpleNamespace(client=lambda service_name=None, **kwargs: bedrock if service_name == "bedrock-runtime" else agent)
+        index.BEDROCK_ROUTER.clients.clear()
+        index.SLACK_STREAMING_ENABLED = streaming
+        if interval_ms:
+            index.SlackMessageStream = functools.partial(SlackMessageStream, interval_ms=interval_ms)
+        question = QUESTIONS[i % len(QUESTIONS)]
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.process_slack_event({"event": {"channel": "C1", "user": "U1", "text": f"<@UHORIZON> {question}"}})
+        history = slack.history
+        if streaming:
+            placeholder.append(history[0][0] - started)
+        first_text.append(slack.first_visible((SLACK_PLACEHOLDER_TEXT,)) - started)
+        complete.append(history[-1][0] - started)
+        assert history[-1][2].strip() == bedrock.text.strip(), "the final message is not the complete answer"
+        for name in totals:
+            totals[name] += slack.calls[name]
+    return placeholder, first_text, complete, totals
+
+def main():
+    questions = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    index = load_lambda("horizon-slackbot", ENV)
+    print(f"{questions} questions, 60 tokens/s, 400 ms to first token, 50 to 200 ms per Slack call, 1 update/s per message")
+    print(f"{'mode':<18}{'placeholder p50':>16}{'first text p50':>16}{'first text p95':>16}{'complete p50':>14}{'posts':>7}{'updates':>9}{'429s':>6}")
+    for name, streaming, interval_ms in MODES:
+        placeholder, first_text, complete, totals = run(index, streaming, interval_ms, questions)
+        shown = f"{percentile(placeholder, 50) * 1000:.0f} ms" if placeholder else "-"
+        print(f"{name:<18}{shown:>16}{percentile(first_text, 50) * 1000:>13.0f} ms{percentile(first_text, 95) * 1000:>13.0f} ms"
+              f"{percentile(complete, 50) * 1000:>11.0f} ms{totals['chat_postMessage']:>7}{totals['chat_update']:>9}{totals['rate_limited']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Benchmark for delta coalescing in streamResponseToAPI
+# Compares one post per token against the coalesced stream using a stubbed management API
+# Also measures how long buffered text waits when the model stalls mid-answer: the background sender posts it
+# once the flush interval has passed, an inline sender only when the next delta arrives
+# Usage: python benchmarks/bench_stream_coalescing.py [post_latency_ms] [answers]
+import contextlib
+import io
+import json
+import sys
+import time
+
+from stubs import FakeGateway, bedrock_stream, frame_text, load_lambda, SAMPLE_ANSWER
+
+# The model pauses after this token, long enough for buffered text to go stale
+STALL_AFTER_TOKEN = 20
+STALL_SECONDS = 1.0
+TOKEN_DELAY = 0.02  # 50 tokens per second before and after the stall
+
+def run(index, post_latency, answers, flush_bytes):
+    index.STREAM_FLUSH_BYTES = flush_bytes
+    posts = 0
+    started = time.perf_counter()
+    for i in range(answers):
+        gateway = FakeGateway(post_latency=post_latency)
+        with contextlib.redirect_stdout(io.StringIO()):
+            index.streamResponseToAPI(bedrock_stream(SAMPLE_ANSWER * 3), f"conn-{i}", gateway=gateway, sender_mode="inline")
+        assert gateway.text_for(f"conn-{i}") == SAMPLE_ANSWER * 3
+        posts += len(gateway.frames)
+    elapsed = time.perf_counter() - started
+    return posts / answers, elapsed / answers
+
+# Returns how long the text of the token before the stall waited before it reached the client, in ms
+def stalled_wait(index, sender_mode):
+    gateway = FakeGateway()
+    produced = {}
+    arrived = {}
+    seen = []
+    post = gateway.post_to_connection
+
+    def record(ConnectionId, Data):
+        result = post(ConnectionId, Data)
+        seen.append(frame_text(json.loads(Data)) or "")
+        if "stalled" in produced and "stalled" not in arrived and len("".join(seen)) >= produced["chars"]:
+            arrived["stalled"] = time.perf_counter()
+        return result
+    gateway.post_to_connection = record
+
+    tokens = []
+    def on_token():
+        tokens.append(None)
+        if len(tokens) == STALL_AFTER_TOKEN + 1:
+            time.sleep(STALL_SECONDS)
+
+    def marked_stream():
+        for event in bedrock_stream(SAMPLE_ANSWER, token_delay=TOKEN_DELAY, on_token=on_token)["body"]:
+            chunk = json.loads(event["chunk"]["bytes"].decode("utf-8"))
+            if chunk["type"] == "content_block_delta" and len(tokens) == STALL_AFTER_TOKEN:
+                produced["chars"] = len(SAMPLE_ANSWER[:STALL_AFTER_TOKEN * 4])
+                produced["stalled"] = time.perf_counter()
+            yield event
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        index.streamResponseToAPI({"body": marked_stream()}, "conn-stall", gateway=gateway, sender_mode=sender_mode)
+    assert gateway.text_for("conn-stall") == SAMPLE_ANSWER
+    return (arrived["stalled"] - produced["stalled"]) * 1000
+
+def main():
+    post_latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 15.0) / 1000.0
+    answers = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    index = load_lambda("get-response-from-bedrock", {"URL": "https://example.invalid/production"})
+
+    print(f"Stubbed post latency: {post_latency * 1000:.1f} ms, answers: {answers}")
+    print(f"{'mode':<22}{'posts/answer':>14}{'wall ms/answer':>16}")
+    for mode, flush_bytes in (("per token", 1), ("coalesced (default)", index.STREAM_FLUSH_BYTES)):
+        posts, wall = run(index, post_latency, answers, flush_bytes)
+        print(f"{mode:<22}{posts:>14.1f}{wall * 1000:>16.1f}")
+
+    print(f"\nModel stall of {STALL_SECONDS * 1000:.0f} ms after token {STALL_AFTER_TOKEN}, flush interval {index.STREAM_FLUSH_INTERVAL_MS} ms")
+    print(f"{'sender':<22}{'buffered text waited ms':>24}")
+    for sender_mode in ("inline", "background"):
+        print(f"{sender_mode:<22}{stalled_wait(index, sender_mode):>24.1f}")
+
+if __name__ == "__main__":
+    main()
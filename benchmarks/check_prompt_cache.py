@@ -0,0 +1,106 @@
+# Check of the Bedrock prompt caching layout in both Lambdas, run against a recording Bedrock stub that, like
+# Bedrock, only caches prefixes of at least the model's minimum length.
+# Sends questions in several languages through the web handler and the Slack bot, fails if the static system
+# block differs between requests of the same Lambda (it could never be cached), reports whether it is long enough
+# to carry the cache_control marker, and the cache read/write token counts each Lambda read back from the usage.
+# Usage: python benchmarks/check_prompt_cache.py
+import contextlib
+import hashlib
+import io
+import json
+import types
+
+from stubs import CachingBedrockRuntime, FakeAgent, FakeGateway, FakeSlackClient, load_lambda
+
+WEB_ENV = {
+    "URL": "https://example.invalid/production",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "ANSWER_CACHE_ENABLED": "false",
+}
+SLACK_ENV = {
+    "ASANA_PAT": "test",
+    "SLACK_BOT_TOKEN": "xoxb-test",
+    "SLACK_BOT_USER_ID": "UHORIZON",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+}
+WEB_QUESTIONS = [
+    ("en", "What is the Cloud Innovation Center?"),
+    ("es", "¿Qué proyectos hace el Cloud Innovation Center?"),
+    ("ja", "クラウドイノベーションセンターとは何ですか?"),
+    ("en", "How can I work with the CIC?"),
+]
+SLACK_QUESTIONS = [
+    "What is the CIC?",
+    "What projects has the CIC worked on?",
+    "How do students join the CIC?",
+]
+
+# Reads the token counts the web Lambda emitted in its EMF record
+def emitted_usage(output):
+    for line in output.splitlines():
+        if line.startswith("{") and '"_aws"' in line:
+            record = json.loads(line)
+            return {name: record.get(name, 0) for name in ("CacheReadInputTokens", "CacheWriteInputTokens", "InputTokens")}
+    return {}
+
+# Reads the token counts the Slack bot logged for its model call
+def logged_usage(output):
+    for line in output.splitlines():
+        if line.startswith("Model token usage: "):
+            tokens = json.loads(line[len("Model token usage: "):])
+            return {"CacheReadInputTokens": tokens["cache_read_input_tokens"],
+                    "CacheWriteInputTokens": tokens["cache_creation_input_tokens"],
+                    "InputTokens": tokens["input_tokens"]}
+    return {}
+
+def run_web():
+    index = load_lambda("get-response-from-bedrock", WEB_ENV)
+    bedrock = CachingBedrockRuntime()
+    index._clients.update(agent=FakeAgent(), gateway=FakeGateway())
+    index.BEDROCK_ROUTER.clients[index.BEDROCK_REGION] = bedrock
+    rows = []
+    for i, (language, question) in enumerate(WEB_QUESTIONS):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            index.lambda_handler({"connectionId": f"conn-{i}", "prompt": question, "language": language, "requestId": f"req-{i}"}, None)
+        rows.append((f"{language}: {question}", emitted_usage(output.getvalue())))
+    return bedrock, rows
+
+def run_slack():
+    index = load_lambda("horizon-slackbot", SLACK_ENV)
+    bedrock = CachingBedrockRuntime()
+    agent = FakeAgent()
+    index.slack_client = FakeSlackClient()
+    index.boto3 = types.SimpleNamespace(client=lambda service_name=None, **kwargs: bedrock if service_name == "bedrock-runtime" else agent)
+    rows = []
+    for question in SLACK_QUESTIONS:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            index.process_slack_event({"event": {"channel": "C1", "user": "U1", "text": f"<@UHORIZON> {question}"}})
+        rows.append((question, logged_usage(output.getvalue())))
+    return bedrock, rows
+
+def report(name, bedrock, rows):
+    # importable once load_lambda has put the shared layer on the path
+    from bedrock_request import PROMPT_CACHE_MIN_TOKENS, cached_prefix
+    from context_assembler import estimate_tokens
+    static = [json.loads(kwargs["body"])["system"][0]["text"].encode("utf-8") for kwargs in bedrock.requests]
+    assert static, f"{name}: no model requests"
+    assert len(set(static)) == 1, f"{name}: static system block differs between requests"
+    marked = sum(1 for kwargs in bedrock.requests if cached_prefix(kwargs))
+    tokens = estimate_tokens(static[0].decode("utf-8"))
+    print(f"{name}: {len(static)} requests, static block identical (~{tokens} tokens, sha256 {hashlib.sha256(static[0]).hexdigest()[:12]}), "
+          f"{marked} sent with the cache marker")
+    if tokens < PROMPT_CACHE_MIN_TOKENS:
+        print(f"  note: below the {PROMPT_CACHE_MIN_TOKENS} token minimum of PROMPT_CACHE_MIN_TOKENS, the prompt is not cached and no marker is sent")
+    print(f"  {'request':<52}{'cache read':>12}{'cache write':>13}{'uncached in':>13}")
+    for label, usage in rows:
+        print(f"  {label[:50]:<52}{usage.get('CacheReadInputTokens', 0):>12}{usage.get('CacheWriteInputTokens', 0):>13}{usage.get('InputTokens', 0):>13}")
+
+def main():
+    report("get-response-from-bedrock", *run_web())
+    report("horizon-slackbot", *run_slack())
+
+if __name__ == "__main__":
+    main()
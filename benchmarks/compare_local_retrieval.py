@@ -0,0 +1,104 @@
+# Recall and latency of the local knowledge base index compared with recorded Bedrock knowledge base results.
+# record: runs each question (one per line) through agent.retrieve and saves results and latency as JSON lines.
+# compare: runs the recorded questions through the local index and reports recall@k against the recorded
+# results, local vs recorded latency, and for several confidence thresholds how many questions the index
+# would answer itself and with what recall. Chunking differs between the two, so a recorded chunk counts as
+# found when a local result contains most of its word 3-grams (or the other way round).
+# Usage: python benchmarks/compare_local_retrieval.py record questions.txt recorded.jsonl --kb-id KB123
+#        python benchmarks/compare_local_retrieval.py compare recorded.jsonl [--index lambda/shared/python/kb_index.bin]
+import argparse
+import json
+import os
+import sys
+import time
+
+from stubs import SHARED_LAYER
+
+sys.path.insert(0, SHARED_LAYER)
+
+from context_assembler import shingles
+from local_index import LOCAL_INDEX_PATH, LocalIndex
+
+THRESHOLDS = (0.5, 0.6, 0.75, 0.9)
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def record(args):
+    import boto3
+    agent = boto3.client("bedrock-agent-runtime")
+    with open(args.questions, encoding="utf-8") as questions, open(args.output, "w", encoding="utf-8") as output:
+        for question in filter(None, (line.strip() for line in questions)):
+            started = time.perf_counter()
+            response = agent.retrieve(knowledgeBaseId=args.kb_id, retrievalQuery={"text": question})
+            latency_ms = (time.perf_counter() - started) * 1000
+            results = [{"text": result["content"]["text"], "score": result.get("score")} for result in response["retrievalResults"]]
+            output.write(json.dumps({"query": question, "latency_ms": round(latency_ms, 1), "results": results}) + "\n")
+            print(f"{latency_ms:8.1f} ms  {question}")
+
+# True when two chunks share most of the word 3-grams of the shorter one
+def same_passage(a, b, threshold):
+    if not a or not b:
+        return False
+    return len(a & b) >= threshold * min(len(a), len(b))
+
+def recall(expected, found, threshold):
+    if not expected:
+        return 1.0
+    return sum(1 for chunk in expected if any(same_passage(chunk, other, threshold) for other in found)) / len(expected)
+
+def compare(args):
+    index = LocalIndex(args.index)
+    with open(args.recorded, encoding="utf-8") as recorded:
+        entries = [json.loads(line) for line in recorded if line.strip()]
+
+    rows = []
+    for entry in entries:
+        expected = [shingles(result["text"]) for result in entry["results"][:args.k] if (result.get("score") or 0) >= args.min_score]
+        started = time.perf_counter()
+        results, confidence = index.search(entry["query"], limit=args.k)
+        local_ms = (time.perf_counter() - started) * 1000
+        found = [shingles(result["content"]["text"]) for result in results]
+        rows.append({"query": entry["query"], "recall": recall(expected, found, args.match), "confidence": confidence,
+                     "local_ms": local_ms, "bedrock_ms": entry.get("latency_ms", 0.0)})
+
+    local_ms = [row["local_ms"] for row in rows]
+    bedrock_ms = [row["bedrock_ms"] for row in rows]
+    print(f"{len(rows)} questions, recall@{args.k} over all questions: {sum(row['recall'] for row in rows) / len(rows):.2f}")
+    print(f"latency ms        p50       p95")
+    print(f"local index  {percentile(local_ms, 50):8.2f}  {percentile(local_ms, 95):8.2f}")
+    print(f"bedrock      {percentile(bedrock_ms, 50):8.2f}  {percentile(bedrock_ms, 95):8.2f}")
+    print(f"{'min confidence':>15}{'answered locally':>18}{'recall (local)':>16}")
+    for threshold in THRESHOLDS:
+        local = [row for row in rows if row["confidence"] >= threshold]
+        local_recall = sum(row["recall"] for row in local) / len(local) if local else 0.0
+        print(f"{threshold:>15.2f}{len(local) / len(rows):>17.0%}{local_recall:>16.2f}")
+    if args.verbose:
+        for row in sorted(rows, key=lambda row: row["recall"]):
+            print(f"  recall {row['recall']:.2f}  confidence {row['confidence']:.2f}  {row['query']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the local knowledge base index with Bedrock retrieve")
+    commands = parser.add_subparsers(dest="command", required=True)
+    recorder = commands.add_parser("record", help="record agent.retrieve results for a list of questions")
+    recorder.add_argument("questions")
+    recorder.add_argument("output")
+    recorder.add_argument("--kb-id", default=os.environ.get("KNOWLEDGE_BASE_ID"), required="KNOWLEDGE_BASE_ID" not in os.environ)
+    comparer = commands.add_parser("compare", help="compare the local index with recorded results")
+    comparer.add_argument("recorded")
+    comparer.add_argument("--index", default=LOCAL_INDEX_PATH)
+    comparer.add_argument("--k", type=int, default=5, help="number of results compared per question")
+    comparer.add_argument("--min-score", type=float, default=0.0, help="ignore recorded results scoring below this")
+    comparer.add_argument("--match", type=float, default=0.5, help="share of shared 3-grams for two chunks to be the same passage")
+    comparer.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        compare(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# Local end-to-end load test of the web chat pipeline: web-socket-handler -> get-response-from-bedrock.
+# Both lambda_handlers run in-process against local fakes for Translate, the knowledge base, Bedrock
+# streaming and the API Gateway management API, driven by concurrent simulated websocket users.
+# Reports time-to-first-token, total latency percentiles, frames per answer and Lambda-seconds per answer.
+# With --disconnect-rate some users close their connection mid-request, to count the model work saved.
+# With --bedrock-concurrency the fake model throttles calls beyond that many open streams, to compare
+# admission control (--no-admission turns it off) with letting every request hit the model.
+# Usage: python benchmarks/load_test.py --users 20 --messages 5 --json results.json
+import argparse
+import contextlib
+import io
+import json
+import random
+import threading
+import time
+
+from stubs import FakeAgent, FakeBedrockRuntime, FakeGateway, FakeLambdaClient, FakeTranslate, frame_type, load_lambda
+
+RESPONSE_FUNCTION_ARN = "arn:aws:lambda:us-west-2:000000000000:function:get-response-from-bedrock"
+ENV = {
+    "URL": "https://example.invalid/production",
+    "KNOWLEDGE_BASE_ID": "KB00000000",
+    "RESPONSE_FUNCTION_ARN": RESPONSE_FUNCTION_ARN,
+    "AWS_DEFAULT_REGION": "us-west-2",
+}
+FAQS = [
+    "What is the Cloud Innovation Center?",
+    "What did the Cloud Innovation Center do for the Phoenix Zoo?",
+    "How can I work with the Cloud Innovation Center?",
+    "Who works at the Cloud Innovation Center?",
+    "What projects does the Cloud Innovation Center work on?",
+]
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+# Builds both Lambda modules and wires them to the fakes
+def build_pipeline(args):
+    env = dict(ENV)
+    if args.no_answer_cache:
+        env["ANSWER_CACHE_ENABLED"] = "false"
+    if args.no_coalescing:
+        env["REQUEST_COALESCING_ENABLED"] = "false"
+    env["ADMISSION_CONTROL_ENABLED"] = "false" if args.no_admission else "true"
+    env["ADMISSION_GLOBAL_RATE"] = str(args.admission_rate)
+    env["ADMISSION_GLOBAL_BURST"] = str(args.admission_burst)
+    env["ADMISSION_QUEUE_SIZE"] = str(args.queue_size)
+    env["ADMISSION_MAX_WAIT_MS"] = str(args.max_wait_ms)
+    web_socket_handler = load_lambda("web-socket-handler", env)
+    response_lambda = load_lambda("get-response-from-bedrock", env)
+
+    fakes = {
+        "gateway": FakeGateway(post_latency=args.post_latency_ms / 1000.0),
+        "agent": FakeAgent(latency=args.retrieve_ms / 1000.0),
+        "bedrock": FakeBedrockRuntime(tokens_per_second=args.token_rate, first_token_latency=args.first_token_ms / 1000.0,
+                                      max_concurrency=args.bedrock_concurrency),
+        "translate": FakeTranslate(latency=args.translate_ms / 1000.0),
+        "lambda": FakeLambdaClient({RESPONSE_FUNCTION_ARN: response_lambda.lambda_handler}),
+    }
+    response_lambda._clients.update(agent=fakes["agent"], gateway=fakes["gateway"])
+    response_lambda.BEDROCK_ROUTER.clients[response_lambda.BEDROCK_REGION] = fakes["bedrock"]
+    web_socket_handler.translate_client = fakes["translate"]
+    web_socket_handler.lambda_client = fakes["lambda"]
+    # Both Lambdas read the same connection registry, like the shared DynamoDB table in the stack
+    response_lambda.CONNECTIONS.store = web_socket_handler.connection_registry.store
+    fakes["response_lambda"] = response_lambda
+    return web_socket_handler, fakes
+
+# Closes a connection like a user leaving the page: API Gateway runs $disconnect and further posts fail
+def disconnect_later(connection_id, delay, web_socket_handler, fakes):
+    def run():
+        time.sleep(delay)
+        fakes["gateway"].gone_connections.add(connection_id)
+        web_socket_handler.lambda_handler({"requestContext": {"routeKey": "$disconnect", "connectionId": connection_id}}, None)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+# One simulated user: opens a connection per message like the frontend and waits for the answer
+def simulate_user(user, args, web_socket_handler, fakes, results, rng):
+    for message in range(args.messages):
+        connection_id = f"user{user}-msg{message}"
+        prompt = rng.choice(FAQS)
+        if args.unique_prompts:
+            prompt = f"{prompt} ({user}-{message})"
+        if rng.random() < args.gone_rate:
+            fakes["gateway"].gone_connections.add(connection_id)
+        web_socket_handler.lambda_handler({"requestContext": {"routeKey": "$connect", "connectionId": connection_id}}, None)
+        leaving = None
+        if rng.random() < args.disconnect_rate:
+            leaving = disconnect_later(connection_id, rng.uniform(0, args.disconnect_within_ms) / 1000.0, web_socket_handler, fakes)
+
+        started = time.perf_counter()
+        handler_started = time.perf_counter()
+        # Like the frontend, every message of a user carries the same chat session ID
+        body = {"action": "sendMessage", "prompt": prompt, "language": args.language, "sessionId": f"session-user{user}"}
+        if args.protocol != 1:
+            body["protocol"] = args.protocol
+        web_socket_handler.lambda_handler({
+            "requestContext": {"routeKey": "sendMessage", "connectionId": connection_id},
+            "body": json.dumps(body),
+        }, None)
+        handler_seconds = time.perf_counter() - handler_started
+
+        done = fakes["lambda"].done.setdefault(connection_id, threading.Event())
+        done.wait(args.timeout)
+        if leaving:
+            leaving.join()
+        # A request that joined an identical one returns straight away, its answer comes from the other invocation
+        gateway = fakes["gateway"]
+        while connection_id not in gateway.ended and connection_id not in gateway.gone_connections and time.perf_counter() - started < args.timeout:
+            time.sleep(0.005)
+        frames, frame_bytes = gateway.volume_for(connection_id)
+        sent = gateway.frames_for(connection_id)
+        results.append({
+            "busy": gateway.text_for(connection_id) in fakes["response_lambda"].BUSY_REPLIES.values(),
+            "queued": any(frame_type(frame) == "queued" for frame in sent),
+            "ttft": gateway.first_delta[connection_id] - started if connection_id in gateway.first_delta else None,
+            "total": gateway.ended[connection_id] - started if connection_id in gateway.ended else None,
+            "frames": frames,
+            "bytes": frame_bytes,
+            "handler_seconds": handler_seconds,
+        })
+        if args.think_ms:
+            time.sleep(args.think_ms / 1000.0)
+
+def run(args):
+    web_socket_handler, fakes = build_pipeline(args)
+    results = []
+    rng = random.Random(args.seed)
+    threads = [
+        threading.Thread(target=simulate_user, args=(user, args, web_socket_handler, fakes, results, random.Random(rng.random())))
+        for user in range(args.users)
+    ]
+    started = time.perf_counter()
+    # The Lambda functions log every request, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - started
+
+    answered = [result for result in results if result["total"] is not None and not result["busy"]]
+    ttft = [result["ttft"] * 1000 for result in answered]
+    total = [result["total"] * 1000 for result in answered]
+    lambda_seconds = sum(fakes["lambda"].durations) + sum(result["handler_seconds"] for result in results)
+    return {
+        "requests": len(results),
+        "answered": len(answered),
+        "busy_replies": sum(1 for result in results if result["busy"]),
+        "unanswered": sum(1 for result in results if result["total"] is None),
+        "queued": sum(1 for result in results if result["queued"]),
+        "throughput_per_s": round(len(answered) / wall, 2) if wall else 0.0,
+        "ttft_ms": {f"p{pct}": round(percentile(ttft, pct), 1) for pct in (50, 90, 99)},
+        "total_ms": {f"p{pct}": round(percentile(total, pct), 1) for pct in (50, 90, 99)},
+        "frames_per_answer": round(sum(r["frames"] for r in answered) / len(answered), 1) if answered else 0.0,
+        "bytes_per_answer": round(sum(r["bytes"] for r in answered) / len(answered), 1) if answered else 0.0,
+        "lambda_seconds_per_answer": round(lambda_seconds / len(answered), 3) if answered else 0.0,
+        "model_calls": fakes["bedrock"].calls,
+        "model_tokens": fakes["bedrock"].tokens,
+        "max_concurrent_model_streams": fakes["bedrock"].max_active,
+        "model_throttled": fakes["bedrock"].throttled,
+        "failed_invocations": fakes["lambda"].errors,
+        "admission": fakes["response_lambda"].ADMISSION.stats(),
+        "coalescing": dict(fakes["response_lambda"].COALESCER.stats),
+        "closed_connection_savings": dict(fakes["response_lambda"].SAVINGS),
+        "retrieve_calls": fakes["agent"].calls,
+        "translate_calls": fakes["translate"].calls,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated websocket users")
+    parser.add_argument("--messages", type=int, default=3, help="messages sent by each user")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="model tokens per second, 0 for no delay")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="model latency before the first chunk")
+    parser.add_argument("--post-latency-ms", type=float, default=15.0, help="latency of each post_to_connection")
+    parser.add_argument("--retrieve-ms", type=float, default=150.0, help="latency of knowledge base retrieve")
+    parser.add_argument("--translate-ms", type=float, default=60.0, help="latency of translate_text")
+    parser.add_argument("--gone-rate", type=float, default=0.0, help="share of connections that are closed by the client")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="share of users that close the page before the answer ends")
+    parser.add_argument("--disconnect-within-ms", type=float, default=1500.0, help="users that leave do so at a random time up to this")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause between messages of a user")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--unique-prompts", action="store_true", help="make every prompt unique to bypass the caches")
+    parser.add_argument("--no-answer-cache", action="store_true", help="disable the answer cache, e.g. to measure coalescing alone")
+    parser.add_argument("--no-coalescing", action="store_true", help="disable coalescing of identical concurrent questions")
+    parser.add_argument("--bedrock-concurrency", type=int, help="open model streams above which the fake model throttles")
+    parser.add_argument("--no-admission", action="store_true", help="disable admission control in front of the model")
+    parser.add_argument("--admission-rate", type=float, default=5.0, help="model calls admitted per second")
+    parser.add_argument("--admission-burst", type=float, default=10.0, help="model calls admitted at once after a quiet period")
+    parser.add_argument("--queue-size", type=int, default=50, help="requests that may wait for a model slot")
+    parser.add_argument("--max-wait-ms", type=int, default=10000, help="longest wait for a model slot")
+    parser.add_argument("--protocol", type=int, default=1, help="websocket frame protocol the simulated clients ask for")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the report to this file, for comparing commits")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"settings": vars(args), "report": report}, output, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+# Local stand-ins for the AWS services used by the Lambda functions, shared by the benchmark scripts
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_ROOT = os.path.join(REPO_ROOT, "lambda")
+SHARED_LAYER = os.path.join(LAMBDA_ROOT, "shared", "python")
+
+SAMPLE_ANSWER = (
+    "## The Cloud Innovation Center\n\n"
+    "The **ASU Cloud Innovation Center (CIC)** is a collaboration between Arizona State University and "
+    "Amazon Web Services. It brings students, staff and public sector partners together to solve real "
+    "problems with cloud technology.\n\n"
+    "Here is what the CIC does:\n"
+    "1. Runs rapid prototyping engagements with public sector organizations.\n"
+    "2. Gives students hands-on experience building on AWS.\n"
+    "3. Publishes the resulting solutions as open source on GitHub.\n\n"
+    "Would you like to know more about a specific project or how to get involved?"
+)
+
+# Function to load a Lambda's index.py under a unique module name (every Lambda uses the same file name)
+def load_lambda(name, env=None):
+    for key, value in (env or {}).items():
+        os.environ.setdefault(key, value)
+    lambda_dir = os.path.join(LAMBDA_ROOT, name)
+    # Lambda puts the shared layer on the path in /opt/python, mirror that locally
+    for path in (SHARED_LAYER, lambda_dir):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    module_name = name.replace("-", "_") + "_index"
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(lambda_dir, "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Function to split text into small pieces, roughly the size of model tokens
+def tokenize(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+# Function to build a fake invoke_model_with_response_stream response in the Claude event format
+# on_token is called for every generated token, so closing the stream early shows up as fewer tokens
+# usage replaces the token counts reported in the message_start event
+def bedrock_stream(text=SAMPLE_ANSWER, token_delay=0.0, token_size=4, on_token=None, usage=None):
+    def events():
+        yield {"type": "message_start", "message": {"usage": usage or {"input_tokens": 1200, "output_tokens": 1}}}
+        yield {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}
+        for token in tokenize(text, token_size):
+            if token_delay:
+                time.sleep(token_delay)
+            if on_token:
+                on_token()
+            yield {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}}
+        yield {"type": "content_block_stop", "index": 0}
+        yield {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(text) // 4}}
+        yield {"type": "message_stop"}
+
+    def body():
+        for event in events():
+            yield {"chunk": {"bytes": json.dumps(event).encode("utf-8")}}
+
+    return {"body": body()}
+
+class GoneException(Exception):
+    pass
+
+class _GatewayExceptions:
+    GoneException = GoneException
+
+# Frame types of the compact protocol (version 2)
+COMPACT_TYPES = {"d": "delta", "e": "end", "q": "queued"}
+
+# Function to read the frame type of a websocket frame, in either protocol
+def frame_type(frame):
+    return frame.get("type") or COMPACT_TYPES.get(frame.get("t"))
+
+# Function to read the text of a websocket frame, in either protocol
+def frame_text(frame):
+    return frame.get("text", frame.get("x", ""))
+
+# Fake apigatewaymanagementapi client that records frames and simulates the HTTPS round trip of each post
+class FakeGateway:
+    exceptions = _GatewayExceptions
+
+    def __init__(self, post_latency=0.0, gone_after=None, gone_connections=()):
+        self.post_latency = post_latency
+        self.gone_after = gone_after
+        self.gone_connections = set(gone_connections)
+        self.frames = []
+        self.first_delta = {}  # connection ID -> time the first delta frame arrived
+        self.ended = {}        # connection ID -> time the end frame arrived
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        if self.post_latency:
+            time.sleep(self.post_latency)
+        now = time.perf_counter()
+        with self.lock:
+            if ConnectionId in self.gone_connections or (self.gone_after is not None and len(self.frames) >= self.gone_after):
+                raise GoneException(ConnectionId)
+            self.frames.append((ConnectionId, Data))
+            kind = frame_type(json.loads(Data))
+            if kind == "delta":
+                self.first_delta.setdefault(ConnectionId, now)
+            elif kind == "end":
+                self.ended[ConnectionId] = now
+        return {}
+
+    # Returns the decoded frames sent to a connection
+    def frames_for(self, connection_id):
+        return [json.loads(data) for conn, data in self.frames if conn == connection_id]
+
+    # Returns the number of frames and bytes sent to a connection
+    def volume_for(self, connection_id):
+        sent = [data for conn, data in self.frames if conn == connection_id]
+        return len(sent), sum(len(data.encode("utf-8")) for data in sent)
+
+    # Returns the text the client would display for a connection
+    def text_for(self, connection_id):
+        return "".join(frame_text(frame) for frame in self.frames_for(connection_id) if frame_type(frame) == "delta")
+
+# Fake bedrock-runtime client streaming a canned answer at a configurable token rate
+# With max_concurrency, a call made while that many streams are open fails with a ThrottlingException
+class FakeBedrockRuntime:
+    def __init__(self, text=SAMPLE_ANSWER, tokens_per_second=0, first_token_latency=0.0, max_concurrency=None):
+        self.text = text
+        self.token_delay = 1.0 / tokens_per_second if tokens_per_second else 0.0
+        self.first_token_latency = first_token_latency
+        self.max_concurrency = max_concurrency
+        self.calls = 0
+        self.throttled = 0
+        self.tokens = 0
+        self.active = 0      # model streams currently open
+        self.max_active = 0  # highest number of model streams open at the same time
+        self.lock = threading.Lock()
+
+    def count_token(self):
+        with self.lock:
+            self.tokens += 1
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        from botocore.exceptions import ClientError
+        self.calls += 1
+        with self.lock:
+            if self.max_concurrency is not None and self.active >= self.max_concurrency:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "InvokeModelWithResponseStream")
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        stream = bedrock_stream(self.text, token_delay=self.token_delay, on_token=self.count_token)
+
+        def body():
+            try:
+                if self.first_token_latency:
+                    time.sleep(self.first_token_latency)
+                yield from stream["body"]
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        return {"body": body()}
+
+    # Blocking call, returns once the whole answer has been generated
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        tokens = tokenize(self.text)
+        time.sleep(self.first_token_latency + self.token_delay * len(tokens))
+        with self.lock:
+            self.tokens += len(tokens)
+        payload = json.dumps({"content": [{"type": "text", "text": self.text}],
+                              "usage": {"input_tokens": 1200, "output_tokens": len(self.text) // 4}}).encode("utf-8")
+        return {"body": io.BytesIO(payload)}
+
+# Fake bedrock-agent-runtime client returning fixed knowledge base chunks
+class FakeAgent:
+    def __init__(self, latency=0.0, results=None):
+        self.latency = latency
+        self.results = results if results is not None else [
+            {"content": {"text": "The ASU Cloud Innovation Center is a collaboration between ASU and AWS."}, "score": 0.72},
+            {"content": {"text": "The CIC runs rapid prototyping engagements with public sector organizations."}, "score": 0.61},
+        ]
+        self.calls = 0
+
+    def retrieve(self, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return {"retrievalResults": self.results}
+
+# Fake translate client, echoes the text back as if it was already in the target language
+class FakeTranslate:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def translate_text(self, Text, SourceLanguageCode, TargetLanguageCode):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return {"TranslatedText": Text, "SourceLanguageCode": TargetLanguageCode}
+
+# Fake lambda client, runs Event invocations of a handler on a background thread and records their duration
+class FakeLambdaClient:
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.durations = []
+        self.errors = 0  # invocations that raised, Lambda would report them as failed async invocations
+        self.done = {}  # connection ID -> event set when the invocation for it finished
+        self.lock = threading.Lock()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        done = self.done.setdefault(event.get("connectionId"), threading.Event())
+
+        def run():
+            started = time.perf_counter()
+            try:
+                self.handlers[FunctionName](event, None)
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+            finally:
+                with self.lock:
+                    self.durations.append(time.perf_counter() - started)
+                done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return {"StatusCode": 202}
+
+# Fake bedrock-runtime client that records every request and emulates Anthropic prompt caching:
+# the serialized system blocks up to the cache_control marker are the cache key, a request whose prefix was
+# seen before reports it as cache_read_input_tokens, otherwise as cache_creation_input_tokens. Like Bedrock,
+# prefixes shorter than min_tokens are processed without caching even when they carry the marker
+class CachingBedrockRuntime:
+    def __init__(self, text=SAMPLE_ANSWER, min_tokens=2048):
+        self.text = text
+        self.min_tokens = min_tokens
+        self.requests = []
+        self.cache = set()
+        self.lock = threading.Lock()
+
+    def usage_for(self, kwargs):
+        from bedrock_request import cached_prefix
+        prefix = cached_prefix(kwargs)
+        if len(prefix) // 4 < self.min_tokens:
+            prefix = b""
+        total = len(kwargs["body"]) // 4
+        cached = len(prefix) // 4
+        with self.lock:
+            self.requests.append(kwargs)
+            hit = prefix in self.cache
+            if prefix:
+                self.cache.add(prefix)
+        return {
+            "input_tokens": total - cached,
+            "cache_read_input_tokens": cached if hit else 0,
+            "cache_creation_input_tokens": 0 if hit else cached,
+            "output_tokens": 1,
+        }
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return bedrock_stream(self.text, usage=self.usage_for(kwargs))
+
+    def invoke_model(self, **kwargs):
+        usage = dict(self.usage_for(kwargs), output_tokens=len(self.text) // 4)
+        payload = json.dumps({"content": [{"type": "text", "text": self.text}], "usage": usage}).encode("utf-8")
+        return {"body": io.BytesIO(payload)}
+
+class _SlackResponse(dict):
+    def __init__(self, data, status_code=200, headers=None):
+        super().__init__(data)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+# Fake Slack WebClient that records when each text became visible in the channel, with an optional round trip per
+# call and an optional chat.update rate limit: updates of a message closer together than min_update_interval
+# seconds are refused with a 429 and a Retry-After header, like Slack does
+class FakeSlackClient:
+    def __init__(self, post_latency=0.0, min_update_interval=0.0, latency_jitter=0.0, seed=1):
+        self.post_latency = post_latency
+        self.min_update_interval = min_update_interval
+        self.latency_jitter = latency_jitter  # each call takes post_latency plus up to this much longer
+        self.rng = random.Random(seed)
+        self.texts = {}    # message ts -> text currently shown
+        self.history = []  # (time, ts, text) for every post and update Slack accepted
+        self.calls = {"chat_postMessage": 0, "chat_update": 0, "rate_limited": 0}
+        self.last_update = {}
+        self.lock = threading.Lock()
+
+    # Sleeps for the round trip of one call, Slack sees the call half way through
+    def round_trip(self):
+        latency = self.post_latency + self.rng.uniform(0, self.latency_jitter)
+        if latency:
+            time.sleep(latency / 2)
+        return latency / 2
+
+    def chat_postMessage(self, channel, text):
+        remaining = self.round_trip()
+        with self.lock:
+            self.calls["chat_postMessage"] += 1
+            ts = f"{len(self.texts) + 1}.000100"
+            self.texts[ts] = text
+            self.last_update[ts] = time.perf_counter()
+            self.history.append((time.perf_counter(), ts, text))
+        time.sleep(remaining)
+        return _SlackResponse({"ok": True, "channel": channel, "ts": ts})
+
+    def chat_update(self, channel, ts, text):
+        from slack_sdk.errors import SlackApiError
+        remaining = self.round_trip()
+        with self.lock:
+            self.calls["chat_update"] += 1
+            now = time.perf_counter()
+            wait = self.min_update_interval - (now - self.last_update.get(ts, 0.0))
+            if self.min_update_interval and wait > 0:
+                self.calls["rate_limited"] += 1
+                response = _SlackResponse({"ok": False, "error": "ratelimited"}, 429, {"Retry-After": str(max(1, round(wait)))})
+                time.sleep(remaining)
+                raise SlackApiError("ratelimited", response)
+            self.texts[ts] = text
+            self.last_update[ts] = now
+            self.history.append((now, ts, text))
+        time.sleep(remaining)
+        return _SlackResponse({"ok": True, "channel": channel, "ts": ts})
+
+    # Returns the time the first text that is not one of the placeholders became visible
+    def first_visible(self, placeholders=()):
+        return next((at for at, _, text in self.history if text not in placeholders), None)
+
+    # Returns the text the channel finally shows
+    def final_texts(self):
+        return list(self.texts.values())
+
+# Function to replace a model stream with one that fails before its first event, like a modelStreamErrorException
+def failing_stream(body, operation):
+    from botocore.exceptions import ClientError
+    events = iter(body)
+    next(events, None)  # the error arrives where the first event would have
+    if hasattr(events, "close"):
+        events.close()
+    raise ClientError({"Error": {"Code": "modelStreamErrorException", "Message": "Model stream error"}}, operation)
+    yield
+
+# Wraps a fake client and injects faults into one of its methods: a share of the calls is slow, throttled, fails
+# with a server error or (for a streaming method) returns a stream that fails before its first event.
+# Rates are checked in that order from one random draw per call, so they add up
+class FaultInjector:
+    def __init__(self, client, method, slow_rate=0.0, slow_seconds=2.0, throttle_rate=0.0, error_rate=0.0, stream_error_rate=0.0, seed=1):
+        self.client = client
+        self.method = method
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.rng = random.Random(seed)
+        self.injected = {"slow": 0, "throttled": 0, "errors": 0, "stream_errors": 0}
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name != self.method:
+            return attribute
+
+        def call(*args, **kwargs):
+            from botocore.exceptions import ClientError
+            with self.lock:
+                roll = self.rng.random()
+            if roll < self.slow_rate:
+                with self.lock:
+                    self.injected["slow"] += 1
+                time.sleep(self.slow_seconds)
+            elif roll < self.slow_rate + self.throttle_rate:
+                with self.lock:
+                    self.injected["throttled"] += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, name)
+            elif roll < self.slow_rate + self.throttle_rate + self.error_rate:
+                with self.lock:
+                    self.injected["errors"] += 1
+                time.sleep(self.slow_seconds)
+                raise ClientError({"Error": {"Code": "ServiceUnavailableException", "Message": "Service unavailable"}}, name)
+            elif roll < self.slow_rate + self.throttle_rate + self.error_rate + self.stream_error_rate:
+                with self.lock:
+                    self.injected["stream_errors"] += 1
+                response = attribute(*args, **kwargs)
+                return dict(response, body=failing_stream(response["body"], name))
+            return attribute(*args, **kwargs)
+
+        return call
+
+# Fake dynamodb client holding one table in memory, with the conditional writes DynamoDBStore uses.
+# Every call takes latency seconds, the condition is checked and applied atomically when the call lands
+class FakeDynamoDB:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.items = {}
+        self.calls = 0
+        self.conflicts = 0
+        self.lock = threading.Lock()
+
+    def round_trip(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        self.round_trip()
+        with self.lock:
+            item = self.items.get(Key["pk"]["S"])
+        return {"Item": dict(item)} if item else {}
+
+    # Checks the condition expressions written by DynamoDBStore
+    def check(self, item, condition, values):
+        if condition is None:
+            return True
+        if condition.startswith("attribute_not_exists(pk) OR"):
+            return item is None or int(item["expires_at"]["N"]) <= int(values[":now"]["N"])
+        if condition == "attribute_not_exists(pk)":
+            return item is None
+        if condition == "attribute_not_exists(version)":
+            return item is not None and "version" not in item
+        if condition == "version = :version":
+            return item is not None and item.get("version", {}).get("N") == values[":version"]["N"]
+        raise ValueError(f"Unsupported condition {condition}")
+
+    def write(self, key, new_item, ConditionExpression=None, ExpressionAttributeValues=None):
+        from botocore.exceptions import ClientError
+        self.round_trip()
+        with self.lock:
+            if not self.check(self.items.get(key), ConditionExpression, ExpressionAttributeValues or {}):
+                self.conflicts += 1
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}, "PutItem")
+            if new_item is None:
+                self.items.pop(key, None)
+            else:
+                self.items[key] = new_item
+
+    def put_item(self, TableName, Item, **condition):
+        self.write(Item["pk"]["S"], dict(Item), **condition)
+
+    def delete_item(self, TableName, Key, **condition):
+        self.write(Key["pk"]["S"], None, **condition)
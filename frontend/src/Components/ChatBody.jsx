@@ -18,6 +18,8 @@ function ChatBody() {
   const [questionAsked, setQuestionAsked] = useState(false); // state to track if a question was asked to remove the FAQs once done
   const messagesEndRef = useRef(null);
   const { language } = useLanguage();
+  // Every message opens its own WebSocket, the server keeps the conversation of this chat under its session ID
+  const sessionId = useRef(createSessionId());
 
   useEffect(() => {
     scrollToBottom();
@@ -63,7 +65,7 @@ function ChatBody() {
           </Box>
           {messageList.map((msg, index) => (
             <Box key={index} mb={2}>
-              {msg.sentBy === "USER" ? <UserReply message={msg.message} /> : msg.sentBy === "BOT" && msg.state === "PROCESSING" ? <StreamingResponse initialMessage={msg.message} setProcessing={setProcessing} language={language} /> : <BotFileCheckReply message={msg.message} fileName={msg.fileName} fileStatus={msg.fileStatus} messageType={msg.sentBy === "USER" ? "user_doc_upload" : "bot_response"} />}
+              {msg.sentBy === "USER" ? <UserReply message={msg.message} /> : msg.sentBy === "BOT" && msg.state === "PROCESSING" ? <StreamingResponse initialMessage={msg.message} setProcessing={setProcessing} language={language} sessionId={sessionId.current} /> : <BotFileCheckReply message={msg.message} fileName={msg.fileName} fileStatus={msg.fileStatus} messageType={msg.sentBy === "USER" ? "user_doc_upload" : "bot_response"} />}
             </Box>
           ))}
           <div ref={messagesEndRef} />
@@ -100,6 +102,15 @@ function UserReply({ message }) {
   );
 }
 
+// Random ID of a chat session, sent with every message of the chat
+const createSessionId = () => {
+  if (window.crypto && window.crypto.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (byte) => byte.toString(16).padStart(2, "0")).join("");
+};
+
 const getBotResponse = (setMessageList, setProcessing, message) => {
   const botMessageBlock = createMessageBlock(message, "BOT", "TEXT", "PROCESSING");
   setMessageList((prevList) => [...prevList, botMessageBlock]);
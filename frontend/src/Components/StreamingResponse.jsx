@@ -5,10 +5,11 @@ import { WEBSOCKET_API, ALLOW_MARKDOWN_BOT } from "../utilities/constants";
 import ReactMarkdown from "react-markdown";
 import { franc } from 'franc-min'; 
 
-const StreamingMessage = ({ initialMessage, setProcessing, userLanguage }) => {
+const StreamingMessage = ({ initialMessage, setProcessing, userLanguage, sessionId }) => {
   const [responses, setResponses] = useState([]);
   const ws = useRef(null);
   const messageBuffer = useRef(""); // Buffer to hold incomplete JSON strings
+  const nextSeq = useRef(0); // Sequence number of the next compact frame of this answer
 
   useEffect(() => {
     let language = userLanguage || (initialMessage ? franc(initialMessage) : "auto");
@@ -141,14 +142,30 @@ const StreamingMessage = ({ initialMessage, setProcessing, userLanguage }) => {
     ws.current.onopen = () => {
       console.log("WebSocket Connected");
       // Send initial message
-      ws.current.send(JSON.stringify({ action: "sendMessage", prompt: initialMessage, language: language}));
+      // Protocol 2 asks for compact frames, servers that do not know it answer with the original frames
+      // The session ID lets the server find the earlier turns of this chat, which were sent over other connections
+      ws.current.send(JSON.stringify({ action: "sendMessage", prompt: initialMessage, language: language, protocol: 2, sessionId: sessionId }));
     };
 
     ws.current.onmessage = (event) => {
       try {
         messageBuffer.current += event.data; // Append new data to buffer
-        const parsedData = JSON.parse(messageBuffer.current); // Try to parse the full buffer
-        
+        const frame = JSON.parse(messageBuffer.current); // Try to parse the full buffer
+
+        // Compact frames: {"r": request ID, "s": sequence number, "t": "d" | "e" | "q", "x": text}
+        let parsedData = frame;
+        if (frame.t !== undefined) {
+          if (frame.s < nextSeq.current) {
+            messageBuffer.current = ""; // Already received
+            return;
+          }
+          if (frame.s > nextSeq.current) {
+            console.log(`Missing frames ${nextSeq.current} to ${frame.s - 1} of request ${frame.r}`);
+          }
+          nextSeq.current = frame.s + 1;
+          parsedData = { type: { d: "delta", e: "end", q: "queued" }[frame.t], text: frame.x };
+        }
+
         if (parsedData.type === "end") {
           // Implement your logic here
           setProcessing(false); // Set processing to false when parsing is complete
@@ -188,7 +205,7 @@ const StreamingMessage = ({ initialMessage, setProcessing, userLanguage }) => {
         ws.current.close();
       }
     };
-  }, [initialMessage, setProcessing, userLanguage]
+  }, [initialMessage, setProcessing, userLanguage, sessionId]
 ); // Add setProcessing to the dependency array
 
 return (
@@ -0,0 +1,204 @@
+# Admission control in front of the model call. Under classroom bursts every request would start its model
+# stream at once and Bedrock would throttle all of them. Each request first takes a token from its client's
+# bucket (a client sending faster than ADMISSION_CLIENT_RATE is told to slow down), then from a global bucket
+# shared by every container. When the global bucket is empty the request waits in a bounded queue: the client
+# gets a "queued" frame straight away, and each token goes to the waiting request whose client was admitted
+# the fewest times lately, oldest first, so one busy client cannot starve the others. A full queue or a
+# wait longer than ADMISSION_MAX_WAIT_MS ends in a short "busy" answer instead of a throttled model call.
+# A client is its chat session: the web client opens a new connection for every message, so a connection
+# never sends twice and would always find a full bucket and no earlier admissions.
+# State lives in ADMISSION_TABLE when it is set, one item per bucket updated with optimistic locking.
+# A request that keeps losing the race for the queue item to other writers stays queued and retries after the
+# poll interval. The store is working, so contention never admits it. It ends busy (it never reached the
+# queue) or timed out. Only store outages admit the request, admission control must never be the reason an
+# answer fails.
+import os
+import time
+import uuid
+import random
+
+from ttl_store import UpdateConflict, create_store
+from telemetry import info
+
+ADMISSION_CONTROL_ENABLED = os.environ.get('ADMISSION_CONTROL_ENABLED', 'true').lower() == 'true'
+ADMISSION_GLOBAL_RATE = float(os.environ.get('ADMISSION_GLOBAL_RATE', '5'))  # Model calls started per second, all containers together
+ADMISSION_GLOBAL_BURST = float(os.environ.get('ADMISSION_GLOBAL_BURST', '10'))
+ADMISSION_CLIENT_RATE = float(os.environ.get('ADMISSION_CLIENT_RATE', '0.5'))  # Requests per second of one chat session
+ADMISSION_CLIENT_BURST = float(os.environ.get('ADMISSION_CLIENT_BURST', '3'))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', '50'))
+ADMISSION_MAX_WAIT_MS = int(os.environ.get('ADMISSION_MAX_WAIT_MS', '10000'))
+ADMISSION_POLL_MS = int(os.environ.get('ADMISSION_POLL_MS', '100'))
+
+GLOBAL_KEY = "admission#global"
+STATE_TTL_SECONDS = 60 * 60
+# Admissions older than this no longer count against a client when the queue is ordered
+FAIRNESS_WINDOW_SECONDS = 60
+
+# Function to add the tokens earned since the last update to a bucket, a missing bucket starts full
+def refill(bucket, rate, burst, now):
+    if bucket is None:
+        return {"tokens": burst, "at": now}
+    return dict(bucket, tokens=min(burst, bucket["tokens"] + max(0.0, now - bucket["at"]) * rate), at=now)
+
+# Function to order the waiting requests, fewest recent admissions of their client first, then oldest first
+# Waiters are [ticket, client ID, enqueued at], served maps a client ID to [admissions, last admitted at]
+def queue_order(waiters, served):
+    return sorted(waiters, key=lambda waiter: (served.get(waiter[1], [0])[0], waiter[2]))
+
+# The outcome of admitting one request
+class Admission:
+    def __init__(self, outcome, waited_ms=0.0, position=None):
+        self.outcome = outcome  # admitted, queued (admitted after waiting), rate_limited, busy or timeout
+        self.waited_ms = waited_ms
+        self.position = position  # place in the queue when the request was first queued
+
+    @property
+    def admitted(self):
+        return self.outcome in ('admitted', 'queued')
+
+class AdmissionController:
+    def __init__(self, store=None, global_rate=ADMISSION_GLOBAL_RATE, global_burst=ADMISSION_GLOBAL_BURST,
+                 client_rate=ADMISSION_CLIENT_RATE, client_burst=ADMISSION_CLIENT_BURST,
+                 queue_size=ADMISSION_QUEUE_SIZE, max_wait_ms=ADMISSION_MAX_WAIT_MS, poll_ms=ADMISSION_POLL_MS,
+                 enabled=ADMISSION_CONTROL_ENABLED, clock=time.time, sleep=time.sleep):
+        self.store = store if store is not None else create_store('ADMISSION_TABLE')
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.poll = poll_ms / 1000.0
+        self.enabled = enabled
+        self.clock = clock
+        self.sleep = sleep
+        self.counters = {'admitted': 0, 'queued': 0, 'rate_limited': 0, 'busy': 0, 'timeout': 0, 'store_errors': 0, 'conflicts': 0}
+
+    # Takes a token from the client's bucket, returns False when the client sends too fast
+    def take_client_token(self, client_id):
+        now = self.clock()
+
+        def take(bucket):
+            bucket = refill(bucket, self.client_rate, self.client_burst, now)
+            if bucket["tokens"] < 1:
+                return bucket, False
+            return dict(bucket, tokens=bucket["tokens"] - 1), True
+
+        return self.store.update(f"admission#client#{client_id}", take, STATE_TTL_SECONDS)
+
+    # Refills the global bucket and drops waiters that outlived the longest wait (their invocation has ended)
+    def current(self, state, now):
+        state = refill(state, self.global_rate, self.global_burst, now)
+        waiters = [waiter for waiter in state.get("waiters", []) if now - waiter[2] <= self.max_wait + 5 * self.poll]
+        served = {client: entry for client, entry in state.get("served", {}).items() if now - entry[1] <= FAIRNESS_WINDOW_SECONDS}
+        return dict(state, waiters=waiters, served=served)
+
+    # One step of the shared queue: joins it if asked, takes a global token when this request is next in line
+    # Returns ("admitted" | "waiting" | "busy" | "timeout", position in the queue)
+    def step(self, ticket, client_id, join):
+        now = self.clock()
+
+        def advance(state):
+            state = self.current(state, now)
+            waiters = state["waiters"]
+            mine = next((waiter for waiter in waiters if waiter[0] == ticket), None)
+            if mine is None:
+                if not join:
+                    return state, ("timeout", None)
+                if len(waiters) >= self.queue_size:
+                    return state, ("busy", None)
+                mine = [ticket, client_id, now]
+                waiters.append(mine)
+            position = queue_order(waiters, state["served"]).index(mine)
+            if position == 0 and state["tokens"] >= 1:
+                waiters.remove(mine)
+                admissions = state["served"].get(client_id, [0])[0]
+                state["served"][client_id] = [admissions + 1, now]
+                return dict(state, tokens=state["tokens"] - 1), ("admitted", 0)
+            return state, ("waiting", position)
+
+        return self.store.update(GLOBAL_KEY, advance, STATE_TTL_SECONDS)
+
+    # step() that reports a lost race for the queue item as ("contended", None) instead of raising
+    def try_step(self, ticket, client_id, join):
+        try:
+            return self.step(ticket, client_id, join)
+        except UpdateConflict as e:
+            print(f"Admission queue contended: {e}")
+            self.counters['conflicts'] += 1
+            return 'contended', None
+
+    # True when a read of the queue suggests this request can take a token, so waiters do not all write on every poll
+    def may_be_next(self, ticket):
+        state = self.store.get(GLOBAL_KEY)
+        if state is None:
+            return True
+        state = self.current(state, self.clock())
+        order = queue_order(state["waiters"], state["served"])
+        return state["tokens"] >= 1 and (not order or order[0][0] == ticket)
+
+    # Removes a request that gave up from the queue
+    def leave(self, ticket):
+        def remove(state):
+            if state is None:
+                return None, None
+            return dict(state, waiters=[waiter for waiter in state.get("waiters", []) if waiter[0] != ticket]), None
+
+        try:
+            self.store.update(GLOBAL_KEY, remove, STATE_TTL_SECONDS)
+        except UpdateConflict as e:
+            # The entry is dropped by current() once it outlived the longest wait
+            print(f"Failed to leave the admission queue: {e}")
+            self.counters['conflicts'] += 1
+
+    # Waits until the request of a client (its chat session) may call the model, on_queued(position) is called once if it has to wait
+    def admit(self, client_id, on_queued=None):
+        if not self.enabled:
+            return Admission('admitted')
+        started = self.clock()
+        position = None
+        try:
+            try:
+                if not self.take_client_token(client_id):
+                    return self.record(Admission('rate_limited'))
+            except UpdateConflict as e:
+                # Only this session writes its bucket, losing every race means it is flooding us
+                print(f"Admission client bucket contended: {e}")
+                self.counters['conflicts'] += 1
+                return self.record(Admission('rate_limited'))
+            ticket = uuid.uuid4().hex
+            outcome, place = self.try_step(ticket, client_id, join=True)
+            joined = outcome != 'contended'
+            while outcome in ('waiting', 'contended'):
+                if position is None and place is not None:
+                    position = place + 1
+                    if on_queued:
+                        on_queued(position)
+                if self.clock() - started >= self.max_wait:
+                    if joined:
+                        self.leave(ticket)
+                    outcome = 'timeout' if joined else 'busy'
+                    break
+                # Jittered so waiters in different containers do not poll in lockstep
+                self.sleep(self.poll * random.uniform(0.5, 1.5))
+                if not joined:
+                    outcome, place = self.try_step(ticket, client_id, join=True)
+                    joined = outcome != 'contended'
+                elif outcome == 'contended' or self.may_be_next(ticket):
+                    outcome, place = self.try_step(ticket, client_id, join=False)
+        except Exception as e:
+            print(f"Admission control unavailable, admitting the request: {e}")
+            self.counters['store_errors'] += 1
+            return Admission('admitted', (self.clock() - started) * 1000)
+        if outcome == 'admitted' and position is not None:
+            outcome = 'queued'
+        return self.record(Admission(outcome, (self.clock() - started) * 1000, position))
+
+    def record(self, admission):
+        self.counters[admission.outcome] += 1
+        if admission.outcome != 'admitted':
+            info(f"Admission: {admission.outcome} after {admission.waited_ms:.0f} ms, counters: {self.counters}")
+        return admission
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,63 @@
+# Cache of complete answers to first-turn questions, checked before the knowledge base and the model are called.
+# Answers are kept in an in-process LRU tier and, when ANSWER_CACHE_TABLE is set, in a DynamoDB tier shared
+# by every container. Keys include the knowledge base version and the shared cache version, so that a re-synced
+# knowledge base or an invalidation sent to any container starts both tiers of every container clean.
+import os
+import hashlib
+
+from ttl_store import InMemoryStore, create_store
+from retrieval_cache import normalize_query
+from cache_version import CACHE_VERSION
+
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', '3600'))
+ANSWER_CACHE_MAX_ITEMS = int(os.environ.get('ANSWER_CACHE_MAX_ITEMS', '256'))
+KB_VERSION = os.environ.get('KB_VERSION', '1')
+
+class AnswerCache:
+    def __init__(self, local=None, shared=None, ttl_seconds=ANSWER_CACHE_TTL_SECONDS, kb_version=KB_VERSION, version=None):
+        self.local = local if local is not None else InMemoryStore(max_items=ANSWER_CACHE_MAX_ITEMS)
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.kb_version = kb_version
+        self.version = version if version is not None else CACHE_VERSION
+
+    def key(self, prompt, language_code):
+        raw = f"{self.kb_version}.{self.version.current()}|{(language_code or '').lower()}|{normalize_query(prompt)}"
+        return "answer#" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # Returns the cached answer or None, shared tier hits are copied into the local tier
+    def get(self, prompt, language_code):
+        key = self.key(prompt, language_code)
+        answer = self.local.get(key)
+        if answer is not None or self.shared is None:
+            return answer
+        try:
+            answer = self.shared.get(key)
+        except Exception as e:
+            print(f"Answer cache shared tier unavailable: {e}")
+            return None
+        if answer is not None:
+            self.local.put(key, answer, self.ttl_seconds)
+        return answer
+
+    def put(self, prompt, language_code, answer):
+        key = self.key(prompt, language_code)
+        self.local.put(key, answer, self.ttl_seconds)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, answer, self.ttl_seconds)
+            except Exception as e:
+                print(f"Failed to write answer to the shared cache tier: {e}")
+
+    # Drops the in-process tier and bumps the shared version, the old entries of the shared tier and of other
+    # containers are no longer read and are left to expire. bump=False when the caller already bumped it
+    def invalidate(self, bump=True):
+        self.local.clear()
+        if bump:
+            self.version.bump()
+
+# Function to build the cache used by the Lambda handler, the shared tier is only used when a table is configured
+def create_answer_cache():
+    shared = create_store('ANSWER_CACHE_TABLE') if os.environ.get('ANSWER_CACHE_TABLE') else None
+    return AnswerCache(shared=shared)
@@ -0,0 +1,51 @@
+# Server-side conversation history keyed by the chat session ID the web client sends with every message.
+# The client opens a new websocket connection for each message, so the connection ID cannot tie the turns
+# of a conversation together, the session ID does (requests without one fall back to their connection ID).
+# Turns are stored already sanitized, so a request only sanitizes its own prompt and answer, and the
+# client no longer needs to resend the whole chatHistory. Only the most recent turns are kept, which
+# keeps the stored item and the prompt size bounded however long the conversation runs.
+import os
+import re
+
+from ttl_store import create_store
+
+CONVERSATION_MAX_TURNS = int(os.environ.get('CONVERSATION_MAX_TURNS', '10'))
+CONVERSATION_TTL_SECONDS = int(os.environ.get('CONVERSATION_TTL_SECONDS', '7200'))
+
+# Session IDs are generated by the client, anything that does not look like one is ignored
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+# Function to return the ID the conversation of a request is stored under
+def conversation_id(session_id, connection_id):
+    if isinstance(session_id, str) and SESSION_ID_PATTERN.match(session_id):
+        return session_id
+    return connection_id
+
+class ConversationStore:
+    def __init__(self, store=None, max_turns=CONVERSATION_MAX_TURNS, ttl_seconds=CONVERSATION_TTL_SECONDS):
+        self.store = store if store is not None else create_store('CONVERSATION_TABLE')
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, session_id):
+        return f"conversation#{session_id}"
+
+    # Returns the sanitized turns of a session, oldest first
+    def load(self, session_id):
+        try:
+            return self.store.get(self.key(session_id)) or []
+        except Exception as e:
+            print(f"Failed to load conversation for session {session_id}: {e}")
+            return []
+
+    # Appends a sanitized user/bot turn to the turns stored at the time of the write, so answers of the same
+    # session finishing together in different containers do not overwrite each other's turn
+    def append(self, session_id, user, bot):
+        def add_turn(current):
+            turns = ((current or []) + [{"user": user, "bot": bot}])[-self.max_turns:]
+            return turns, turns
+        try:
+            return self.store.update(self.key(session_id), add_turn, self.ttl_seconds)
+        except Exception as e:
+            print(f"Failed to save conversation for session {session_id}: {e}")
+            return None
@@ -0,0 +1,61 @@
+# Wire formats of the websocket frames sent to the web client. Frames are built as {'type': ..., 'text': ...}
+# dicts and only encoded when they are posted, with the protocol the client asked for in its sendMessage body.
+# Version 1 (clients that send no "protocol") is the original format: {"statusCode": 200, "type": ..., "text": ...}
+# for every frame, including the empty start frame and a "blank" frame for every event without text.
+# Version 2 is compact: short keys, no status code, frames without content are not posted at all, and every
+# frame carries the request ID and its sequence number within the answer, so a client can tell answers apart
+# when it asks again before the previous answer ended, and notice a missing frame.
+#   {"r": "<request ID>", "s": 0, "t": "d", "x": "text"}  delta
+#   {"r": "<request ID>", "s": 7, "t": "e"}               end of the answer
+#   {"r": "<request ID>", "s": 0, "t": "q", "p": 3}       waiting for a model slot at position 3
+import json
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+SUPPORTED_PROTOCOLS = (PROTOCOL_V1, PROTOCOL_V2)
+
+# Short frame types of version 2, frames of any other type carry nothing the client uses
+COMPACT_TYPES = {'delta': 'd', 'end': 'e', 'queued': 'q'}
+
+# Function to pick the protocol of a request, anything unknown falls back to version 1 so old clients keep working
+def negotiate(requested):
+    try:
+        version = int(requested)
+    except (TypeError, ValueError):
+        return PROTOCOL_V1
+    return version if version in SUPPORTED_PROTOCOLS else PROTOCOL_V1
+
+# Version 1 encoder, the frame as the client always received it
+class FrameEncoder:
+    version = PROTOCOL_V1
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id
+        self.seq = 0  # frames encoded so far for this answer
+
+    # Returns the JSON text to post, or None when the frame is not sent in this protocol
+    def encode(self, frame):
+        self.seq += 1
+        return json.dumps(dict({'statusCode': 200, 'type': frame['type'], 'text': frame.get('text', '')}, **frame))
+
+# Version 2 encoder, one per answer and connection since the sequence numbers belong to the answer
+class CompactFrameEncoder(FrameEncoder):
+    version = PROTOCOL_V2
+
+    def encode(self, frame):
+        kind = COMPACT_TYPES.get(frame['type'])
+        if kind is None or (kind == 'd' and not frame.get('text')):
+            return None
+        compact = {'r': self.request_id, 's': self.seq, 't': kind}
+        if kind == 'd':
+            compact['x'] = frame['text']
+        elif kind == 'q':
+            compact['p'] = frame.get('position')
+        self.seq += 1
+        return json.dumps(compact, separators=(',', ':'), ensure_ascii=False)
+
+# Function to create the encoder of an answer, protocol is the value the client sent (None for old clients)
+def create_encoder(protocol=None, request_id=None):
+    if negotiate(protocol) == PROTOCOL_V2:
+        return CompactFrameEncoder(request_id)
+    return FrameEncoder(request_id)
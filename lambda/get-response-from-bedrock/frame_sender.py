@@ -0,0 +1,233 @@
+# Senders that deliver websocket frames to a connection through the API Gateway management API.
+# InlineSender posts each frame on the caller's thread. BackgroundSender lets the caller keep draining
+# the model stream while a sender thread posts frames from a bounded queue: frames are delivered in
+# order, consecutive delta frames waiting in the queue are merged into a single post, and the caller
+# only blocks (backpressure) when the queue is full. FanOutSender sends one stream to several connections.
+# Each sender encodes frames with the protocol of its connection's request (frame_protocol.py).
+# A sender given a coalescer (index.DeltaCoalescer) buffers delta text before posting it. The sender thread
+# of a BackgroundSender wakes up when buffered text reaches its flush interval, so text is posted on time
+# even while the model produces nothing; an InlineSender can only check the interval when a delta arrives.
+import os
+import time
+import queue
+import threading
+
+from frame_protocol import FrameEncoder, create_encoder
+
+STREAM_SENDER_MODE = os.environ.get('STREAM_SENDER_MODE', 'background')
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '64'))
+FLIGHT_POLL_INTERVAL_MS = int(os.environ.get('FLIGHT_POLL_INTERVAL_MS', '250'))  # Flight store reads of a stream are at least this far apart
+
+_STOP = object()
+
+class InlineSender:
+    def __init__(self, gateway, connection_id, timer=None, encoder=None, coalescer=None):
+        self.gateway = gateway
+        self.connection_id = connection_id
+        self.timer = timer
+        self.encoder = encoder if encoder is not None else FrameEncoder()
+        self.coalescer = coalescer
+        self.gone = False
+        self.error = None
+        self.posts = 0
+
+    def post(self, frame):
+        data = self.encoder.encode(frame)
+        if data is None:
+            return  # Nothing the client's protocol needs
+        started = time.perf_counter()
+        try:
+            self.gateway.post_to_connection(ConnectionId=self.connection_id, Data=data)
+            self.posts += 1
+        except self.gateway.exceptions.GoneException:
+            print(f"Connection {self.connection_id} is no longer valid. Cleaning up.")
+            self.gone = True
+        finally:
+            if self.timer:
+                self.timer.add('post_to_connection', time.perf_counter() - started)
+
+    # True once frames can no longer be delivered and the caller should stop streaming
+    @property
+    def stopped(self):
+        return self.gone or self.error is not None
+
+    # Returns the frames to post for a frame: buffered text is held back by the coalescer, and is
+    # always posted before a frame of another type
+    def coalesce(self, frame):
+        if self.coalescer is None:
+            return [frame]
+        if frame.get('type') == 'delta':
+            text = self.coalescer.add(frame['text'])
+            return [dict(frame, text=text)] if text else []
+        text = self.coalescer.flush()
+        return ([{'type': 'delta', 'text': text}] if text else []) + [frame]
+
+    def send(self, frame):
+        for ready in self.coalesce(frame):
+            if not self.stopped:
+                self.post(ready)
+
+    # Waits until every frame has been posted, returns True if all of them were delivered
+    def close(self):
+        text = self.coalescer.flush() if self.coalescer is not None else None
+        if text and not self.stopped:
+            self.post({'type': 'delta', 'text': text})
+        return not self.stopped
+
+class BackgroundSender(InlineSender):
+    def __init__(self, gateway, connection_id, timer=None, max_queue=STREAM_QUEUE_SIZE, encoder=None, coalescer=None):
+        super().__init__(gateway, connection_id, timer, encoder, coalescer)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, frame):
+        if not self.stopped:
+            self.queue.put(frame)
+
+    # Waits for the next frame, or returns None once the text buffered by the coalescer is due
+    def next_frame(self):
+        deadline = self.coalescer.deadline() if self.coalescer is not None else None
+        if deadline is None:
+            return self.queue.get()
+        try:
+            return self.queue.get(timeout=max(0.0, deadline - self.coalescer.clock()))
+        except queue.Empty:
+            return None
+
+    # Sender loop, merges delta frames that queued up while the previous post was in flight
+    def run(self):
+        pending = None
+        while True:
+            frame = pending if pending is not None else self.next_frame()
+            pending = None
+            if frame is None:
+                frames = [{'type': 'delta', 'text': self.coalescer.flush()}]
+            elif frame is _STOP:
+                # Text still buffered when the stream ended without an end frame
+                text = self.coalescer.flush() if self.coalescer is not None else None
+                if text and not self.stopped:
+                    self.post_safely({'type': 'delta', 'text': text})
+                return
+            else:
+                frame, pending = self.merge(frame)
+                frames = self.coalesce(frame)
+            for ready in frames:
+                if self.stopped:
+                    break  # Keep draining so a blocked producer is released
+                self.post_safely(ready)
+
+    # Merges the delta frames waiting behind a delta frame, returns it and the first frame of another kind
+    def merge(self, frame):
+        pending = None
+        if frame.get('type') == 'delta':
+            texts = [frame['text']]
+            while True:
+                try:
+                    following = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if following is not _STOP and following.get('type') == 'delta':
+                    texts.append(following['text'])
+                else:
+                    pending = following
+                    break
+            frame = dict(frame, text="".join(texts))
+        return frame, pending
+
+    def post_safely(self, frame):
+        try:
+            self.post(frame)
+        except Exception as e:
+            print(f"Error while posting to connection {self.connection_id}: {e}")
+            self.error = e
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+        return not self.stopped
+
+# Function to merge consecutive delta frames, so a late subscriber catches up in as few posts as possible
+def merge_deltas(frames):
+    merged = []
+    for frame in frames:
+        if merged and frame.get('type') == 'delta' and merged[-1].get('type') == 'delta':
+            merged[-1] = dict(merged[-1], text=merged[-1]['text'] + frame['text'])
+        else:
+            merged.append(frame)
+    return merged
+
+# Sends the frames of one model stream to the leading connection and to every connection that joined its flight
+# Subscribers are picked up between frames, at most every poll interval so the stream does not wait on a flight
+# store read for every token, and are first sent the frames they missed, in their own protocol
+class FanOutSender:
+    def __init__(self, gateway, connection_id, flight, timer=None, mode=None, encoder=None, coalescer_factory=None,
+                 poll_interval_ms=FLIGHT_POLL_INTERVAL_MS, clock=time.monotonic):
+        self.gateway = gateway
+        self.flight = flight
+        self.timer = timer
+        self.mode = mode
+        self.coalescer_factory = coalescer_factory  # Every connection buffers its own text
+        self.poll_interval = poll_interval_ms / 1000.0
+        self.clock = clock
+        self.polled_at = clock()  # The caller polled the flight just before streaming
+        self.polls = 0
+        self.sent = []
+        self.senders = {}
+        self.delivered = {}  # connection ID -> True if every frame reached it, filled in by close
+        self.add(connection_id, encoder)
+        for subscriber in flight.subscribers:
+            self.add_subscriber(subscriber)
+
+    def add(self, connection_id, encoder=None):
+        if connection_id in self.senders:
+            return
+        coalescer = self.coalescer_factory() if self.coalescer_factory is not None else None
+        sender = create_sender(self.gateway, connection_id, self.timer, mode=self.mode, encoder=encoder, coalescer=coalescer)
+        self.flight.served.add(connection_id)
+        for frame in merge_deltas(self.sent):
+            sender.send(frame)
+        self.senders[connection_id] = sender
+
+    def add_subscriber(self, subscriber):
+        self.add(subscriber['connectionId'], create_encoder(subscriber.get('protocol'), subscriber.get('requestId')))
+
+    # Picks up new subscribers once the poll interval has passed since the last read of the flight
+    def refresh(self, force=False):
+        if not force and self.clock() - self.polled_at < self.poll_interval:
+            return
+        self.polled_at = self.clock()
+        self.polls += 1
+        for subscriber in self.flight.poll():
+            self.add_subscriber(subscriber)
+
+    # True once no connection can receive frames, subscribers that joined in the meantime keep the stream going
+    @property
+    def stopped(self):
+        if all(sender.stopped for sender in self.senders.values()):
+            self.refresh(force=True)
+        return all(sender.stopped for sender in self.senders.values())
+
+    @property
+    def gone(self):
+        return all(sender.gone for sender in self.senders.values())
+
+    def send(self, frame):
+        self.refresh()
+        self.sent.append(frame)
+        for sender in self.senders.values():
+            sender.send(frame)
+
+    # Closes the flight, catches up the last subscribers and waits for every connection
+    def close(self):
+        for subscriber in self.flight.close():
+            self.add_subscriber(subscriber)
+        for connection_id, sender in self.senders.items():
+            self.delivered[connection_id] = sender.close()
+        return any(self.delivered.values())
+
+# Function to create the sender for a response stream, STREAM_SENDER_MODE=inline restores blocking posts
+def create_sender(gateway, connection_id, timer=None, mode=None, encoder=None, coalescer=None):
+    if (mode or STREAM_SENDER_MODE) == 'inline':
+        return InlineSender(gateway, connection_id, timer, encoder, coalescer)
+    return BackgroundSender(gateway, connection_id, timer, encoder=encoder, coalescer=coalescer)
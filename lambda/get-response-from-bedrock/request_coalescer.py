@@ -0,0 +1,124 @@
+# Single-flight coalescing of identical first-turn questions that arrive while one of them is being answered.
+# The first request for a question leads a "flight": it does the retrieval and the model call, and its frames are
+# fanned out to every connection that joins the flight. Later requests claim numbered subscriber slots with
+# conditional writes and return straight away. The leader picks new subscribers up between frames, and when it is
+# done it claims the next free slot with a closing marker, so a request arriving after that leads a new flight.
+# Flights live in FLIGHT_TABLE when it is set so that requests in different containers are coalesced.
+import os
+import uuid
+import hashlib
+
+from ttl_store import create_store
+from telemetry import debug
+from retrieval_cache import normalize_query
+
+REQUEST_COALESCING_ENABLED = os.environ.get('REQUEST_COALESCING_ENABLED', 'true').lower() == 'true'
+FLIGHT_TTL_SECONDS = int(os.environ.get('FLIGHT_TTL_SECONDS', '120'))
+KB_VERSION = os.environ.get('KB_VERSION', '1')
+
+# One answer in progress, owned by the leading request
+class Flight:
+    def __init__(self, store, key, flight_id, ttl_seconds=FLIGHT_TTL_SECONDS):
+        self.store = store
+        self.key = key
+        self.flight_id = flight_id
+        self.ttl_seconds = ttl_seconds
+        self.subscribers = []  # Entries written by the requests that joined, in join order
+        self.served = set()  # Connection IDs that were sent frames, filled in by the senders
+        self.next_slot = 0
+        self.closed = False
+
+    def slot_key(self, slot):
+        return f"flight#{self.flight_id}#{slot}"
+
+    # Returns the subscribers that joined since the last poll
+    def poll(self):
+        joined = []
+        while not self.closed:
+            try:
+                entry = self.store.get(self.slot_key(self.next_slot))
+            except Exception as e:
+                print(f"Failed to read subscribers of flight {self.flight_id}: {e}")
+                break
+            if entry is None:
+                break
+            joined.append(entry)
+            self.next_slot += 1
+        self.subscribers.extend(joined)
+        return joined
+
+    # Returns the subscribers that joined but were never sent a frame
+    def stranded(self):
+        return [subscriber for subscriber in self.subscribers if subscriber['connectionId'] not in self.served]
+
+    # Stops new requests from joining and releases the question for the next flight
+    # Returns the subscribers that joined since the last poll
+    def close(self):
+        if self.closed:
+            return []
+        joined = []
+        while not self.closed:
+            joined.extend(self.poll())
+            try:
+                self.closed = self.store.put_if_absent(self.slot_key(self.next_slot), {"closed": True}, self.ttl_seconds)
+            except Exception as e:
+                print(f"Failed to close flight {self.flight_id}: {e}")
+                self.closed = True
+        try:
+            self.store.delete(self.key)
+        except Exception as e:
+            print(f"Failed to release flight {self.flight_id}: {e}")
+        return joined
+
+class RequestCoalescer:
+    def __init__(self, store=None, ttl_seconds=FLIGHT_TTL_SECONDS, kb_version=KB_VERSION):
+        self.store = store if store is not None else create_store('FLIGHT_TABLE')
+        self.ttl_seconds = ttl_seconds
+        self.kb_version = kb_version
+        self.stats = {"led": 0, "joined": 0, "fanned_out": 0, "stranded": 0}
+
+    def key(self, prompt, language_code):
+        raw = f"{self.kb_version}|{(language_code or '').lower()}|{normalize_query(prompt)}"
+        return "flight#" + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # Leads a new flight or joins the one in progress for the question
+    # Returns (flight, False) for the leader, (None, True) when joined and (None, False) when the request has to answer alone
+    def start(self, prompt, language_code, subscriber, flight_id=None):
+        key = self.key(prompt, language_code)
+        flight_id = flight_id or uuid.uuid4().hex
+        try:
+            # A flight that closed between the calls is retried once, the next request for the question leads a new one
+            for _ in range(2):
+                if self.store.put_if_absent(key, {"flight": flight_id}, self.ttl_seconds):
+                    self.stats["led"] += 1
+                    return Flight(self.store, key, flight_id, self.ttl_seconds), False
+                leader = self.store.get(key)
+                if leader is not None and self.join(leader["flight"], subscriber):
+                    self.stats["joined"] += 1
+                    return None, True
+        except Exception as e:
+            print(f"Request coalescing unavailable: {e}")
+        return None, False
+
+    # Claims the first free subscriber slot of a flight, returns False once the flight is closed
+    def join(self, flight_id, subscriber):
+        slot = 0
+        while True:
+            slot_key = f"flight#{flight_id}#{slot}"
+            if self.store.put_if_absent(slot_key, subscriber, self.ttl_seconds):
+                return True
+            existing = self.store.get(slot_key)
+            if existing is None:
+                continue  # Expired between the two calls, try the same slot again
+            if existing.get("closed"):
+                return False
+            slot += 1
+
+    # Closes the flight if streaming did not, returns subscribers that joined but were never sent a frame
+    def finish(self, flight):
+        flight.close()
+        stranded = flight.stranded()
+        self.stats["fanned_out"] += len(flight.subscribers) - len(stranded)
+        self.stats["stranded"] += len(stranded)
+        debug(lambda: f"Request coalescing stats: {self.stats}")
+        return stranded
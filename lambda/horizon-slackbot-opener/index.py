@@ -1,6 +1,7 @@
 import os
 import json
 import boto3
+from event_dedup import SLACK_EVENTS, retry_number
 
 # Initialize AWS Lambda client
 lambda_client = boto3.client('lambda')
@@ -32,13 +33,23 @@ def lambda_handler(event, context):
                     print("Ignoring bot's own message.")
                     return {'statusCode': 200, 'body': 'OK'}
 
+                # Retries and duplicate deliveries of an event already forwarded are acknowledged without a second invoke
+                retry_num = retry_number(event.get('headers'))
+                if not SLACK_EVENTS.claim('opener', slack_event, retry_num):
+                    return {'statusCode': 200, 'headers': {'X-Slack-No-Retry': '1'}, 'body': 'OK'}
+
                 # If it's a valid app mention, invoke the second Lambda function
                 print("Valid app mention detected, invoking second Lambda.")
-                lambda_client.invoke(
-                    FunctionName=PROCESSING_LAMBDA_ARN,
-                    InvocationType='Event',  # Asynchronous invocation
-                    Payload=json.dumps(slack_event)
-                )
+                try:
+                    lambda_client.invoke(
+                        FunctionName=PROCESSING_LAMBDA_ARN,
+                        InvocationType='Event',  # Asynchronous invocation
+                        Payload=json.dumps(slack_event)
+                    )
+                except Exception:
+                    # Let Slack's retry of this event through
+                    SLACK_EVENTS.release('opener', slack_event)
+                    raise
 
                 return {'statusCode': 200, 'body': 'OK'}
             else:
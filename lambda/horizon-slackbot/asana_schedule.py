@@ -0,0 +1,103 @@
+# Client for the weekly schedule kept in Asana.
+# All day sections are fetched concurrently over one pooled connection that is reused across warm
+# invocations, Asana pagination is followed, only the task fields we use are requested, and the result
+# is kept as a snapshot for SCHEDULE_CACHE_TTL_SECONDS (in memory, plus DynamoDB when SCHEDULE_CACHE_TABLE is set).
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import urllib3
+
+from ttl_store import InMemoryStore, create_store
+
+ASANA_API_URL = os.environ.get('ASANA_API_URL', 'https://app.asana.com/api/1.0')
+ASANA_PAGE_SIZE = 100
+ASANA_TIMEOUT = urllib3.Timeout(connect=2.0, read=5.0)
+SCHEDULE_CACHE_TTL_SECONDS = int(os.environ.get('SCHEDULE_CACHE_TTL_SECONDS', '300'))
+SCHEDULE_CACHE_KEY = "schedule#week"
+
+# One connection pool per container, sized so every section can be fetched at the same time
+http = urllib3.PoolManager(maxsize=5, block=False, timeout=ASANA_TIMEOUT, retries=urllib3.Retry(total=2, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503), raise_on_status=False))
+
+class ScheduleClient:
+    def __init__(self, token, section_ids, base_url=ASANA_API_URL, ttl_seconds=SCHEDULE_CACHE_TTL_SECONDS, persisted=None, pool=None):
+        self.token = token
+        self.section_ids = section_ids
+        self.base_url = base_url.rstrip('/')
+        self.ttl_seconds = ttl_seconds
+        self.snapshot = InMemoryStore(max_items=1)
+        self.persisted = persisted
+        self.pool = pool or http
+        self.executor = ThreadPoolExecutor(max_workers=len(section_ids))
+        self.asana_calls = 0
+
+    # Fetches every page of tasks in a section, returns the task names or an error entry like the original fetch
+    def fetch_section(self, section_id):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        params = {"section": section_id, "opt_fields": "name", "limit": ASANA_PAGE_SIZE}
+        names = []
+        while True:
+            try:
+                response = self.pool.request('GET', f"{self.base_url}/tasks?{urlencode(params)}", headers=headers)
+            except urllib3.exceptions.HTTPError as e:
+                return None, f"Error: {e}"
+            self.asana_calls += 1
+            if response.status != 200:
+                return None, f"Error: {response.status} - {response.data.decode('utf-8')}"
+            payload = json.loads(response.data.decode('utf-8'))
+            names.extend(task.get("name") for task in payload.get("data", []))
+            next_page = payload.get("next_page")
+            if not next_page or not next_page.get("offset"):
+                return names, None
+            params["offset"] = next_page["offset"]
+
+    # Fetches the whole week from Asana with one request per section running in parallel
+    def fetch(self):
+        week_schedule = {}
+        complete = True
+        results = self.executor.map(self.fetch_section, self.section_ids.values())
+        for day, (names, error) in zip(self.section_ids, results):
+            week_schedule[day] = names if error is None else [error]
+            complete = complete and error is None
+        return week_schedule, complete
+
+    # Returns the weekly schedule, from the snapshot when it is fresh enough
+    def get_weekly_schedule(self):
+        schedule = self.snapshot.get(SCHEDULE_CACHE_KEY)
+        if schedule is not None:
+            return schedule
+
+        if self.persisted is not None:
+            try:
+                schedule = self.persisted.get(SCHEDULE_CACHE_KEY)
+            except Exception as e:
+                print(f"Schedule cache unavailable: {e}")
+            if schedule is not None:
+                self.snapshot.put(SCHEDULE_CACHE_KEY, schedule, self.ttl_seconds)
+                return schedule
+
+        started = time.perf_counter()
+        schedule, complete = self.fetch()
+        print(f"Fetched schedule from Asana in {(time.perf_counter() - started) * 1000:.1f} ms")
+        # Partial results with errors are returned but never cached
+        if complete:
+            self.snapshot.put(SCHEDULE_CACHE_KEY, schedule, self.ttl_seconds)
+            if self.persisted is not None:
+                try:
+                    self.persisted.put(SCHEDULE_CACHE_KEY, schedule, self.ttl_seconds)
+                except Exception as e:
+                    print(f"Failed to persist schedule snapshot: {e}")
+        return schedule
+
+    # Drops the snapshot so the next request reads Asana again
+    def invalidate(self):
+        self.snapshot.clear()
+        if self.persisted is not None:
+            self.persisted.delete(SCHEDULE_CACHE_KEY)
+
+# Function to build the schedule client used by the Lambda handler
+def create_schedule_client(token, section_ids):
+    persisted = create_store('SCHEDULE_CACHE_TABLE') if os.environ.get('SCHEDULE_CACHE_TABLE') else None
+    return ScheduleClient(token, section_ids, persisted=persisted)
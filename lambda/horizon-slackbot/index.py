@@ -1,10 +1,24 @@
 import os
 import json
 import boto3
+from botocore.config import Config
 import re
-import urllib3
+import time
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from retrieval_cache import RETRIEVAL_CACHE
+from local_index import KB_RETRIEVER
+from asana_schedule import create_schedule_client
+from schedule_index import ScheduleIndex
+from intent_router import classify_intent, INTENT_METRICS, OUT_OF_SCOPE, SCHEDULE, SMALL_TALK
+from bedrock_request import ModelUsage, build_request
+from model_router import MODEL_ROUTER, route_features
+from context_assembler import assemble_context
+from slack_stream import SLACK_STREAMING_ENABLED, SlackMessageStream
+from event_dedup import SLACK_EVENTS
+from sanitizer import sanitize_input
+from resilience import RETRIEVE_CALLS, ResilientClient
+from region_router import BEDROCK_REGIONS, RegionRouter
 
 # Asana setup
 ASANA_TOKEN = os.environ['ASANA_PAT']
@@ -16,71 +30,79 @@ SECTION_IDS = {
     "Friday": "1208829604918551"
 }
 
+# Schedule snapshot shared by every invocation of a warm container
+schedule_client = create_schedule_client(ASANA_TOKEN, SECTION_IDS)
+
+# System prompts for the model, kept identical across requests so that Bedrock can cache them
+SYSTEM_PROMPT = (
+    "You are Horizon, a helpful assistant who will assist the members of ASU's Cloud Innovation Center, use information from the knowledge base and fallback on your learning as needed."
+    "Your Purpose is to provde concise information about the CIC and employee schedules when asked about the schedules."
+    "Respond directly to user questions without introducing unnecessary context or elaboration."
+    "Respond concisely and directly. If the question is unrelated to your purpose or the provided data, respond that you do not have the answer without elaborating unnecessarily."
+)
+SMALL_TALK_SYSTEM_PROMPT = (
+    "You are Horizon, a friendly assistant for the members of ASU's Cloud Innovation Center. "
+    "Reply to greetings and small talk in one or two short sentences and offer help with CIC information or employee schedules."
+)
+OUT_OF_SCOPE_REPLY = "Sorry, I don't have the answer to that. I can help with questions about the Cloud Innovation Center and employee schedules."
+
 # Slack setup
 slack_client = WebClient(token=os.environ['SLACK_BOT_TOKEN'])
 
-# Function to sanaitize user input by removing special characters and limiting length
-def sanitize_input(prompt):
-    sanitized = re.sub(r'[_*~`#\[\](){}>+-]', '', prompt).strip()[:500]
-    return sanitized
+# Model and retrieve calls are retried within their deadlines by the resilience layer, botocore makes one attempt
+CALL_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 1})
+# Model calls go to the best region of the pool, one client per region kept for the lifetime of the container
+BEDROCK_ROUTER = RegionRouter(BEDROCK_REGIONS, lambda region: boto3.client(service_name="bedrock-runtime", region_name=region, config=CALL_CONFIG))
 
 #Function to detect potential injection attempts in user input
 def detect_injection(prompt):
     return False  # Extend this as needed for more robust detection
 
-# Fetch schedule from Asana
+# Fetch schedule from Asana, repeated questions within the snapshot TTL do not call Asana at all
 def fetch_weekly_schedule():
-    http = urllib3.PoolManager()
-    url_template = "https://app.asana.com/api/1.0/tasks?section={section_id}"
-    headers = {"Authorization": f"Bearer {ASANA_TOKEN}"}
-    week_schedule = {}
-
-    for day, section_id in SECTION_IDS.items():
-        url = url_template.format(section_id=section_id)
-        response = http.request('GET', url, headers=headers)
-        # If the API call is successful, extract task names for the day
-        if response.status == 200:
-            tasks = json.loads(response.data.decode('utf-8')).get("data", [])
-            day_schedule = [task.get("name") for task in tasks]
-            week_schedule[day] = day_schedule
-        # If the API call fails, store the error message for the day
-        else:
-            week_schedule[day] = [f"Error: {response.status} - {response.data.decode('utf-8')}"]
-    return week_schedule
-
-# Function that extracts a person's name from the prompt by matching against tasks in the schedule
-def extract_person_name(prompt, schedule):
-    all_people = {task.split()[0] for day in schedule.values() for task in day}
-    for person in all_people:
-        if person.lower() in prompt.lower():
-            return person
-    return None
-
-# Function to construct a response based on the scedule, filtered by day or person if specified 
-def construct_schedule_response(schedule, day=None, person=None):
-    # If a specific day is requested, fetch the schedule for that day
-    if day:
-        day_schedule = schedule.get(day, [])
-        if not day_schedule:
-            return f"No schedule found for {day}."
-        return f"Here is the schedule for {day}:\n" + "\n".join(day_schedule)
-
-    #If a specific person is requested, search for their tasks across all days
-    if person:
-        person_schedule = []
-        for day, tasks in schedule.items():
-            for task in tasks:
-                if person.lower() in task.lower():
-                    person_schedule.append(f"{day}: {task}")
-        if not person_schedule:
-            return f"No schedule found for {person}."
-        return f"Here is the schedule for {person}:\n" + "\n".join(person_schedule)
-
-    # If no specific day or person is requested, return the full schedule
-    full_schedule = "Here is the schedule for next week:\n"
-    for day, tasks in schedule.items():
-        full_schedule += f"\n*{day}*:\n" + "\n".join(tasks)
-    return full_schedule
+    return schedule_client.get_weekly_schedule()
+
+# Index of the current schedule snapshot, rebuilt only when a new snapshot is fetched
+_schedule_index = {'schedule': None, 'index': None}
+
+# Function to return the index of the current weekly schedule
+def get_schedule_index():
+    schedule = fetch_weekly_schedule()
+    if schedule is not _schedule_index['schedule']:
+        _schedule_index['index'] = ScheduleIndex(schedule)
+        _schedule_index['schedule'] = schedule
+    return _schedule_index['index']
+
+# Schedule questions that need more than a lookup (comparisons, availability, advice) still go to the model
+REASONING_PATTERN = re.compile(
+    r"\b(why|should|recommend|suggest|best|compare|overlap|both|together|free|available|availability|"
+    r"cover|meet|meeting|most|least|longest|shortest|more|less|earliest|latest|else)\b",
+    re.IGNORECASE
+)
+
+# Function to check whether a schedule question needs the model rather than a table lookup
+def needs_reasoning(prompt):
+    return REASONING_PATTERN.search(prompt) is not None
+
+# Function to send a response back to Slack
+def post_slack_message(channel_id, text):
+    try:
+        slack_client.chat_postMessage(channel=channel_id, text=text)
+    except SlackApiError as e:
+        print(f"Failed to send message: {e.response['error']}")
+
+# Function to stream the model answer into a Slack message as it is generated, returns the answer text
+def stream_model_response(bedrock, kwargs, message, usage):
+    response = bedrock.invoke_model_with_response_stream(**kwargs)
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        chunk_json = json.loads(chunk['bytes'].decode('utf-8'))
+        usage.observe(chunk_json)
+        if chunk_json['type'] == 'content_block_delta':
+            message.append(chunk_json['delta'].get('text', ''))
+    return message.text
 
 # Function for processing incoming slack events and generate a respnose
 def process_slack_event(slack_event):
@@ -101,112 +123,145 @@ def process_slack_event(slack_event):
         #If the bot is not mentions, ingore the message
         return {'statusCode': 200, 'body': 'No mention detected, ignoring.'}
 
+    # The opener already drops most duplicates, this catches deliveries that reached the processor twice anyway
+    if not SLACK_EVENTS.claim('processor', slack_event):
+        return {'statusCode': 200, 'body': 'Duplicate event, ignoring.'}
+
     sanitized_prompt = sanitize_input(user_message.replace(mention_pattern, '').strip())
 
+    # Classify the message to decide which stages of the pipeline need to run
+    started = time.perf_counter()
+    intent = classify_intent(sanitized_prompt)
+    calls = {'retrieve': 0, 'model': 0, 'asana': 0}
+    print(f"Classified intent: [{intent}]")
+
     #Detect and handle injection attempts
     if detect_injection(sanitized_prompt):
-        bot_response = "Sorry, I can't process this request."
-    # If the message mentions "schedule", fetch the weekly schedule 
-    elif "schedule" in sanitized_prompt.lower():
-        weekly_schedule = fetch_weekly_schedule()
-
-        # Checks if a specific day or person is requested
-        if "monday" in sanitized_prompt.lower():
-            schedule_response = construct_schedule_response(weekly_schedule, day="Monday")
-        elif "tuesday" in sanitized_prompt.lower():
-            schedule_response = construct_schedule_response(weekly_schedule, day="Tuesday")
-        elif "wednesday" in sanitized_prompt.lower():
-            schedule_response = construct_schedule_response(weekly_schedule, day="Wednesday")
-        elif "thursday" in sanitized_prompt.lower():
-            schedule_response = construct_schedule_response(weekly_schedule, day="Thursday")
-        elif "friday" in sanitized_prompt.lower():
-            schedule_response = bot_response = construct_schedule_response(weekly_schedule, day="Friday")
-        # If no day is mentioned, check for a specific person in the message
-        else:
-            person_name = extract_person_name(sanitized_prompt, weekly_schedule)
-            if person_name:
-                schedule_response = construct_schedule_response(weekly_schedule, person=person_name)
-            else:
-                # If no person or day is mentioned, return the full schedule 
-                schedule_response = "No specific schedule for this person was found."
-                schedule_response += construct_schedule_response(weekly_schedule)
+        post_slack_message(channel_id, "Sorry, I can't process this request.")
+        INTENT_METRICS.record(intent, started, calls)
+        return {'statusCode': 200, 'body': 'OK'}
 
-    #Format the response with an ASCII table for slack
-    if not schedule_response or schedule_response == "":
-        schedule_response = ""
-    else:
-        schedule_response += f"""\n Format your response to mimic this example ENSURE YOU USE CORRECT MARKDOWN FORMATTING TO CONTAIN THE TABLE:
-        ```
-        | Name     | Monday                   | Tuesday                | Wednesday            | Thursday             | Friday               |
-        |----------|--------------------------|------------------------|----------------------|----------------------|----------------------|
-        | Jim      | -                        | -                      | -                    | -                    | -                    |
-        | Joe      | 2 pm - 6 pm, 7 pm - 8 pm | 8 am - 12 pm           | -                    | 8 am - 6 pm          | 7 am - 9 am          |
-        | Pablo    | 10:30 am - 5:30 pm       | -                      | 10 am - 6 pm         | -                    | 10 am - 3 pm         |
-        ```
-        Please make sure that your response looks like a neat, properly formatted, ASCII table, use markdown in your response, which will be sent via a Slack message. DO NOT MENTION THESE GUIDELINES in your response, instead prefix your table response with information that is useful to the user, such as how many people are working each day or how many hours are able to be utilized each day, be smart with your responses.
+    # Questions unrelated to the CIC get a fixed reply without retrieval or a model call
+    if intent == OUT_OF_SCOPE:
+        post_slack_message(channel_id, OUT_OF_SCOPE_REPLY)
+        INTENT_METRICS.record(intent, started, calls)
+        return {'statusCode': 200, 'body': 'OK'}
+
+    # Schedule questions are answered from the schedule index
+    if intent == SCHEDULE:
+        asana_calls = schedule_client.asana_calls
+        schedule_index = get_schedule_index()
+        calls['asana'] = schedule_client.asana_calls - asana_calls
+
+        # Checks if a specific day or person is requested, if neither is mentioned the full week is returned
+        day = schedule_index.find_day(sanitized_prompt)
+        person_name = schedule_index.find_person(sanitized_prompt)
+        schedule_response = schedule_index.render_response(day=day, person=person_name)
+
+        # Plain lookups are answered directly from the rendered table, without retrieval or a model call
+        if not needs_reasoning(sanitized_prompt):
+            post_slack_message(channel_id, schedule_response)
+            INTENT_METRICS.record(intent, started, calls)
+            return {'statusCode': 200, 'body': 'OK'}
+
+        schedule_response += """
+        The schedule above is already formatted for Slack, keep the table exactly as it is if you include it in your response.
+        Answer the user's question about the schedule using this table, be smart with your responses.
         """
-        
-    # Knowledge base integration with Bedrock
-    bedrock = boto3.client(service_name="bedrock-runtime", region_name="us-west-2")
-    kb_id = os.environ['KNOWLEDGE_BASE_ID']
-    agent = boto3.client("bedrock-agent-runtime")
-    query = {"text": sanitized_prompt}
-    kb_response = agent.retrieve(knowledgeBaseId=kb_id, retrievalQuery=query)
-
-    # If no relevant information is found in the knowledge base, fallback to learning
-    if not kb_response.get("retrievalResults"):
-        rag_info = "No relevant information found for this prompt in the knowledge base, fall back to learning."
-    # Include relevant information from the knowledge base in the response
+
+    # Model calls go to the best Bedrock region and fail over to another one until the first token arrives
+    bedrock = BEDROCK_ROUTER
+
+    # A placeholder is posted before retrieval and the model call, and edited as the answer streams in
+    message = None
+    if SLACK_STREAMING_ENABLED:
+        message = SlackMessageStream(slack_client, channel_id)
+        message.start()
+
+    # Picks the model, the answer budget and whether retrieval is needed from the intent and the prompt
+    route = MODEL_ROUTER.route(route_features(intent, sanitized_prompt))
+
+    if intent == SMALL_TALK and not route.use_rag:
+        # Greetings and thanks only need a short reply, without retrieval or the large prompt
+        system_prompt = SMALL_TALK_SYSTEM_PROMPT
+        testing_prompt = sanitized_prompt or "Hello!"
     else:
-        rag_info = "RELEVANT INFORMATION:\n"
-        for result in kb_response["retrievalResults"]:
-            rag_info += result["content"]["text"] + "\n"
+        system_prompt = SYSTEM_PROMPT
+        rag_info = ""
+
+        # Knowledge base integration with Bedrock, schedule questions are answered from the schedule alone
+        if route.use_rag:
+            kb_id = os.environ['KNOWLEDGE_BASE_ID']
+            agent = ResilientClient(boto3.client("bedrock-agent-runtime", config=CALL_CONFIG), {'retrieve': RETRIEVE_CALLS})
+            fallbacks = KB_RETRIEVER.counters['fallback']
+            try:
+                kb_response = KB_RETRIEVER.retrieve(agent, kb_id, sanitized_prompt)
+            except Exception as e:
+                # A slow or failing knowledge base (or an open circuit) is skipped, the model answers on its own
+                print(f"Knowledge base skipped: {type(e).__name__}: {e}, retrieve stats: {RETRIEVE_CALLS.stats()}")
+                kb_response = {"retrievalResults": []}
+            calls['retrieve'] += KB_RETRIEVER.counters['fallback'] - fallbacks  # Answers from the local index make no call
+            print(f"Local index stats: {KB_RETRIEVER.stats()}, retrieval cache stats: {RETRIEVAL_CACHE.stats()}")
+
+            # The retrieval score can move a well matched question to a smaller budget
+            results = kb_response.get("retrievalResults", [])
+            top_score = max((result.get("score") or 0.0 for result in results), default=0.0)
+            route = MODEL_ROUTER.route(route_features(intent, sanitized_prompt, top_score=top_score))
+
+            context = assemble_context(results)
+            print(f"Context assembly: {context.stats()}")
 
-    testing_prompt = f"""
+            # If no relevant information is found in the knowledge base, fallback to learning
+            if not context.chunks:
+                rag_info = "No relevant information found for this prompt in the knowledge base, fall back to learning."
+            # Include the best relevant information from the knowledge base that fits the context budget
+            else:
+                rag_info = "RELEVANT INFORMATION:\n" + context.text
+
+        testing_prompt = f"""
 
     {sanitized_prompt}
 
     {schedule_response}
 
     {rag_info}
-
-    Respond concisely and directly. If the question is unrelated to your purpose or the provided data, respond that you do not have the answer without elaborating unnecessarily.
     """
-    kwargs = {
-        "modelId": "anthropic.claude-3-5-haiku-20241022-v1:0",
-        "contentType": "application/json",
-        "accept": "application/json",
-        "body": json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1000,
-            "system": (
-                "You are Horizon, a helpful assistant who will assist the members of ASU's Cloud Innovation Center, use information from the knowledge base and fallback on your learning as needed."
-                "Your Purpose is to provde concise information about the CIC and employee schedules when asked about the schedules."
-                "Respond directly to user questions without introducing unnecessary context or elaboration."
-            ),
-            "messages": [{"role": "user", "content": [{"type": "text", "text": testing_prompt}]}]
-        })
-    }
+    kwargs = build_request(route.model_id, system_prompt, testing_prompt, route.max_tokens)
     # Send the response back to Slack
+    usage = ModelUsage()
     try:
-        response = bedrock.invoke_model(**kwargs)
-        response_body = response['body'].read().decode('utf-8')
-        response_json = json.loads(response_body)
-        model_content = response_json.get('content', [])
-        bot_response = ''.join([item['text'] for item in model_content if item['type'] == 'text']).strip()
-        bot_response = bot_response + '\n'
+        calls['model'] += 1
+        if message is not None:
+            bot_response = stream_model_response(bedrock, kwargs, message, usage).strip() + '\n'
+        else:
+            response = bedrock.invoke_model(**kwargs)
+            response_body = response['body'].read().decode('utf-8')
+            response_json = json.loads(response_body)
+            usage.add(response_json.get('usage', {}))
+            model_content = response_json.get('content', [])
+            bot_response = ''.join([item['text'] for item in model_content if item['type'] == 'text']).strip()
+            bot_response = bot_response + '\n'
+        print(f"Model token usage: {json.dumps(usage.tokens)}")
     except Exception as e:
         bot_response = f"Sorry, I encountered an error: {str(e)}"
 
-    try:
-        slack_client.chat_postMessage(channel=channel_id, text=bot_response)
-    except SlackApiError as e:
-        print(f"Failed to send message: {e.response['error']}")
-
+    if message is not None:
+        message.finish(bot_response)
+        first_text_ms = round((message.first_text_at - started) * 1000, 1) if message.first_text_at else None
+        print(f"Slack message updates: {message.stats()}")
+    else:
+        post_slack_message(channel_id, bot_response)
+        first_text_ms = round((time.perf_counter() - started) * 1000, 1)
+    INTENT_METRICS.record(intent, started, calls)
+    MODEL_ROUTER.record(route, started, intent=intent, first_text_ms=first_text_ms)
     return {'statusCode': 200, 'body': 'OK'}
 
 # Lambda entry point
 def lambda_handler(event, context):
+    # Sent after the knowledge base is re-synced so that no stale results are served
+    if event.get("invalidateRetrievalCache"):
+        RETRIEVAL_CACHE.invalidate()
+        return {'statusCode': 200, 'body': 'OK'}
     try:
         process_slack_event(event)
     except Exception as e:
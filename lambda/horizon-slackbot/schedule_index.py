@@ -0,0 +1,122 @@
+# Structured index of the weekly schedule and a deterministic Slack table renderer.
+# Asana task names look like "Joe 2 pm - 6 pm, 7 pm - 8 pm": the first word is the person and the
+# rest holds their time ranges. Task names are parsed once per schedule snapshot into a person x day
+# index, so lookups by person or day are dictionary reads and schedule questions can be answered
+# without asking the model to format a table.
+import re
+
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")
+DAY_PATTERN = re.compile(r"\b(" + "|".join(DAYS) + r")\b", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z'.-]*")
+TIME = r"(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?m?\.?"
+TIME_RANGE_PATTERN = re.compile(TIME + r"\s*(?:-|–|to)\s*" + TIME, re.IGNORECASE)
+
+# Function to convert an hour/minute/meridiem triple into minutes after midnight
+def _minutes(hour, minute, meridiem):
+    hour = int(hour) % 12 if meridiem else int(hour)
+    if meridiem and meridiem.lower() == 'p':
+        hour += 12
+    return hour * 60 + int(minute or 0)
+
+# Function to parse the time ranges of a task, returns a list of (label, minutes) tuples
+def parse_time_ranges(text):
+    ranges = []
+    for match in TIME_RANGE_PATTERN.finditer(text):
+        start_hour, start_minute, start_meridiem, end_hour, end_minute, end_meridiem = match.groups()
+        end = _minutes(end_hour, end_minute, end_meridiem)
+        # "10 - 2 pm" style ranges borrow the meridiem of the end time unless that would end before starting
+        start = _minutes(start_hour, start_minute, start_meridiem or end_meridiem)
+        if start > end and not start_meridiem:
+            start = _minutes(start_hour, start_minute, 'a')
+        label = " ".join(match.group(0).split())
+        ranges.append((label, max(end - start, 0)))
+    return ranges
+
+class ScheduleIndex:
+    def __init__(self, schedule):
+        self.days = [day for day in schedule]
+        self.people = {}     # lower-case name -> display name, in order of first appearance
+        self.slots = {}      # (lower-case name, day) -> list of (label, minutes)
+        self.notes = {}      # (lower-case name, day) -> task text without a parsable time range
+        self.by_day = {day: [] for day in self.days}
+        self.errors = {}
+
+        for day, tasks in schedule.items():
+            for task in tasks:
+                if not task:
+                    continue
+                if task.startswith("Error:"):
+                    self.errors[day] = task
+                    continue
+                name, _, rest = task.strip().partition(" ")
+                key = name.lower()
+                self.people.setdefault(key, name)
+                if key not in self.by_day[day]:
+                    self.by_day[day].append(key)
+                ranges = parse_time_ranges(rest)
+                if ranges:
+                    self.slots.setdefault((key, day), []).extend(ranges)
+                elif rest:
+                    self.notes[(key, day)] = rest
+
+    # Returns the first weekday named in the prompt
+    def find_day(self, prompt):
+        match = DAY_PATTERN.search(prompt)
+        return match.group(1).capitalize() if match else None
+
+    # Returns the display name of the first scheduled person named in the prompt
+    def find_person(self, prompt):
+        for word in WORD_PATTERN.findall(prompt):
+            word = word.lower().rstrip(".")
+            person = self.people.get(word[:-2] if word.endswith("'s") else word)
+            if person:
+                return person
+        return None
+
+    def cell(self, key, day):
+        ranges = self.slots.get((key, day))
+        if ranges:
+            return ", ".join(label for label, _ in ranges)
+        return self.notes.get((key, day), "-")
+
+    def hours(self, key, day):
+        return sum(minutes for _, minutes in self.slots.get((key, day), [])) / 60
+
+    # Function to render a monospaced table for Slack, Slack does not render markdown tables
+    def render_table(self, people, days):
+        rows = [["Name"] + list(days)]
+        rows += [[self.people[key]] + [self.cell(key, day) for day in days] for key in people]
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = ["| " + " | ".join(value.ljust(width) for value, width in zip(row, widths)) + " |" for row in rows]
+        lines.insert(1, "|" + "|".join("-" * (width + 2) for width in widths) + "|")
+        return "```\n" + "\n".join(lines) + "\n```"
+
+    def day_summary(self, day):
+        people = self.by_day.get(day, [])
+        hours = sum(self.hours(key, day) for key in people)
+        return f"*{day}*: {len(people)} {'person' if len(people) == 1 else 'people'} scheduled, {hours:g} hours"
+
+    # Function to answer a schedule question for a day, a person or the whole week
+    def render_response(self, day=None, person=None):
+        days = [day] if day else self.days
+        errors = [self.errors[d] for d in days if d in self.errors]
+        if person:
+            key = person.lower()
+            scheduled = [d for d in days if (key, d) in self.slots or (key, d) in self.notes]
+            if not scheduled:
+                return f"No schedule found for {person}" + (f" on {day}." if day else ".")
+            total = sum(self.hours(key, d) for d in days)
+            header = f"Here is the schedule for {person}" + (f" on {day}" if day else "") + f" ({total:g} hours across {len(scheduled)} {'day' if len(scheduled) == 1 else 'days'}):"
+            people = [key]
+        else:
+            people = [key for key in self.people if any(key in self.by_day.get(d, []) for d in days)]
+            if not people and not errors:
+                return f"No schedule found for {day}." if day else "No schedule found for next week."
+            header = f"Here is the schedule for {day}:" if day else "Here is the schedule for next week:"
+            header += "\n" + "\n".join(self.day_summary(d) for d in days)
+        parts = [header]
+        if people:
+            parts.append(self.render_table(people, days))
+        if errors:
+            parts.append("Some days could not be loaded from Asana:\n" + "\n".join(errors))
+        return "\n".join(parts)
@@ -0,0 +1,109 @@
+# Streaming of a model answer into a single Slack message. A placeholder is posted as soon as the bot knows it
+# will call the model, then the message is edited with chat_update as the answer arrives. Text is coalesced so at
+# most one update is sent per SLACK_UPDATE_INTERVAL_MS (chat.update is rate limited per workspace), a rate limited
+# update pushes the next one back by the Retry-After Slack returns, and finish always sends the complete answer.
+# The interval counts from the moment the previous call returned, plus SLACK_UPDATE_HEADROOM_MS: Slack sees a call
+# some time after it is sent, and a slow call followed by a fast one would otherwise reach Slack too close together.
+# The final update is sent at once when the previous call returned more than an interval ago, otherwise after the
+# rest of that interval. A Retry-After only delays the retry of a final update that was rate limited.
+import os
+import time
+from slack_sdk.errors import SlackApiError
+
+SLACK_STREAMING_ENABLED = os.environ.get('SLACK_STREAMING_ENABLED', 'true').lower() == 'true'
+SLACK_UPDATE_INTERVAL_MS = int(os.environ.get('SLACK_UPDATE_INTERVAL_MS', '1000'))
+SLACK_UPDATE_HEADROOM_MS = int(os.environ.get('SLACK_UPDATE_HEADROOM_MS', '100'))
+SLACK_PLACEHOLDER_TEXT = os.environ.get('SLACK_PLACEHOLDER_TEXT', ':hourglass_flowing_sand: Looking that up...')
+# Longest wait on a Retry-After before the final update is retried
+MAX_FINAL_RETRY_SECONDS = 5
+
+# Function to read the Retry-After seconds of a rate limited Slack call, None when the call was not rate limited
+def retry_after(error):
+    response = error.response
+    if getattr(response, 'status_code', None) != 429 and response.get('error') != 'ratelimited':
+        return None
+    try:
+        return float((getattr(response, 'headers', None) or {}).get('Retry-After', 1))
+    except ValueError:
+        return 1.0
+
+class SlackMessageStream:
+    def __init__(self, client, channel_id, interval_ms=SLACK_UPDATE_INTERVAL_MS, headroom_ms=SLACK_UPDATE_HEADROOM_MS):
+        self.client = client
+        self.channel_id = channel_id
+        self.interval = (interval_ms + headroom_ms) / 1000.0
+        self.ts = None          # timestamp of the placeholder message, None if it could not be posted
+        self.parts = []
+        self.shown = ""         # text of the last update Slack accepted
+        self.next_update = 0.0  # monotonic time before which no update is sent
+        self.last_call_at = None  # monotonic time the previous Slack call returned
+        self.first_text_at = None  # perf_counter time answer text first became visible
+        self.counters = {'updates': 0, 'rate_limited': 0, 'failed': 0}
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    # Posts the placeholder message that is later edited, returns False if Slack refused it
+    def start(self, text=SLACK_PLACEHOLDER_TEXT):
+        try:
+            self.ts = self.client.chat_postMessage(channel=self.channel_id, text=text)['ts']
+        except SlackApiError as e:
+            print(f"Failed to post the placeholder message: {e.response['error']}")
+        self.last_call_at = time.monotonic()
+        self.next_update = self.last_call_at + self.interval
+        return self.ts is not None
+
+    # Adds streamed text, the message is only edited once the update interval has passed
+    def append(self, text):
+        self.parts.append(text)
+        if self.ts is not None and time.monotonic() >= self.next_update:
+            self.update(self.text)
+
+    # Edits the message, returns the seconds to wait if Slack rate limited the update, otherwise 0
+    def update(self, text):
+        if not text.strip() or text == self.shown:
+            return 0
+        try:
+            self.client.chat_update(channel=self.channel_id, ts=self.ts, text=text)
+        except SlackApiError as e:
+            wait = retry_after(e)
+            if wait is None:
+                print(f"Failed to update message: {e.response['error']}")
+                self.counters['failed'] += 1
+                return 0
+            self.counters['rate_limited'] += 1
+            self.next_update = time.monotonic() + max(wait, self.interval)
+            return wait
+        finally:
+            # Counted from the response, so the time the call took is never part of the interval
+            self.last_call_at = time.monotonic()
+            self.next_update = max(self.next_update, self.last_call_at + self.interval)
+        self.counters['updates'] += 1
+        self.shown = text
+        if self.first_text_at is None:
+            self.first_text_at = time.perf_counter()
+        return 0
+
+    # Replaces the message with the complete text, or posts it as a new message if there is no placeholder
+    def finish(self, text=None):
+        text = text if text is not None else self.text
+        if self.ts is None:
+            try:
+                self.client.chat_postMessage(channel=self.channel_id, text=text)
+                self.first_text_at = self.first_text_at or time.perf_counter()
+            except SlackApiError as e:
+                print(f"Failed to send message: {e.response['error']}")
+            return
+        if not text.strip() or text == self.shown:
+            return  # Nothing new to show, so nothing to wait for
+        # Only the rest of the interval since the previous call is waited out, nothing when it has passed
+        time.sleep(min(max(self.last_call_at + self.interval - time.monotonic(), 0), MAX_FINAL_RETRY_SECONDS))
+        wait = self.update(text)
+        if wait:
+            # The final text must land, wait out the rate limit once and retry
+            time.sleep(min(wait, MAX_FINAL_RETRY_SECONDS))
+            self.update(text)
+
+    def stats(self):
+        return dict(self.counters)
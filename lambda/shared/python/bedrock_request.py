@@ -0,0 +1,84 @@
+# Request bodies for the Anthropic models on Bedrock, shared by the web and Slack Lambdas.
+# The system prompt is sent as a static block that is byte-identical for every request, followed by the blocks
+# that change per request such as the response language. Once the static block reaches the model's minimum
+# cacheable length it is marked for prompt caching: Bedrock then caches the prefix up to the marker, so only the
+# tail and the messages are processed again on a cache hit. Shorter prefixes are never cached, so they are sent
+# without the marker. Today's prompts (about 1,000 tokens on the web, 140 in Slack) are below the minimum.
+import os
+import json
+
+from context_assembler import estimate_tokens
+
+PROMPT_CACHING_ENABLED = os.environ.get('PROMPT_CACHING_ENABLED', 'true').lower() == 'true'
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get('PROMPT_CACHE_MIN_TOKENS', '2048'))  # Claude 3.5 Haiku, 1024 for Sonnet models
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+# Function to check whether a static prompt is long enough for Bedrock to cache it
+def cacheable(static_prompt, min_tokens=PROMPT_CACHE_MIN_TOKENS):
+    return PROMPT_CACHING_ENABLED and estimate_tokens(static_prompt) >= min_tokens
+
+# Function to build the system blocks, the static block carries the cache marker when it can be cached
+def system_blocks(static_prompt, dynamic_prompt=None):
+    static_block = {"type": "text", "text": static_prompt}
+    if cacheable(static_prompt):
+        static_block["cache_control"] = {"type": "ephemeral"}
+    blocks = [static_block]
+    if dynamic_prompt:
+        blocks.append({"type": "text", "text": dynamic_prompt})
+    return blocks
+
+# Function to build the keyword arguments of invoke_model / invoke_model_with_response_stream
+def build_request(model_id, static_prompt, user_text, max_tokens, dynamic_prompt=None):
+    return {
+        "modelId": model_id,
+        "contentType": "application/json",
+        "accept": "application/json",
+        "body": json.dumps({
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": max_tokens,
+            "system": system_blocks(static_prompt, dynamic_prompt),
+            "messages": [{
+                "role": "user",
+                "content": [{
+                    "type": "text",
+                    "text": user_text
+                }]
+            }]
+        })
+    }
+
+# Function to return the bytes of a request body that Bedrock caches, the system blocks up to the end of the marked one
+def cached_prefix(kwargs):
+    body = kwargs["body"]
+    marker = '"cache_control": {"type": "ephemeral"}}'
+    start = body.find('"system": ')
+    end = body.find(marker)
+    return body[start:end + len(marker)].encode("utf-8") if start >= 0 and end >= 0 else b""
+
+# Token usage of one model call, read from the stream's message_start/message_delta events or a complete response
+class ModelUsage:
+    FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+    def __init__(self):
+        self.tokens = {field: 0 for field in self.FIELDS}
+        self.stop_reason = None  # end_turn for a complete answer, max_tokens when it was cut off
+
+    # Adds a usage object, usage in stream events is a running total for the message so the largest value is kept
+    def add(self, usage):
+        for field in self.FIELDS:
+            self.tokens[field] = max(self.tokens[field], usage.get(field) or 0)
+
+    # Reads the usage carried by a decoded stream event
+    def observe(self, event):
+        if event.get("type") == "message_start":
+            self.add(event.get("message", {}).get("usage", {}))
+        elif event.get("type") == "message_delta":
+            self.add(event.get("usage", {}))
+            self.stop_reason = event.get("delta", {}).get("stop_reason") or self.stop_reason
+
+    # Writes the token counts to a RequestTimer, they are emitted as Count metrics
+    def record(self, timer):
+        timer.count("InputTokens", self.tokens["input_tokens"])
+        timer.count("OutputTokens", self.tokens["output_tokens"])
+        timer.count("CacheReadInputTokens", self.tokens["cache_read_input_tokens"])
+        timer.count("CacheWriteInputTokens", self.tokens["cache_creation_input_tokens"])
@@ -0,0 +1,57 @@
+# Version of the cached knowledge base content, shared by the answer and retrieval caches of every container.
+# Invalidating a cache bumps a counter stored under "cache#version" in CACHE_VERSION_TABLE and every cache key
+# includes it, so entries cached before the bump are never read again by any container or tier, they only age
+# out. Containers re-read the counter at most every CACHE_VERSION_REFRESH_SECONDS, which bounds how long a warm
+# container keeps serving entries from before an invalidation made elsewhere.
+import os
+import time
+import threading
+
+from ttl_store import create_store
+
+CACHE_VERSION_REFRESH_SECONDS = float(os.environ.get('CACHE_VERSION_REFRESH_SECONDS', '10'))
+CACHE_VERSION_KEY = "cache#version"
+
+class CacheVersion:
+    def __init__(self, store=None, refresh_seconds=CACHE_VERSION_REFRESH_SECONDS, clock=time.monotonic):
+        self.store = store if store is not None else create_store('CACHE_VERSION_TABLE')
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.value = None  # last version read or written, None until the first read
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    # Returns the current version, read from the store when the last read is older than the refresh interval
+    def current(self):
+        with self.lock:
+            if self.value is not None and self.clock() < self.checked_at + self.refresh_seconds:
+                return self.value
+            # Other request threads keep using the last value while this one reads the store
+            self.checked_at = self.clock()
+            last = self.value
+        try:
+            stored = self.store.get(CACHE_VERSION_KEY) or 0
+        except Exception as e:
+            print(f"Cache version unavailable, keeping version {last or 0}: {e}")
+            with self.lock:
+                self.value = last or 0
+                return self.value
+        with self.lock:
+            self.value = stored
+            return self.value
+
+    # Moves every cache of every container to a new version, returns it
+    def bump(self):
+        def increment(current):
+            value = (current or 0) + 1
+            return value, value
+
+        value = self.store.update(CACHE_VERSION_KEY, increment)
+        with self.lock:
+            self.value = value
+            self.checked_at = self.clock()
+        print(f"Cache version bumped to {value}")
+        return value
+
+# Version shared by the caches of this container
+CACHE_VERSION = CacheVersion()
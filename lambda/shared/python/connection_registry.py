@@ -0,0 +1,33 @@
+# Registry of websocket connections, written by web-socket-handler on $connect/$disconnect and read by
+# get-response-from-bedrock before it spends a retrieval or a model call on a connection.
+# Disconnects are kept as tombstones so "closed" can be told apart from "never seen"; connections the
+# registry does not know about (for example with the in-memory stand-in) are treated as open.
+import time
+
+from ttl_store import create_store
+
+# API Gateway closes websocket connections after two hours at most
+CONNECTION_TTL_SECONDS = 2 * 60 * 60
+
+class ConnectionRegistry:
+    def __init__(self, store=None, ttl_seconds=CONNECTION_TTL_SECONDS):
+        self.store = store if store is not None else create_store('CONNECTION_TABLE')
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, connection_id):
+        return f"connection#{connection_id}"
+
+    def connect(self, connection_id):
+        self.store.put(self.key(connection_id), {"state": "connected", "at": int(time.time())}, self.ttl_seconds)
+
+    def disconnect(self, connection_id):
+        self.store.put(self.key(connection_id), {"state": "disconnected", "at": int(time.time())}, self.ttl_seconds)
+
+    # Returns False only when the connection is known to be closed, lookup errors count as open
+    def is_open(self, connection_id):
+        try:
+            entry = self.store.get(self.key(connection_id))
+        except Exception as e:
+            print(f"Connection registry unavailable: {e}")
+            return True
+        return entry is None or entry.get("state") != "disconnected"
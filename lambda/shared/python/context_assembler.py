@@ -0,0 +1,82 @@
+# Assembly of the knowledge base context sent to the model, shared by the web and Slack Lambda functions.
+# Retrieval results below RAG_MIN_SCORE are dropped, chunks that mostly repeat a better scoring chunk
+# (overlapping chunking windows, the same page ingested twice) are dropped, and the remaining chunks are
+# packed best first into a budget of RAG_CONTEXT_TOKENS. Tokens are estimated at four characters each.
+import os
+import string
+
+RAG_MIN_SCORE = float(os.environ.get('RAG_MIN_SCORE', '0.2'))
+RAG_CONTEXT_TOKENS = int(os.environ.get('RAG_CONTEXT_TOKENS', '1500'))
+RAG_DUPLICATE_THRESHOLD = float(os.environ.get('RAG_DUPLICATE_THRESHOLD', '0.8'))
+
+# Punctuation is replaced by spaces before splitting into words, much faster than a word regex
+PUNCTUATION_TABLE = str.maketrans({character: ' ' for character in string.punctuation})
+
+# Function to estimate the number of model tokens in a text
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+# Function to return the set of word 3-grams of a text, used to compare chunks
+def shingles(text):
+    words = text.lower().translate(PUNCTUATION_TABLE).split()
+    if len(words) < 3:
+        return {tuple(words)} if words else set()
+    return set(zip(words, words[1:], words[2:]))
+
+# Function to cut a text to a token budget, at a word boundary where possible
+def truncate_to_tokens(text, tokens):
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+# The chunks selected for a prompt, with counts of what was left out and why
+class AssembledContext:
+    def __init__(self, chunks, dropped):
+        self.chunks = chunks
+        self.dropped = dropped
+        self.text = "\n".join(chunks)
+        self.tokens = estimate_tokens(self.text)
+
+    def stats(self):
+        return dict(self.dropped, used=len(self.chunks), tokens=self.tokens)
+
+# Function to select and order the retrieval results that go into the prompt
+def assemble_context(results, budget_tokens=RAG_CONTEXT_TOKENS, min_score=RAG_MIN_SCORE, duplicate_threshold=RAG_DUPLICATE_THRESHOLD):
+    dropped = {'low_score': 0, 'duplicate': 0, 'over_budget': 0}
+    candidates = []
+    for result in results:
+        text = (result.get('content', {}).get('text') or '').strip()
+        score = result.get('score')
+        if not text:
+            continue
+        if score is not None and score < min_score:
+            dropped['low_score'] += 1
+            continue
+        candidates.append((score if score is not None else 0.0, text))
+    # Best first, the sort is stable so equal scores keep the knowledge base order
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    chunks = []
+    selected_shingles = []
+    remaining = budget_tokens
+    for score, text in candidates:
+        # The budget is checked first, it is much cheaper than comparing chunks
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            # The best chunk is cut to fit rather than sending no context at all
+            if chunks or remaining <= 0:
+                dropped['over_budget'] += 1
+                continue
+            text = truncate_to_tokens(text, remaining)
+            tokens = estimate_tokens(text)
+        # Share of this chunk's 3-grams already present in a selected chunk
+        text_shingles = shingles(text)
+        if any(len(text_shingles & other) >= duplicate_threshold * min(len(text_shingles), len(other)) for other in selected_shingles if other and text_shingles):
+            dropped['duplicate'] += 1
+            continue
+        chunks.append(text)
+        selected_shingles.append(text_shingles)
+        remaining -= tokens
+    return AssembledContext(chunks, dropped)
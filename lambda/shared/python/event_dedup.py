@@ -0,0 +1,77 @@
+# Idempotency of Slack event deliveries, shared by horizon-slackbot-opener and horizon-slackbot.
+# Slack redelivers an event when it gets no 200 within 3 seconds (the retry carries X-Slack-Retry-Num), and the
+# same mention can also arrive twice on its own. Each stage claims the event ID once in a TTL store before doing
+# any work: the opener before invoking the processor, the processor before retrieval, Asana or Bedrock.
+# Claims of the two stages use separate keys so the opener's claim does not stop the processor.
+# Store errors let the event through, a possible duplicate answer is better than a lost one.
+import os
+import json
+import time
+
+from ttl_store import create_store
+
+# Slack stops retrying an event after about an hour
+SLACK_EVENT_TTL_SECONDS = int(os.environ.get('SLACK_EVENT_TTL_SECONDS', str(2 * 60 * 60)))
+
+# Function to read the ID Slack delivers an event under, falling back to the message for events without one
+def event_key(slack_event):
+    if slack_event.get('event_id'):
+        return slack_event['event_id']
+    event_data = slack_event.get('event', {})
+    if event_data.get('client_msg_id'):
+        return event_data['client_msg_id']
+    if event_data.get('channel') and event_data.get('ts'):
+        return f"{event_data['channel']}:{event_data['ts']}"
+    return None
+
+# Function to read the X-Slack-Retry-Num header of an API Gateway event, 0 for a first delivery
+def retry_number(headers):
+    for name, value in (headers or {}).items():
+        if name.lower() == 'x-slack-retry-num':
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
+
+class EventDeduplicator:
+    def __init__(self, store=None, ttl_seconds=SLACK_EVENT_TTL_SECONDS):
+        self.store = store if store is not None else create_store('SLACK_EVENT_TABLE')
+        self.ttl_seconds = ttl_seconds
+        self.counters = {'claimed': 0, 'suppressed': 0, 'retries': 0}
+
+    def key(self, stage, event_id):
+        return f"slack-event#{stage}#{event_id}"
+
+    # Claims an event for a stage, returns False when the stage already handled it and it should be dropped
+    def claim(self, stage, slack_event, retry_num=0):
+        event_id = event_key(slack_event)
+        if retry_num:
+            self.counters['retries'] += 1
+        if event_id is None:
+            return True
+        try:
+            claimed = self.store.put_if_absent(self.key(stage, event_id), {"at": int(time.time()), "retry": retry_num}, self.ttl_seconds)
+        except Exception as e:
+            print(f"Slack event store unavailable, processing {event_id} anyway: {e}")
+            return True
+        self.counters['claimed' if claimed else 'suppressed'] += 1
+        if not claimed:
+            print(json.dumps({"duplicate_event": event_id, "stage": stage, "retry_num": retry_num, "duplicates_suppressed": self.counters['suppressed']}))
+        return claimed
+
+    # Gives a claim back, so a retry of an event whose handling failed is processed
+    def release(self, stage, slack_event):
+        event_id = event_key(slack_event)
+        if event_id is None:
+            return
+        try:
+            self.store.delete(self.key(stage, event_id))
+        except Exception as e:
+            print(f"Failed to release Slack event {event_id}: {e}")
+
+    def stats(self):
+        return dict(self.counters)
+
+# Deduplicator shared by every invocation of a warm container
+SLACK_EVENTS = EventDeduplicator()
@@ -0,0 +1,71 @@
+# Local intent classifier for Slack mentions and web chat messages, used to decide which pipeline stages run
+# (the web chat has no schedule or canned replies and answers those intents as knowledge questions):
+#   schedule     -> schedule index (model only for questions that need reasoning), no retrieval
+#   knowledge    -> knowledge base retrieval and the full prompt
+#   small_talk   -> short model call without retrieval or the large prompt
+#   out_of_scope -> canned reply, no retrieval and no model call
+import re
+import time
+import json
+
+from telemetry import info
+
+SCHEDULE = "schedule"
+KNOWLEDGE = "knowledge"
+SMALL_TALK = "small_talk"
+OUT_OF_SCOPE = "out_of_scope"
+INTENTS = (SCHEDULE, KNOWLEDGE, SMALL_TALK, OUT_OF_SCOPE)
+
+SCHEDULE_PATTERN = re.compile(r"\b(schedules?|shifts?|monday|tuesday|wednesday|thursday|friday)\b", re.IGNORECASE)
+# Weaker schedule wording that only counts when the prompt is not about the CIC itself ("what is the CIC working on?")
+SCHEDULE_HINT_PATTERN = re.compile(r"\b(working|works|in the office|in office|hours|this week|next week)\b", re.IGNORECASE)
+SMALL_TALK_PATTERN = re.compile(
+    r"^\W*(hi|hello|hey|howdy|yo|good (morning|afternoon|evening)|thanks|thank you|thx|cheers|bye|goodbye|"
+    r"how are you|how's it going|what's up|who are you|what are you|what can you do|help)\b",
+    re.IGNORECASE
+)
+OUT_OF_SCOPE_PATTERN = re.compile(
+    r"\b(weather|forecast|stock price|stocks|bitcoin|crypto|sports?|score|recipe|movie|song|lyrics|horoscope|lottery|election)\b",
+    re.IGNORECASE
+)
+CIC_PATTERN = re.compile(r"\b(cic|cloud innovation|asu|arizona state|aws|amazon|project|projects|team|student|students)\b", re.IGNORECASE)
+SMALL_TALK_MAX_WORDS = 6
+
+# Function to classify a sanitized prompt into one of the INTENTS
+def classify_intent(prompt):
+    text = prompt.strip()
+    if not text:
+        return SMALL_TALK
+    if SCHEDULE_PATTERN.search(text):
+        return SCHEDULE
+    mentions_cic = CIC_PATTERN.search(text) is not None
+    if not mentions_cic and SCHEDULE_HINT_PATTERN.search(text):
+        return SCHEDULE
+    if not mentions_cic and SMALL_TALK_PATTERN.search(text) and len(text.split()) <= SMALL_TALK_MAX_WORDS:
+        return SMALL_TALK
+    if not mentions_cic and OUT_OF_SCOPE_PATTERN.search(text):
+        return OUT_OF_SCOPE
+    return KNOWLEDGE
+
+# Per-intent request counts, downstream call counts and latency for the lifetime of the container
+class IntentMetrics:
+    def __init__(self):
+        self.totals = {intent: {'requests': 0, 'retrieve': 0, 'model': 0, 'asana': 0, 'latency_ms': 0.0} for intent in INTENTS}
+
+    # Records one handled request and logs it together with the running totals of its intent
+    def record(self, intent, started, calls):
+        latency_ms = (time.perf_counter() - started) * 1000
+        totals = self.totals[intent]
+        totals['requests'] += 1
+        totals['latency_ms'] += latency_ms
+        for name, count in calls.items():
+            totals[name] += count
+        average = totals['latency_ms'] / totals['requests']
+        info(json.dumps({
+            'intent': intent,
+            'latency_ms': round(latency_ms, 1),
+            'calls': calls,
+            'intent_totals': dict(totals, latency_ms=round(totals['latency_ms'], 1), average_latency_ms=round(average, 1))
+        }))
+
+INTENT_METRICS = IntentMetrics()
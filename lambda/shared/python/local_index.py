@@ -0,0 +1,170 @@
+# Embedded BM25 index of the knowledge base documents, queried in-process in front of the Bedrock knowledge base.
+# The index file is built offline by scripts/build_kb_index.py and shipped in the shared layer next to this module.
+# Layout (little-endian): 8 byte magic, uint32 header length, JSON header (terms, chunks, BM25 parameters),
+# then 4-byte aligned sections of uint32 posting chunk IDs, uint32 term frequencies and the UTF-8 chunk texts.
+# The sections are read through mmap, so only the pages a query touches are loaded.
+# Questions the index covers poorly (low confidence) fall back to the Bedrock knowledge base through RETRIEVAL_CACHE.
+import os
+import json
+import math
+import mmap
+import time
+import string
+import struct
+from collections import defaultdict
+
+from retrieval_cache import RETRIEVAL_CACHE
+
+LOCAL_INDEX_ENABLED = os.environ.get('LOCAL_INDEX_ENABLED', 'true').lower() == 'true'
+LOCAL_INDEX_PATH = os.environ.get('LOCAL_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kb_index.bin'))
+LOCAL_INDEX_MIN_CONFIDENCE = float(os.environ.get('LOCAL_INDEX_MIN_CONFIDENCE', '0.75'))
+LOCAL_INDEX_RESULTS = int(os.environ.get('LOCAL_INDEX_RESULTS', '5'))
+
+MAGIC = b"CICIDX1\0"
+PUNCTUATION_TABLE = str.maketrans({character: ' ' for character in string.punctuation})
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been but by can could did do does for from had has have he her
+him his how i if in into is it its me my no not of on or our she so than that the their them then there these they
+this to up us was we were what when where which who whom why will with would you your tell please know
+""".split())
+
+# Function to split text into index terms, the build step and queries must use the same function
+def tokenize(text):
+    return [word for word in text.lower().translate(PUNCTUATION_TABLE).split() if word not in STOPWORDS]
+
+# Function to write an index of the given chunks, chunks are (source, text) pairs
+def write_index(chunks, path, k1=1.2, b=0.75):
+    postings = defaultdict(list)
+    lengths = []
+    for chunk_id, (source, text) in enumerate(chunks):
+        counts = defaultdict(int)
+        for term in tokenize(text):
+            counts[term] += 1
+        lengths.append(sum(counts.values()))
+        for term, count in counts.items():
+            postings[term].append((chunk_id, count))
+
+    count = len(chunks)
+    terms = {}
+    ids, frequencies = [], []
+    for term in sorted(postings):
+        entries = postings[term]
+        idf = math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+        terms[term] = [len(ids), len(entries), round(idf, 6)]
+        ids.extend(chunk_id for chunk_id, _ in entries)
+        frequencies.extend(tf for _, tf in entries)
+
+    texts, chunk_entries, offset = [], [], 0
+    for (source, text), length in zip(chunks, lengths):
+        encoded = text.encode("utf-8")
+        chunk_entries.append([source, offset, len(encoded), length])
+        texts.append(encoded)
+        offset += len(encoded)
+
+    header = json.dumps({
+        "version": 1, "k1": k1, "b": b, "avgdl": (sum(lengths) / count) if count else 0.0,
+        "chunks": chunk_entries, "terms": terms, "postings": len(ids),
+    }, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+    with open(path, "wb") as output:
+        output.write(MAGIC + struct.pack("<I", len(header)) + header)
+        output.write(struct.pack(f"<{len(ids)}I", *ids))
+        output.write(struct.pack(f"<{len(frequencies)}I", *frequencies))
+        output.write(b"".join(texts))
+
+class LocalIndex:
+    def __init__(self, path):
+        with open(path, "rb") as source:
+            self.map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a knowledge base index")
+        header_length = struct.unpack_from("<I", self.map, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(self.map[start:start + header_length])
+        self.k1, self.b, self.avgdl = header["k1"], header["b"], header["avgdl"] or 1.0
+        self.chunks = header["chunks"]
+        self.terms = header["terms"]
+        view = memoryview(self.map)
+        postings_start = start + header_length
+        postings_end = postings_start + 4 * header["postings"]
+        self.ids = view[postings_start:postings_end].cast("I")
+        self.frequencies = view[postings_end:postings_end + 4 * header["postings"]].cast("I")
+        self.text_start = postings_end + 4 * header["postings"]
+        # Weight of a query term the documents never mention, so unknown terms lower the confidence
+        self.missing_idf = math.log(1 + (len(self.chunks) + 0.5) / 0.5)
+
+    def text(self, chunk_id):
+        _, offset, length, _ = self.chunks[chunk_id]
+        start = self.text_start + offset
+        return self.map[start:start + length].decode("utf-8")
+
+    # Returns the best chunks in the shape of agent.retrieve results, and the confidence of the best one
+    # A result's score is the idf-weighted share of the question's terms found in the chunk, between 0 and 1
+    def search(self, text, limit=LOCAL_INDEX_RESULTS):
+        query = set(tokenize(text))
+        if not query:
+            return [], 0.0
+        scores = defaultdict(float)
+        matched = defaultdict(float)
+        total_idf = 0.0
+        for term in query:
+            entry = self.terms.get(term)
+            if entry is None:
+                total_idf += self.missing_idf
+                continue
+            start, count, idf = entry
+            total_idf += idf
+            for position in range(start, start + count):
+                chunk_id = self.ids[position]
+                tf = self.frequencies[position]
+                length = self.chunks[chunk_id][3]
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.avgdl))
+                matched[chunk_id] += idf
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        results = [{
+            "content": {"text": self.text(chunk_id)},
+            "location": {"type": "LOCAL", "localLocation": {"uri": self.chunks[chunk_id][0]}},
+            "score": round(matched[chunk_id] / total_idf, 4) if total_idf else 0.0,
+        } for chunk_id in best]
+        return results, (results[0]["score"] if results else 0.0)
+
+# Function to open the shipped index, returns None when there is no index or it is turned off
+def load_local_index(path=LOCAL_INDEX_PATH):
+    if not LOCAL_INDEX_ENABLED or not os.path.exists(path):
+        return None
+    try:
+        return LocalIndex(path)
+    except Exception as e:
+        print(f"Failed to open the local knowledge base index {path}: {e}")
+        return None
+
+# Retrieval through the local index first, with the Bedrock knowledge base (through the retrieval cache) as fallback
+class HybridRetriever:
+    def __init__(self, index=None, fallback=RETRIEVAL_CACHE, min_confidence=LOCAL_INDEX_MIN_CONFIDENCE):
+        self.index = index
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.counters = {'local': 0, 'fallback': 0, 'local_ms': 0.0}
+
+    # Drop-in replacement for RETRIEVAL_CACHE.retrieve(agent, kb_id, text)
+    def retrieve(self, agent, kb_id, text, **kwargs):
+        if self.index is not None:
+            started = time.perf_counter()
+            results, confidence = self.index.search(text)
+            self.counters['local_ms'] += (time.perf_counter() - started) * 1000
+            if confidence >= self.min_confidence:
+                self.counters['local'] += 1
+                return {"retrievalResults": results}
+        self.counters['fallback'] += 1
+        return self.fallback.retrieve(agent, kb_id, text, **kwargs)
+
+    def stats(self):
+        lookups = self.counters['local'] + self.counters['fallback']
+        return {
+            'local': self.counters['local'],
+            'fallback': self.counters['fallback'],
+            'avg_local_ms': round(self.counters['local_ms'] / lookups, 3) if lookups and self.index is not None else 0.0,
+        }
+
+# Retriever shared by every invocation of a warm container
+KB_RETRIEVER = HybridRetriever(load_local_index())
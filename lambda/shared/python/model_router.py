@@ -0,0 +1,91 @@
+# Routing of each question to a model, a max_tokens budget and whether knowledge base context is included,
+# shared by the web and Slack Lambda functions. The decision only uses cheap local features: the intent, the
+# number of words in the prompt, the number of conversation turns and, once retrieved, the best retrieval score.
+# Routes are checked in order and the first whose conditions all hold is used, the last route should match
+# everything. MODEL_ROUTING_TABLE replaces the default table with a JSON list of routes of the same shape.
+import os
+import json
+import time
+
+from telemetry import info
+
+DEFAULT_MODEL_ID = os.environ.get('MODEL_ID', "anthropic.claude-3-5-haiku-20241022-v1:0")
+
+DEFAULT_ROUTES = [
+    # Greetings and thanks, a short reply without retrieval
+    {"name": "small_talk", "when": {"intent": ["small_talk"], "max_prompt_words": 8}, "max_tokens": 150, "use_rag": False},
+    # Schedule questions carry their own data, the knowledge base is not needed
+    {"name": "schedule", "when": {"intent": ["schedule"]}, "max_tokens": 1000, "use_rag": False},
+    # Short first questions the knowledge base matches well
+    {"name": "simple", "when": {"max_prompt_words": 12, "max_history_turns": 0, "min_top_score": 0.5}, "max_tokens": 600, "use_rag": True},
+    # Everything else gets the full treatment
+    {"name": "full", "when": {}, "max_tokens": 1000, "use_rag": True},
+]
+
+# Function to read the routing table, falling back to the default table when MODEL_ROUTING_TABLE is invalid
+def load_routes():
+    table = os.environ.get('MODEL_ROUTING_TABLE')
+    if not table:
+        return DEFAULT_ROUTES
+    try:
+        routes = json.loads(table)
+        if not isinstance(routes, list) or not routes:
+            raise ValueError("expected a non-empty list of routes")
+        return routes
+    except ValueError as e:
+        print(f"Invalid MODEL_ROUTING_TABLE, using the default routes: {e}")
+        return DEFAULT_ROUTES
+
+# The route chosen for a request
+class Route:
+    def __init__(self, name, model_id, max_tokens, use_rag):
+        self.name = name
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.use_rag = use_rag
+
+    def as_dict(self):
+        return {"route": self.name, "model_id": self.model_id, "max_tokens": self.max_tokens, "use_rag": self.use_rag}
+
+class ModelRouter:
+    def __init__(self, routes=None, default_model_id=DEFAULT_MODEL_ID):
+        self.routes = routes if routes is not None else load_routes()
+        self.default_model_id = default_model_id
+        self.totals = {}
+
+    # Function to check the conditions of a route, score conditions never hold before retrieval
+    def matches(self, when, features):
+        if "intent" in when and features.get("intent") not in when["intent"]:
+            return False
+        for name in ("prompt_words", "history_turns", "top_score"):
+            value = features.get(name)
+            if f"max_{name}" in when and (value is None or value > when[f"max_{name}"]):
+                return False
+            if f"min_{name}" in when and (value is None or value < when[f"min_{name}"]):
+                return False
+        return True
+
+    # Picks the route for a request, features are intent, prompt_words, history_turns and top_score (None before retrieval)
+    def route(self, features):
+        for route in self.routes:
+            if self.matches(route.get("when", {}), features):
+                return Route(route["name"], route.get("model_id", self.default_model_id), route["max_tokens"], route.get("use_rag", True))
+        return Route("default", self.default_model_id, 1000, True)
+
+    # Records the latency of a routed request and logs it with the running totals of its route
+    def record(self, route, started, **extra):
+        latency_ms = (time.perf_counter() - started) * 1000
+        totals = self.totals.setdefault(route.name, {'requests': 0, 'latency_ms': 0.0})
+        totals['requests'] += 1
+        totals['latency_ms'] += latency_ms
+        info(json.dumps(dict(route.as_dict(), latency_ms=round(latency_ms, 1), **extra, route_totals={
+            'requests': totals['requests'],
+            'average_latency_ms': round(totals['latency_ms'] / totals['requests'], 1),
+        })))
+
+# Function to collect the routing features of a prompt
+def route_features(intent, prompt, history_turns=0, top_score=None):
+    return {"intent": intent, "prompt_words": len(prompt.split()), "history_turns": history_turns, "top_score": top_score}
+
+# Router shared by every invocation of a warm container
+MODEL_ROUTER = ModelRouter()
@@ -0,0 +1,239 @@
+# Routing of model calls across a pool of Bedrock regions, shared by the web and Slack Lambda functions.
+# Every region of BEDROCK_REGIONS gets one client per container and a health record: a moving average of the
+# time to the first text token and of the error rate. Each request goes to the region with the lowest
+# latency scaled up by its error rate, regions not tried yet count with REGION_PRIOR_MS and ties keep the pool
+# order, so the first region is the home region. A few requests (REGION_EXPLORE_RATE) go to the least tried
+# other region so every region is measured and a recovered region is noticed again. A stream that is
+# throttled, fails or produces no text token within its deadline fails over to the next region (it is closed
+# first), a blocking call only on errors. A region failing REGION_BREAKER_FAILURES times in a row is
+# skipped until a trial call after REGION_BREAKER_RESET_SECONDS succeeds (when every breaker is open the best
+# region is tried anyway). With a single region the failed call is retried there with jittered backoff.
+# Once the first text token arrived the stream is never moved.
+# The model (or inference profile) must be enabled in every region of the pool.
+import os
+import time
+import random
+import threading
+import json
+from concurrent.futures import wait
+
+from resilience import EXECUTOR, MODEL_DEADLINE_MS, RETRY_MAX_ATTEMPTS, CircuitBreaker, DeadlineExceeded, backoff_delay, is_retryable
+
+BEDROCK_REGIONS = [region.strip() for region in os.environ.get('BEDROCK_REGIONS', 'us-west-2').split(',') if region.strip()]
+REGION_FIRST_TOKEN_DEADLINE_MS = int(os.environ.get('REGION_FIRST_TOKEN_DEADLINE_MS', '5000'))  # Per region, MODEL_DEADLINE_MS caps all of them
+REGION_MAX_ATTEMPTS = int(os.environ.get('REGION_MAX_ATTEMPTS', str(RETRY_MAX_ATTEMPTS)))
+REGION_EWMA_ALPHA = float(os.environ.get('REGION_EWMA_ALPHA', '0.2'))  # Weight of the newest call in the moving averages
+REGION_ERROR_PENALTY = float(os.environ.get('REGION_ERROR_PENALTY', '4'))  # A 25% error rate doubles a region's score
+REGION_PRIOR_MS = float(os.environ.get('REGION_PRIOR_MS', '1000'))
+REGION_EXPLORE_RATE = float(os.environ.get('REGION_EXPLORE_RATE', '0.05'))
+REGION_BREAKER_FAILURES = int(os.environ.get('REGION_BREAKER_FAILURES', '3'))
+REGION_BREAKER_RESET_SECONDS = float(os.environ.get('REGION_BREAKER_RESET_SECONDS', '30'))
+
+# Function to close a model stream (a botocore EventStream), so Bedrock stops generating
+def close_stream(body):
+    if body is not None and hasattr(body, 'close'):
+        try:
+            body.close()
+        except Exception as e:
+            print(f"Failed to close an abandoned model stream: {e}")
+
+# Function to read a model stream up to and including its first text token, returns the events read
+def read_until_text(events):
+    head = []
+    for event in events:
+        head.append(event)
+        chunk = event.get('chunk')
+        if chunk and json.loads(chunk['bytes'].decode('utf-8')).get('type') == 'content_block_delta':
+            break
+    return head
+
+# A model stream whose first events were already read, iterates them and then the rest of the stream
+# close() reaches the original stream, so a reader can still end the generation early
+class StartedStream:
+    def __init__(self, stream, events, head):
+        self.stream = stream
+        self.events = events
+        self.head = head
+
+    def __iter__(self):
+        yield from self.head
+        self.head = []
+        yield from self.events
+
+    def close(self):
+        close_stream(self.stream)
+
+# Moving averages of one region
+class RegionHealth:
+    def __init__(self, region, alpha=REGION_EWMA_ALPHA, failure_threshold=REGION_BREAKER_FAILURES, reset_seconds=REGION_BREAKER_RESET_SECONDS):
+        self.region = region
+        self.alpha = alpha
+        self.latency_ms = None  # moving average time to the first text token, None until a call finished
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.breaker = CircuitBreaker(f"bedrock {region}", failure_threshold, reset_seconds)
+        self.lock = threading.Lock()
+
+    # Adds one call, latency_ms is left out for calls that failed before their deadline
+    def observe(self, latency_ms=None, failed=False):
+        with self.lock:
+            self.calls += 1
+            self.failures += failed
+            self.error_rate += self.alpha * ((1.0 if failed else 0.0) - self.error_rate)
+            if latency_ms is not None:
+                self.latency_ms = latency_ms if self.latency_ms is None else self.latency_ms + self.alpha * (latency_ms - self.latency_ms)
+
+    # Lower is better: the expected latency, scaled up by the share of failing calls
+    def score(self, error_penalty=REGION_ERROR_PENALTY, prior_ms=REGION_PRIOR_MS):
+        latency = self.latency_ms if self.latency_ms is not None else prior_ms
+        return latency * (1.0 + error_penalty * self.error_rate)
+
+    def stats(self):
+        return {'latency_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None, 'error_rate': round(self.error_rate, 3),
+                'calls': self.calls, 'failures': self.failures, 'breaker': self.breaker.state}
+
+# Drop-in for a bedrock-runtime client, invoke_model and invoke_model_with_response_stream go to the best region
+class RegionRouter:
+    def __init__(self, regions, client_factory, first_token_deadline_ms=REGION_FIRST_TOKEN_DEADLINE_MS, total_deadline_ms=MODEL_DEADLINE_MS,
+                 max_attempts=REGION_MAX_ATTEMPTS, explore_rate=REGION_EXPLORE_RATE, rng=None):
+        self.regions = list(regions)
+        self.client_factory = client_factory
+        self.first_token_deadline = first_token_deadline_ms / 1000.0
+        self.total_deadline = total_deadline_ms / 1000.0
+        self.max_attempts = max_attempts
+        self.explore_rate = explore_rate
+        self.rng = rng or random.Random()
+        self.health = {region: RegionHealth(region) for region in self.regions}
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'failovers': 0, 'retries': 0, 'explored': 0, 'exhausted': 0, 'last_resort': 0}
+
+    # Counters are updated by every request thread of the container
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Returns the client of a region, created on first use and reused for the lifetime of the container
+    def client(self, region):
+        with self.lock:
+            if region not in self.clients:
+                self.clients[region] = self.client_factory(region)
+            return self.clients[region]
+
+    # Regions in the order they should be tried, best score first and open breakers last
+    def ranked(self):
+        order = sorted(self.regions, key=lambda region: (self.health[region].breaker.state == 'open', self.health[region].score(), self.regions.index(region)))
+        healthy = [region for region in order if self.health[region].breaker.state != 'open']
+        if len(healthy) > 1 and self.rng.random() < self.explore_rate:
+            # The region tried the fewest times, so every region of the pool gets measured
+            explored = min(healthy[1:], key=lambda region: self.health[region].calls)
+            order.remove(explored)
+            order.insert(0, explored)
+            self.count('explored')
+        return order
+
+    def invoke_model(self, **kwargs):
+        return self.call('invoke_model', kwargs, stream=False)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self.call('invoke_model_with_response_stream', kwargs, stream=True)
+
+    # Makes the call in the best region, failing over while nothing has been streamed yet
+    def call(self, method, kwargs, stream):
+        self.count('calls')
+        deadline = time.monotonic() + self.total_deadline
+        order = self.ranked()
+        plan = (order * self.max_attempts)[:self.max_attempts]
+        tried = []
+        error = None
+        for region in plan:
+            if not self.health[region].breaker.allow():
+                continue
+            if tried:
+                if region in tried:
+                    delay = backoff_delay(len(tried) - 1)
+                    if time.monotonic() + delay >= deadline:
+                        break
+                    self.count('retries')
+                    time.sleep(delay)
+                else:
+                    self.count('failovers')
+                    print(f"Bedrock failover from {tried[-1]} to {region} after {type(error).__name__}: {error}")
+            tried.append(region)
+            try:
+                return self.attempt(region, method, kwargs, stream, deadline)
+            except Exception as e:
+                if not (isinstance(e, DeadlineExceeded) or is_retryable(e)):
+                    raise
+                error = e
+        if not tried:
+            # Every breaker is open, the best region still gets the call rather than no region at all
+            self.count('last_resort')
+            return self.attempt(order[0], method, kwargs, stream, deadline)
+        self.count('exhausted')
+        print(f"No Bedrock region could take the call, stats: {self.stats()}")
+        raise error
+
+    # One call in one region, recorded in the region's moving averages and breaker
+    def attempt(self, region, method, kwargs, stream, deadline):
+        health = self.health[region]
+        remaining = deadline - time.monotonic()
+        started = time.monotonic()
+        try:
+            response = self.start(region, method, kwargs, stream, min(self.first_token_deadline, remaining))
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded) or is_retryable(e):
+                health.observe((time.monotonic() - started) * 1000 if isinstance(e, DeadlineExceeded) else None, failed=True)
+                health.breaker.record_failure()
+            else:
+                # The region answered, the request itself was rejected and would be everywhere
+                health.breaker.record_success()
+            raise
+        # A blocking call takes as long as its answer, only streams measure the time to the first token
+        health.observe((time.monotonic() - started) * 1000 if stream else None)
+        health.breaker.record_success()
+        return response
+
+    # One attempt in one region. A blocking call runs on the caller's thread without a deadline, only errors
+    # move it to another region, so a long generation is never sent twice. A stream runs on a worker thread
+    # and only counts as started once its first text token arrived, an attempt abandoned at its deadline has
+    # its stream closed so the region stops generating for nobody.
+    def start(self, region, method, kwargs, stream, timeout):
+        client = self.client(region)
+        if not stream:
+            return getattr(client, method)(**kwargs)
+        lock = threading.Lock()
+        state = {'abandoned': False, 'body': None}
+
+        def attempt():
+            response = getattr(client, method)(**kwargs)
+            body = response['body']
+            with lock:
+                if state['abandoned']:
+                    close_stream(body)
+                    return None
+                state['body'] = body
+            events = iter(body)
+            head = read_until_text(events)
+            with lock:
+                if state['abandoned']:
+                    # Given up while waiting for the first token, closing it here covers streams that cannot be closed mid-read
+                    close_stream(body)
+                    return None
+            return dict(response, body=StartedStream(body, events, head))
+
+        future = EXECUTOR.submit(attempt)
+        done, _ = wait([future], timeout=max(0.0, timeout))
+        if not done:
+            with lock:
+                state['abandoned'] = True
+                body = state['body']
+            close_stream(body)
+            raise DeadlineExceeded(f"{method} in {region} had no text after {timeout * 1000:.0f} ms")
+        return future.result()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, regions={region: health.stats() for region, health in self.health.items()})
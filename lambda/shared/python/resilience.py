@@ -0,0 +1,251 @@
+# Deadlines, retries, hedged requests and a circuit breaker for the AWS calls of the Lambda functions.
+# Model calls use the deadline and retry settings through region_router.py.
+# Each kind of call has a CallPolicy: the call runs on a worker thread so it can be abandoned at its deadline,
+# throttling and transient errors are retried with jittered exponential backoff while the deadline allows,
+# and idempotent calls (retrieve, translate_text) are hedged: when an attempt is slower than the recent
+# HEDGE_PERCENTILE latency (HEDGE_INITIAL_MS until enough calls were seen, never later than HEDGE_MAX_MS)
+# a second identical request is sent and the first answer wins.
+# Once enough calls were seen, a policy with a minimum deadline (retrieve, which the handlers can skip) uses
+# ADAPTIVE_DEADLINE_MULTIPLIER times the recent p99 latency as its deadline, between that minimum and its
+# configured deadline, so an outage fails fast instead of every request waiting out the full deadline. Calls
+# abandoned at their deadline still report their latency when they finish, so the deadline grows again when
+# the service gets slower for good.
+# The knowledge base breaker opens after KB_BREAKER_FAILURES failed retrieval attempts in a row, the handlers
+# then answer from the model alone until a trial call after KB_BREAKER_RESET_SECONDS succeeds. Calls in progress
+# stop retrying once the breaker is open.
+# Clients wrapped with these policies should not retry themselves (botocore max_attempts=1).
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+RETRIEVE_DEADLINE_MS = int(os.environ.get('RETRIEVE_DEADLINE_MS', '3000'))
+RETRIEVE_MIN_DEADLINE_MS = int(os.environ.get('RETRIEVE_MIN_DEADLINE_MS', '750'))
+TRANSLATE_DEADLINE_MS = int(os.environ.get('TRANSLATE_DEADLINE_MS', '2000'))
+ADAPTIVE_DEADLINE_MULTIPLIER = float(os.environ.get('ADAPTIVE_DEADLINE_MULTIPLIER', '4'))  # 0 keeps the configured deadlines
+MODEL_DEADLINE_MS = int(os.environ.get('MODEL_DEADLINE_MS', '10000'))  # Until the response starts, not the whole stream
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', '3'))
+RETRY_BASE_MS = int(os.environ.get('RETRY_BASE_MS', '100'))
+RETRY_MAX_BACKOFF_MS = int(os.environ.get('RETRY_MAX_BACKOFF_MS', '2000'))
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'true').lower() == 'true'
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '90'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_INITIAL_MS = int(os.environ.get('HEDGE_INITIAL_MS', '500'))  # Hedging threshold until HEDGE_MIN_SAMPLES calls were seen
+HEDGE_MAX_MS = int(os.environ.get('HEDGE_MAX_MS', '1000'))  # Latest hedge, even when slow calls pushed the percentile up
+KB_BREAKER_FAILURES = int(os.environ.get('KB_BREAKER_FAILURES', '5'))
+KB_BREAKER_RESET_SECONDS = float(os.environ.get('KB_BREAKER_RESET_SECONDS', '30'))
+
+RETRYABLE_CODES = frozenset({
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException', 'ServiceUnavailableException',
+    'InternalServerException', 'ModelNotReadyException', 'ModelStreamErrorException', 'RequestTimeout', 'RequestTimeoutException',
+})
+RETRYABLE_ERRORS = (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError)
+
+# Worker threads of the calls, an abandoned call finishes in the background
+EXECUTOR = ThreadPoolExecutor(max_workers=64, thread_name_prefix="aws-call")
+
+class DeadlineExceeded(Exception):
+    pass
+
+class CircuitOpen(Exception):
+    pass
+
+# Function to check whether an error is worth retrying
+def is_retryable(error):
+    if isinstance(error, ClientError):
+        # Errors inside an event stream carry the code in camel case (throttlingException)
+        code = error.response.get('Error', {}).get('Code') or ''
+        return code[:1].upper() + code[1:] in RETRYABLE_CODES
+    return isinstance(error, RETRYABLE_ERRORS)
+
+# Function to pick the wait before a retry, "full jitter" so retries of concurrent requests spread out
+def backoff_delay(attempt, base_ms=RETRY_BASE_MS, max_ms=RETRY_MAX_BACKOFF_MS):
+    return random.uniform(0, min(max_ms, base_ms * 2 ** attempt)) / 1000.0
+
+# Latencies of the latest successful calls, to pick the hedging threshold
+class LatencyTracker:
+    def __init__(self, size=200, min_samples=HEDGE_MIN_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    # Returns the latency percentile in seconds, None until enough calls were seen
+    def percentile(self, pct):
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_seconds, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False  # a half-open trial call is in progress
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.clock() - self.opened_at >= self.reset_seconds else 'open'
+
+    # Returns True when a call may go ahead, once the reset time has passed a single trial call is let through
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"Circuit breaker [{self.name}] closed")
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                print(f"Circuit breaker [{self.name}] opened after {self.failures} failures")
+                self.opened_at = self.clock()
+            self.trial = False
+
+# How one kind of call is made: deadline, retries, hedging and an optional circuit breaker
+class CallPolicy:
+    def __init__(self, name, deadline_ms, max_attempts=RETRY_MAX_ATTEMPTS, hedge=False, breaker=None, min_deadline_ms=None):
+        self.name = name
+        self.deadline = deadline_ms / 1000.0
+        self.min_deadline = (deadline_ms if min_deadline_ms is None else min(min_deadline_ms, deadline_ms)) / 1000.0
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.breaker = breaker
+        self.latencies = LatencyTracker()
+        self.counters = {'calls': 0, 'retries': 0, 'hedged': 0, 'hedge_wins': 0, 'deadline_exceeded': 0, 'failures': 0, 'short_circuited': 0}
+        self.lock = threading.Lock()  # Counters are also updated from the worker threads of hedged requests
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # Deadline of the next call: a multiple of the recent p99 latency within the policy's bounds
+    def current_deadline(self):
+        p99 = self.latencies.percentile(99) if ADAPTIVE_DEADLINE_MULTIPLIER > 0 else None
+        if p99 is None:
+            return self.deadline
+        return min(self.deadline, max(self.min_deadline, ADAPTIVE_DEADLINE_MULTIPLIER * p99))
+
+    # A call in progress stops retrying once the breaker opened, the service is considered down
+    def may_retry(self):
+        return self.breaker is None or self.breaker.state == 'closed'
+
+    def call(self, fn, *args, **kwargs):
+        self.count('calls')
+        if self.breaker is not None and not self.breaker.allow():
+            self.count('short_circuited')
+            raise CircuitOpen(f"{self.name} skipped, the {self.breaker.name} circuit is open")
+        timeout = self.current_deadline()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                result = self.attempt(fn, args, kwargs, deadline, timeout)
+            except Exception as e:
+                if self.breaker is not None:
+                    self.breaker.record_failure()
+                delay = backoff_delay(attempt)
+                if is_retryable(e) and attempt + 1 < self.max_attempts and time.monotonic() + delay < deadline and self.may_retry():
+                    self.count('retries')
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.count('deadline_exceeded' if isinstance(e, DeadlineExceeded) else 'failures')
+                raise
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return result
+
+    # Starts one request on a worker thread, its latency is recorded when it succeeds, even after it was abandoned
+    def submit(self, fn, args, kwargs):
+        submitted = time.monotonic()
+
+        def finished(future):
+            if future.exception() is None:
+                self.latencies.add(time.monotonic() - submitted)
+
+        future = EXECUTOR.submit(fn, *args, **kwargs)
+        future.add_done_callback(finished)
+        return future
+
+    # One attempt, hedged with a second identical request when it is slower than usual
+    def attempt(self, fn, args, kwargs, deadline, timeout):
+        started = time.monotonic()
+        futures = [self.submit(fn, args, kwargs)]
+        hedge_after = None
+        if self.hedge and HEDGE_ENABLED:
+            hedge_after = self.latencies.percentile(HEDGE_PERCENTILE)
+            if hedge_after is None:
+                hedge_after = HEDGE_INITIAL_MS / 1000.0
+            hedge_after = min(hedge_after, HEDGE_MAX_MS / 1000.0)
+        if hedge_after is not None and started + hedge_after < deadline:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                self.count('hedged')
+                futures.append(self.submit(fn, args, kwargs))
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.count('hedge_wins')
+                    return future.result()
+                error = error or future.exception()
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"{self.name} took longer than {timeout * 1000:.0f} ms")
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, deadline_ms=round(self.current_deadline() * 1000), breaker=self.breaker.state if self.breaker is not None else None)
+
+# Client wrapper sending the named methods through their policies, everything else goes to the client as is
+class ResilientClient:
+    def __init__(self, client, policies):
+        self.client = client
+        self.policies = policies
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        policy = self.policies.get(name)
+        if policy is None:
+            return attribute
+        return lambda *args, **kwargs: policy.call(attribute, *args, **kwargs)
+
+# Policies shared by every invocation of a warm container
+KB_BREAKER = CircuitBreaker('knowledge_base', KB_BREAKER_FAILURES, KB_BREAKER_RESET_SECONDS)
+RETRIEVE_CALLS = CallPolicy('retrieve', RETRIEVE_DEADLINE_MS, hedge=True, breaker=KB_BREAKER, min_deadline_ms=RETRIEVE_MIN_DEADLINE_MS)
+# A prompt that cannot be translated fails the request, so translate keeps its full deadline
+TRANSLATE_CALLS = CallPolicy('translate_text', TRANSLATE_DEADLINE_MS, hedge=True)
@@ -0,0 +1,118 @@
+# Cache of knowledge base retrieval results, shared by the web and Slack Lambda functions.
+# Results are memoized per normalized query for RETRIEVAL_CACHE_TTL_SECONDS, concurrent identical misses
+# share a single agent.retrieve call, and invalidate() drops everything after a knowledge base re-sync.
+# Keys include the shared cache version, so an invalidation sent to one container reaches every container.
+import os
+import re
+import time
+import threading
+
+from ttl_store import InMemoryStore
+from cache_version import CACHE_VERSION
+
+RETRIEVAL_CACHE_ENABLED = os.environ.get('RETRIEVAL_CACHE_ENABLED', 'true').lower() == 'true'
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', '900'))
+RETRIEVAL_CACHE_MAX_ITEMS = int(os.environ.get('RETRIEVAL_CACHE_MAX_ITEMS', '512'))
+KB_VERSION = os.environ.get('KB_VERSION', '1')
+
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Function to normalize a query so that case, whitespace and punctuation differences share a cache entry
+def normalize_query(text):
+    normalized = PUNCTUATION_PATTERN.sub(' ', text.lower())
+    return WHITESPACE_PATTERN.sub(' ', normalized).strip()
+
+# A retrieve call in progress, followers wait on the event and reuse the leader's result
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class RetrievalCache:
+    def __init__(self, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS, max_items=RETRIEVAL_CACHE_MAX_ITEMS, kb_version=KB_VERSION, clock=time.time, version=None):
+        self.ttl_seconds = ttl_seconds
+        self.kb_version = kb_version
+        self.version = version if version is not None else CACHE_VERSION
+        self.store = InMemoryStore(max_items=max_items, clock=clock)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.generation = 0
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0, 'invalidations': 0, 'hit_ms': 0.0, 'miss_ms': 0.0}
+
+    def key(self, kb_id, text, kwargs):
+        extra = "|".join(f"{name}={kwargs[name]}" for name in sorted(kwargs))
+        return f"{self.kb_version}.{self.version.current()}|{kb_id}|{normalize_query(text)}|{extra}"
+
+    def _count(self, counter, started=None, timer=None):
+        with self.lock:
+            self.counters[counter] += 1
+            if timer:
+                self.counters[timer] += (time.perf_counter() - started) * 1000
+
+    # Drop-in replacement for agent.retrieve(knowledgeBaseId=kb_id, retrievalQuery={"text": text}, **kwargs)
+    def retrieve(self, agent, kb_id, text, **kwargs):
+        started = time.perf_counter()
+        if not RETRIEVAL_CACHE_ENABLED:
+            return agent.retrieve(knowledgeBaseId=kb_id, retrievalQuery={"text": text}, **kwargs)
+
+        key = self.key(kb_id, text, kwargs)
+        with self.lock:
+            cached = self.store.get(key)
+            call = self.in_flight.get(key) if cached is None else None
+            leader = cached is None and call is None
+            if leader:
+                call = self.in_flight[key] = _InFlight()
+            generation = self.generation
+
+        if cached is not None:
+            self._count('hits', started, 'hit_ms')
+            return cached
+
+        if not leader:
+            call.event.wait()
+            self._count('coalesced', started, 'hit_ms')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            response = agent.retrieve(knowledgeBaseId=kb_id, retrievalQuery={"text": text}, **kwargs)
+            call.result = {"retrievalResults": response.get("retrievalResults", [])}
+            with self.lock:
+                # Results fetched before an invalidation belong to the old knowledge base
+                if generation == self.generation:
+                    self.store.put(key, call.result, self.ttl_seconds)
+            self._count('misses', started, 'miss_ms')
+            return call.result
+        except Exception as e:
+            call.error = e
+            self._count('errors')
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            call.event.set()
+
+    # Drops every cached result, called when the knowledge base has been re-synced. The local results go at
+    # once, other containers stop using theirs when they read the bumped version
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.store.clear()
+            self.counters['invalidations'] += 1
+        self.version.bump()
+
+    # Returns the hit/miss counters and average latencies for tuning the TTL
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        served = counters['hits'] + counters['coalesced']
+        counters['hit_ms'] = round(counters['hit_ms'] / served, 3) if served else 0.0
+        counters['miss_ms'] = round(counters['miss_ms'] / counters['misses'], 3) if counters['misses'] else 0.0
+        counters['size'] = len(self.store)
+        return counters
+
+# Cache shared by every request handled by this container
+RETRIEVAL_CACHE = RetrievalCache()
@@ -0,0 +1,47 @@
+# Sanitization of user prompts, model answers and chat history, shared by the web and Slack Lambda functions.
+# Markdown symbols are removed with a precompiled str.translate table (one pass, no regex engine), prompt
+# injection phrases are found with a single combined regex. The web client no longer sends its history (turns are
+# stored sanitized by the conversation store), but older clients still send the whole history on every turn, so
+# sanitized history turns are memoized by content and only their new turns are processed.
+import os
+import re
+from functools import lru_cache
+
+PROMPT_MAX_CHARS = 500
+SANITIZE_CACHE_SIZE = int(os.environ.get('SANITIZE_CACHE_SIZE', '2048'))
+
+SAFE_PROMPT_PATTERN = re.compile(r"^[a-zA-Z0-9\s,.!?:'-]+$")
+# Markdown-like symbols, deleted from prompts, answers and history
+MARKDOWN_SYMBOLS = "_*~`#[](){}>+-"
+MARKDOWN_TABLE = str.maketrans('', '', MARKDOWN_SYMBOLS)
+# Common injection phrases, one pattern so a prompt is scanned once
+INJECTION_PATTERN = re.compile(r"(?i)\b(?:system prompt|internal guidelines|configuration|ignore|disregard|forget|reset)\b")
+
+def validate_prompt(prompt):
+    # Allow only alphanumeric and basic punctuation. Validates user input to esnure there are only safe characters.
+    return SAFE_PROMPT_PATTERN.match(prompt) is not None
+
+def sanitize_input(prompt):
+    # Strip markdown and limit input length
+    return prompt.translate(MARKDOWN_TABLE).strip()[:PROMPT_MAX_CHARS]
+
+def sanitize_bot_input(prompt):
+    # Strip markdown, answers are kept at full length
+    return prompt.translate(MARKDOWN_TABLE)
+
+def detect_injection(prompt):
+    # Checks for potential prompt injection attmpts in user input.
+    return INJECTION_PATTERN.search(prompt) is not None
+
+# Sanitized (user, bot) pair of one history turn, memoized so turns re-sent on every request are only processed once
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def sanitize_turn(user, bot):
+    return sanitize_input(user), sanitize_bot_input(bot)
+
+def sanitize_chat_history(chat_history):
+    # sanatize the entire chat history to prevent injection attacks.
+    sanitized_history = []
+    for entry in chat_history:
+        user_input, bot_response = sanitize_turn(entry.get("user", ""), entry.get("bot", ""))
+        sanitized_history.append({"user": user_input, "bot": bot_response})
+    return sanitized_history
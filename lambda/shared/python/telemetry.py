@@ -0,0 +1,101 @@
+# Per-request timing spans emitted as CloudWatch Embedded Metric Format (EMF) records, and a log
+# governor that replaces unconditional debug dumps with lazy, truncated and sampled logging.
+#
+# LOG_LEVEL        DEBUG, INFO, WARNING or ERROR (default INFO)
+# LOG_SAMPLE_RATE  share of requests logged at DEBUG level whatever LOG_LEVEL says (default 0.01)
+# LOG_MAX_CHARS    longest debug message written before it is truncated (default 2000)
+import os
+import json
+import time
+import random
+import uuid
+from contextlib import contextmanager
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_MAX_CHARS = int(os.environ.get('LOG_MAX_CHARS', '2000'))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CICChatbot')
+FUNCTION_NAME = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+
+# Whether the current request was picked for debug logging, decided once per request
+_request = {'sampled': False}
+
+# Function to start a request: decides sampling and returns the request ID shared across Lambdas
+def start_request(request_id=None):
+    _request['sampled'] = random.random() < LOG_SAMPLE_RATE
+    return request_id or str(uuid.uuid4())
+
+def truncate(text, limit=None):
+    limit = LOG_MAX_CHARS if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
+
+# Function to log a message, the message may be a callable so expensive formatting only happens when it is written
+def log(level, message):
+    if LEVELS[level] < LOG_LEVEL and not (_request['sampled'] and level == 'DEBUG'):
+        return
+    if callable(message):
+        message = message()
+    print(truncate(message) if level == 'DEBUG' else message)
+
+def debug(message):
+    log('DEBUG', message)
+
+def info(message):
+    log('INFO', message)
+
+# Collects the timing of each stage of a request and emits them as one EMF record
+class RequestTimer:
+    def __init__(self, request_id, stage):
+        self.request_id = request_id
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.metrics = {}
+        self.counts = {}
+
+    # Times a block of code, repeated spans with the same name are added up
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    # Adds seconds to a cumulative metric, for example the time spent in post_to_connection
+    def add(self, name, seconds):
+        self.metrics[name] = self.metrics.get(name, 0.0) + seconds * 1000
+
+    # Records the time since the start of the request, only the first mark of a name is kept
+    def mark(self, name):
+        if name not in self.metrics:
+            self.metrics[name] = (time.perf_counter() - self.started) * 1000
+
+    # Adds to a counter emitted with the timings, for example the tokens used by the request
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    # Writes the EMF record, CloudWatch turns every metric into a time series per Stage
+    def emit(self, **properties):
+        self.mark('total')
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Stage"]],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in self.metrics] +
+                               [{"Name": name, "Unit": "Count"} for name in self.counts]
+                }]
+            },
+            "Stage": self.stage,
+            "FunctionName": FUNCTION_NAME,
+            "RequestId": self.request_id,
+        }
+        record.update({name: round(value, 2) for name, value in self.metrics.items()})
+        record.update(self.counts)
+        record.update(properties)
+        print(json.dumps(record))
+        return record
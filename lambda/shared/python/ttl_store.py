@@ -0,0 +1,184 @@
+# Key/value stores with per-item expiry, shared by the Lambda functions through the shared layer.
+# InMemoryStore lives inside a single warm container (and stands in for DynamoDB locally),
+# DynamoDBStore is shared by every container and expects a table with a string partition key "pk"
+# and DynamoDB TTL enabled on the "expires_at" attribute.
+import os
+import json
+import time
+import random
+import threading
+from collections import OrderedDict
+
+import boto3
+from botocore.exceptions import ClientError
+
+UPDATE_ATTEMPTS = int(os.environ.get('STORE_UPDATE_ATTEMPTS', '8'))
+UPDATE_BACKOFF_BASE_MS = float(os.environ.get('STORE_UPDATE_BACKOFF_BASE_MS', '10'))
+UPDATE_BACKOFF_MAX_MS = float(os.environ.get('STORE_UPDATE_BACKOFF_MAX_MS', '200'))
+
+# Raised when an update lost the race to other writers of the same item on every attempt. The store works, the
+# item is just too busy, so callers can tell it apart from an outage
+class UpdateConflict(RuntimeError):
+    pass
+
+# Function to compute the wait before the next attempt of a conflicting update, full jitter so that the writers
+# that collided spread out instead of colliding again
+def conflict_delay(attempt, base_ms=UPDATE_BACKOFF_BASE_MS, max_ms=UPDATE_BACKOFF_MAX_MS):
+    return random.uniform(0, min(max_ms, base_ms * 2 ** attempt)) / 1000.0
+
+# Bounded in-process store, evicts the least recently used item once max_items is reached
+class InMemoryStore:
+    def __init__(self, max_items=1024, clock=time.time):
+        self.max_items = max_items
+        self.clock = clock
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= self.clock():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl_seconds=None):
+        expires_at = self.clock() + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    # Stores the value only if the key is missing or expired, returns True when the value was stored
+    def put_if_absent(self, key, value, ttl_seconds=None):
+        expires_at = self.clock() + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (item[1] is None or item[1] > self.clock()):
+                return False
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return True
+
+    # Read-modify-write of one item: fn gets the current value (None if missing or expired) and returns
+    # (new value, result), a new value of None deletes the item. Returns the result
+    def update(self, key, fn, ttl_seconds=None):
+        with self.lock:
+            item = self.items.get(key)
+            current = item[0] if item is not None and (item[1] is None or item[1] > self.clock()) else None
+            value, result = fn(current)
+            if value is None:
+                self.items.pop(key, None)
+            else:
+                self.items[key] = (value, self.clock() + ttl_seconds if ttl_seconds else None)
+                self.items.move_to_end(key)
+                while len(self.items) > self.max_items:
+                    self.items.popitem(last=False)
+        return result
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+# DynamoDB backed store, values are stored as JSON strings
+class DynamoDBStore:
+    def __init__(self, table_name, client=None, clock=time.time, sleep=time.sleep):
+        self.table_name = table_name
+        self.client = client
+        self.clock = clock
+        self.sleep = sleep
+
+    def _client(self):
+        if self.client is None:
+            self.client = boto3.client("dynamodb")
+        return self.client
+
+    def get(self, key):
+        response = self._client().get_item(TableName=self.table_name, Key={"pk": {"S": key}}, ConsistentRead=True)
+        item = response.get("Item")
+        if not item:
+            return None
+        # DynamoDB deletes expired items lazily, so the expiry is checked on read as well
+        if "expires_at" in item and int(item["expires_at"]["N"]) <= self.clock():
+            return None
+        return json.loads(item["value"]["S"])
+
+    def _item(self, key, value, ttl_seconds):
+        item = {"pk": {"S": key}, "value": {"S": json.dumps(value)}}
+        if ttl_seconds:
+            item["expires_at"] = {"N": str(int(self.clock() + ttl_seconds))}
+        return item
+
+    def put(self, key, value, ttl_seconds=None):
+        self._client().put_item(TableName=self.table_name, Item=self._item(key, value, ttl_seconds))
+
+    def put_if_absent(self, key, value, ttl_seconds=None):
+        try:
+            self._client().put_item(
+                TableName=self.table_name,
+                Item=self._item(key, value, ttl_seconds),
+                ConditionExpression="attribute_not_exists(pk) OR expires_at <= :now",
+                ExpressionAttributeValues={":now": {"N": str(int(self.clock()))}}
+            )
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    # Read-modify-write of one item with optimistic locking on a version attribute, retried with jittered
+    # exponential backoff when another writer got in between. fn gets the current value and returns
+    # (new value, result), None deletes the item. Raises UpdateConflict when every attempt lost the race
+    def update(self, key, fn, ttl_seconds=None, attempts=UPDATE_ATTEMPTS):
+        for attempt in range(attempts):
+            if attempt:
+                self.sleep(conflict_delay(attempt - 1))
+            item = self._client().get_item(TableName=self.table_name, Key={"pk": {"S": key}}, ConsistentRead=True).get("Item")
+            current = None
+            if item and not ("expires_at" in item and int(item["expires_at"]["N"]) <= self.clock()):
+                current = json.loads(item["value"]["S"])
+            version = int(item["version"]["N"]) if item and "version" in item else 0
+            value, result = fn(current)
+            if item is None:
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+            else:
+                condition = {"ConditionExpression": "version = :version" if version else "attribute_not_exists(version)"}
+                if version:
+                    condition["ExpressionAttributeValues"] = {":version": {"N": str(version)}}
+            try:
+                if value is None:
+                    if item is not None:
+                        self._client().delete_item(TableName=self.table_name, Key={"pk": {"S": key}}, **condition)
+                else:
+                    new_item = self._item(key, value, ttl_seconds)
+                    new_item["version"] = {"N": str(version + 1)}
+                    self._client().put_item(TableName=self.table_name, Item=new_item, **condition)
+                return result
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+        raise UpdateConflict(f"Gave up updating {key} after {attempts} conflicting writes")
+
+    def delete(self, key):
+        self._client().delete_item(TableName=self.table_name, Key={"pk": {"S": key}})
+
+# Function to create the shared store for a feature: DynamoDB when the table variable is set, in-memory otherwise
+def create_store(table_env_var, max_items=1024):
+    table_name = os.environ.get(table_env_var)
+    if table_name:
+        return DynamoDBStore(table_name)
+    return InMemoryStore(max_items=max_items)
@@ -2,28 +2,81 @@
 import os
 import json
 import boto3
+from botocore.config import Config
+
+from language_detection import is_in_language
+from ttl_store import InMemoryStore
+from telemetry import RequestTimer, debug, start_request
+from connection_registry import ConnectionRegistry
+from resilience import TRANSLATE_CALLS
 
 # Initialize AWS service clients for Lambda, API Gateway, and translate
 lambda_client = boto3.client('lambda')
 api_client = boto3.client('apigatewaymanagementapi')
-translate_client = boto3.client('translate')
+# Translate calls are retried and hedged by the resilience layer within their deadline, botocore makes one attempt
+translate_client = boto3.client('translate', config=Config(retries={'mode': 'standard', 'max_attempts': 1}))
+
+# Open/closed state of websocket connections, read by the response Lambda before it does any work
+connection_registry = ConnectionRegistry()
+
+# Cache of (source text, target language) -> translation, kept for the lifetime of the container
+TRANSLATION_CACHE_TTL_SECONDS = int(os.environ.get('TRANSLATION_CACHE_TTL_SECONDS', '86400'))
+translation_cache = InMemoryStore(max_items=int(os.environ.get('TRANSLATION_CACHE_MAX_ITEMS', '1024')))
+
+# Counts how many prompts needed Amazon Translate and how many were handled locally
+translate_stats = {'requests': 0, 'translate_calls': 0, 'skipped_same_language': 0, 'cache_hits': 0}
+
+# Function to translate a prompt into the target language, returns the translated text and the source language
+def translate_prompt(prompt, language):
+    translate_stats['requests'] += 1
+
+    # Fast path: the prompt is already in the target language, which is the common English case
+    if is_in_language(prompt, language):
+        translate_stats['skipped_same_language'] += 1
+        return prompt, language
+
+    cache_key = f"{language}|{prompt.strip()}"
+    cached = translation_cache.get(cache_key)
+    if cached is not None:
+        translate_stats['cache_hits'] += 1
+        return cached['text'], cached['source']
+
+    translation_response = TRANSLATE_CALLS.call(
+        translate_client.translate_text,
+        Text=prompt,
+        SourceLanguageCode='auto',
+        TargetLanguageCode=language
+    )
+    translate_stats['translate_calls'] += 1
+    translated = {
+        'text': translation_response['TranslatedText'],
+        'source': translation_response.get('SourceLanguageCode', 'auto')
+    }
+    translation_cache.put(cache_key, translated, TRANSLATION_CACHE_TTL_SECONDS)
+    return translated['text'], translated['source']
 
 # Function for handling the sendMessage websocket route
 def handle_message(event, connection_id):
     # Get the ARN of the response Lambda function from environment variables
     response_function_arn = os.environ['RESPONSE_FUNCTION_ARN']
 
+    # The request ID is passed on so the response Lambda reports its timings under the same ID
+    request_id = start_request(event.get('requestContext', {}).get('requestId'))
+    timer = RequestTimer(request_id, "websocket")
+
     try:
         # Parse the message body and extract prompt and language settings
         body = json.loads(event.get('body', '{}'))
         prompt = body.get('prompt', '')
         language = body.get('language')  # User-specified language
-        chat_history = body.get('chatHistory', [])
+        chat_history = body.get('chatHistory')  # Only sent by older clients, the conversation is stored server side
+        protocol = body.get('protocol')  # Frame protocol the client understands, older clients send none
+        session_id = body.get('sessionId')  # Chat session of the client, its conversation is stored under it
 
         # Log the received language and prompt for debugging
         print(f"Language from request: [{language}]")
-        print(f"Prompt from user: [{prompt}]")
-        print(f"Chat history: [{json.dumps(chat_history)}]")
+        debug(lambda: f"Prompt from user: [{prompt}]")
+        print(f"Chat history entries from client: [{len(chat_history) if chat_history is not None else 0}]")
 
         # Validate that a prompt was provided
         if not prompt:
@@ -39,15 +92,12 @@ def handle_message(event, connection_id):
 
             # Only translate if the user specifies a different target language
             if language and language != 'auto':
-                translation_response = translate_client.translate_text(
-                    Text=prompt,
-                    SourceLanguageCode='auto',
-                    TargetLanguageCode=language
-                )
-                detected_source_language = translation_response.get('SourceLanguageCode', 'auto')
-                translated_prompt = translation_response['TranslatedText']
+                with timer.span('translate'):
+                    translated_prompt, detected_source_language = translate_prompt(prompt, language)
+                avoided = translate_stats['requests'] - translate_stats['translate_calls']
                 print(f"Detected source language: [{detected_source_language}]")
-                print(f"Translated prompt: [{translated_prompt}]")
+                debug(lambda: f"Translated prompt: [{translated_prompt}]")
+                print(f"Translate calls avoided: [{avoided}/{translate_stats['requests']}] {translate_stats}")
             else:
                 print("No translation needed; using prompt as-is.")
 
@@ -65,19 +115,27 @@ def handle_message(event, connection_id):
 
         # Prepare input payload for the response Lambda function
         input = {
+            "requestId": request_id,
             "prompt": translated_prompt, #Use the translated prompt
-            "chatHistory": chat_history,
             "connectionId": connection_id,
             "language": response_language #Use detected or user-specified language
         }
+        if chat_history is not None:
+            input["chatHistory"] = chat_history
+        if protocol is not None:
+            input["protocol"] = protocol
+        if session_id is not None:
+            input["sessionId"] = session_id
 
         # Asynchronously invoke the response Lambda function
-        lambda_client.invoke(
-            FunctionName=response_function_arn,
-            InvocationType='Event',
-            Payload=json.dumps(input)
-        )
-
+        with timer.span('invoke'):
+            lambda_client.invoke(
+                FunctionName=response_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps(input)
+            )
+
+        timer.emit()
         return {'statusCode': 200}
 
     except json.JSONDecodeError as e:
@@ -99,12 +157,26 @@ def handle_message(event, connection_id):
 def handle_connect(event, connection_id):
     # Handle new WebSocket connections and log the connection ID
     print(f"New client connected with connection id: {connection_id}")
+    try:
+        connection_registry.connect(connection_id)
+    except Exception as e:
+        print(f"Failed to register connection {connection_id}: {str(e)}")
+    return {'statusCode': 200}
+
+# Function for handling the disconnect websocket route
+def handle_disconnect(event, connection_id):
+    # Mark the connection as closed so responses still being prepared for it are abandoned
+    print(f"Client disconnected with connection id: {connection_id}")
+    try:
+        connection_registry.disconnect(connection_id)
+    except Exception as e:
+        print(f"Failed to unregister connection {connection_id}: {str(e)}")
     return {'statusCode': 200}
 
 # Main WebSocket handler for chat application - processes new connections and incoming messages, routing them to appropriate handler functions
 def lambda_handler(event, context):
-    # Log the incoming event for debugging
-    print(f"Received event: {json.dumps(event)}")
+    # Log the incoming event for debugging, only serialized when debug logging is on or the request is sampled
+    debug(lambda: f"Received event: {json.dumps(event)}")
 
     try:
         # Extract route and connection ID from the event
@@ -121,6 +193,8 @@ def lambda_handler(event, context):
         # Route the request based on the WebSocket action
         if route_key == '$connect':
             return handle_connect(event, connection_id)
+        elif route_key == '$disconnect':
+            return handle_disconnect(event, connection_id)
         elif route_key == 'sendMessage':
             return handle_message(event, connection_id)
         else:
@@ -0,0 +1,93 @@
+# Lightweight local language detection used to skip Amazon Translate when a prompt is already
+# in the target language. It only answers when it is confident and returns None otherwise,
+# in which case the caller falls back to Translate with SourceLanguageCode='auto'.
+import re
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Frequent function words of the most common Latin-script languages
+STOPWORDS = {
+    'en': frozenset("the is are was what who whom how where when why which do does did can could would should will "
+                    "you your i me my we our it its this that these those of to in on at for with about from and or "
+                    "a an be have has tell there any hello hi hey thanks thank please".split()),
+    'es': frozenset("el la los las es son qué que quién cómo dónde cuándo por para con de del y o un una en mi tu "
+                    "su sus hay puedo puedes sobre hola gracias".split()),
+    'fr': frozenset("le la les est sont qui que quoi comment où quand pourquoi pour avec de des du et ou un une en "
+                    "mon ton je vous nous il elle sur bonjour merci".split()),
+    'de': frozenset("der die das ist sind was wer wie wo wann warum für mit von und oder ein eine in mein dein ich "
+                    "sie wir es über hallo danke".split()),
+    'pt': frozenset("o a os as é são que quem como onde quando por para com de do da e ou um uma em meu seu eu "
+                    "você sobre olá obrigado".split()),
+    'it': frozenset("il lo la gli le è sono che chi come dove quando perché per con di del e o un una in mio tuo "
+                    "io lei noi su ciao grazie".split()),
+}
+
+# Unicode blocks whose script is used by a single supported language
+SCRIPT_RANGES = (
+    ('ko', 0xAC00, 0xD7AF), ('ko', 0x1100, 0x11FF),
+    ('ja', 0x3040, 0x30FF),
+    ('zh', 0x4E00, 0x9FFF),
+    ('th', 0x0E00, 0x0E7F),
+    ('el', 0x0370, 0x03FF),
+    ('he', 0x0590, 0x05FF),
+    ('hy', 0x0530, 0x058F),
+    ('ka', 0x10A0, 0x10FF),
+    ('km', 0x1780, 0x17FF),
+    ('lo', 0x0E80, 0x0EFF),
+    ('my', 0x1000, 0x109F),
+    ('si', 0x0D80, 0x0DFF),
+    ('ta', 0x0B80, 0x0BFF),
+    ('te', 0x0C00, 0x0C7F),
+    ('kn', 0x0C80, 0x0CFF),
+    ('ml', 0x0D00, 0x0D7F),
+    ('gu', 0x0A80, 0x0AFF),
+    ('pa', 0x0A00, 0x0A7F),
+    ('bn', 0x0980, 0x09FF),
+)
+
+LATIN_LIMIT = 0x0250  # Basic Latin through Latin Extended-B
+
+def _script_of(char):
+    code = ord(char)
+    if code < LATIN_LIMIT:
+        return 'latin'
+    for language, start, end in SCRIPT_RANGES:
+        if start <= code <= end:
+            return language
+    return None
+
+# Function to detect the language of a text, returns a language code or None when unsure
+def detect_language(text):
+    letters = [char for char in text if char.isalpha()]
+    if not letters:
+        return None
+
+    counts = {}
+    for char in letters:
+        script = _script_of(char)
+        counts[script] = counts.get(script, 0) + 1
+
+    # Latin letters inside non-Latin text are usually names or acronyms such as "CIC", so they are ignored
+    non_latin = sum(count for script, count in counts.items() if script != 'latin')
+    if non_latin:
+        # Japanese mixes kana with Han characters, any kana means Japanese
+        if counts.get('ja') and counts.get('ja', 0) + counts.get('zh', 0) >= 0.9 * non_latin:
+            return 'ja'
+        script, count = max(((script, count) for script, count in counts.items() if script != 'latin'), key=lambda item: item[1])
+        if script is None or count < 0.9 * non_latin:
+            return None
+        return script
+
+    words = WORD_PATTERN.findall(text.lower())
+    scores = sorted(((sum(word in stopwords for word in words), language) for language, stopwords in STOPWORDS.items()), reverse=True)
+    (best, language), (runner_up, _) = scores[0], scores[1]
+    # Need at least one function word and a clear winner
+    if best == 0 or best == runner_up:
+        return None
+    if len(words) > 4 and best < 0.2 * len(words):
+        return None
+    return language
+
+# Function to check whether a text is already written in the target language
+def is_in_language(text, language_code):
+    return detect_language(text) == language_code.lower().split('-')[0]
@@ -4,6 +4,7 @@ import * as apigatewayv2 from '@aws-cdk/aws-apigatewayv2-alpha';
 import * as apigatewayv2_integrations from '@aws-cdk/aws-apigatewayv2-integrations-alpha';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import { bedrock } from '@cdklabs/generative-ai-cdk-constructs';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
 import * as amplify from '@aws-cdk/aws-amplify-alpha';
@@ -48,26 +49,96 @@ export class CicChatAssistantStack extends cdk.Stack {
             ]
         });
 
+        // Shared Python modules used by the Lambda functions, available under /opt/python
+        const sharedLayer = new lambda.LayerVersion(this, 'shared-python-layer', {
+            code: lambda.Code.fromAsset('lambda/shared'),
+            compatibleRuntimes: [lambda.Runtime.PYTHON_3_9, lambda.Runtime.PYTHON_3_12],
+            description: 'Shared modules for the CIC chatbot Lambda functions',
+        });
+
+        // Shared tier of the answer cache for repeated first-turn questions, also holds the cache version
+        // bumped by invalidations of the answer and retrieval caches
+        const answerCacheTable = new dynamodb.Table(this, 'answer-cache-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
+        // Server-side conversation history per chat session, keyed by the client's sessionId (the connection ID when a client sends none)
+        const conversationTable = new dynamodb.Table(this, 'conversation-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
+        // Open/closed state of websocket connections
+        const connectionTable = new dynamodb.Table(this, 'connection-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
+        // Token buckets and the wait queue in front of the model, shared by every container
+        const admissionTable = new dynamodb.Table(this, 'admission-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
+        // Identical questions being answered at the same time, shared by every container
+        const flightTable = new dynamodb.Table(this, 'flight-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
         // get-response-from-bedrock Lambda function
         const getResponseFromBedrockLambda = new lambda.Function(this, 'get-response-from-bedrock', {
             runtime: lambda.Runtime.PYTHON_3_12,
             code: lambda.Code.fromAsset('lambda/get-response-from-bedrock'),
             handler: 'index.handler',
+            layers: [sharedLayer],
             environment: {
                 KNOWLEDGE_BASE_ID: kb.knowledgeBaseId,
-                URL: 'URL'
+                URL: 'URL',
+                ANSWER_CACHE_TABLE: answerCacheTable.tableName,
+                CACHE_VERSION_TABLE: answerCacheTable.tableName,
+                CONVERSATION_TABLE: conversationTable.tableName,
+                CONNECTION_TABLE: connectionTable.tableName,
+                FLIGHT_TABLE: flightTable.tableName,
+                ADMISSION_TABLE: admissionTable.tableName,
+                KB_VERSION: '1'
             },
             timeout: cdk.Duration.seconds(300),
             memorySize: 256
         });
+        answerCacheTable.grantReadWriteData(getResponseFromBedrockLambda);
+        conversationTable.grantReadWriteData(getResponseFromBedrockLambda);
+        connectionTable.grantReadData(getResponseFromBedrockLambda);
+        flightTable.grantReadWriteData(getResponseFromBedrockLambda);
+        admissionTable.grantReadWriteData(getResponseFromBedrockLambda);
 
         // Grant permissions to access Bedrock for getResponseFromBedrockLambda
         kb.grantRead(getResponseFromBedrockLambda);
+        // Not limited to this region, model calls fail over to the other regions of BEDROCK_REGIONS
         getResponseFromBedrockLambda.addToRolePolicy(new iam.PolicyStatement({
-            actions: ['bedrock:InvokeModel'],
+            actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
             resources: ['*'],
         }));
 
+        // Slack event IDs already handled, so retried and duplicate deliveries are dropped
+        const slackEventTable = new dynamodb.Table(this, 'slack-event-table', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+        });
+
         // Environment variables with placeholder values to guide users
             const slackBotEnvVars = {
                 ASANA_PAT: '<ASANA_PAT>',
@@ -76,7 +147,9 @@ export class CicChatAssistantStack extends cdk.Stack {
                 SLACK_SECRET: '<CLIENT_SECRET>',
                 KNOWLEDGE_BASE_ID: kb.knowledgeBaseId,
                 SLACK_BOT_TOKEN: '<SLACK_BOT_TOKEN>',
-                SLACK_BOT_USER_ID: '<SLACK_BOT_USER_ID>'
+                SLACK_BOT_USER_ID: '<SLACK_BOT_USER_ID>',
+                SLACK_EVENT_TABLE: slackEventTable.tableName,
+                CACHE_VERSION_TABLE: answerCacheTable.tableName
             };
 
         // Create Lambda function for Slack bot message processing
@@ -84,6 +157,7 @@ export class CicChatAssistantStack extends cdk.Stack {
             runtime: lambda.Runtime.PYTHON_3_9,
             code: lambda.Code.fromAsset('lambda/slack-bot-processor'),
             handler: 'index.handler',
+            layers: [sharedLayer],
             environment: slackBotEnvVars,
             timeout: cdk.Duration.minutes(5),
             memorySize: 1024,
@@ -92,7 +166,7 @@ export class CicChatAssistantStack extends cdk.Stack {
         // Grant permissions to access Bedrock
         kb.grantRead(slackBotProcessor);
         slackBotProcessor.addToRolePolicy(new iam.PolicyStatement({
-            actions: ['bedrock:InvokeModel'],
+            actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
             resources: ['*'],
         }));
         
@@ -111,13 +185,19 @@ export class CicChatAssistantStack extends cdk.Stack {
             runtime: lambda.Runtime.PYTHON_3_9,
             code: lambda.Code.fromAsset('lambda/slack-bot-opener'),
             handler: 'index.handler',
+            layers: [sharedLayer],
             environment: {
-                RESPONSE_FUNCTION_ARN: slackBotProcessor.functionArn
+                RESPONSE_FUNCTION_ARN: slackBotProcessor.functionArn,
+                SLACK_EVENT_TABLE: slackEventTable.tableName
             },
             timeout: cdk.Duration.minutes(1),
             memorySize: 256,
         });
 
+        slackEventTable.grantReadWriteData(slackBotProcessor);
+        answerCacheTable.grantReadWriteData(slackBotProcessor);
+        slackEventTable.grantReadWriteData(slackBotOpener);
+
         // Grant permissions for opener to invoke processor and response function
         slackBotProcessor.grantInvoke(slackBotOpener);
         getResponseFromBedrockLambda.grantInvoke(slackBotOpener);
@@ -153,8 +233,10 @@ export class CicChatAssistantStack extends cdk.Stack {
             runtime: lambda.Runtime.PYTHON_3_12,
             code: lambda.Code.fromAsset('lambda/web-socket-handler'),
             handler: 'index.handler',
+            layers: [sharedLayer],
             environment: {
-                RESPONSE_FUNCTION_ARN: getResponseFromBedrockLambda.functionArn
+                RESPONSE_FUNCTION_ARN: getResponseFromBedrockLambda.functionArn,
+                CONNECTION_TABLE: connectionTable.tableName
             },
             timeout: cdk.Duration.seconds(300),
             memorySize: 256
@@ -162,6 +244,7 @@ export class CicChatAssistantStack extends cdk.Stack {
 
         // Grant permission to invoke response function
         getResponseFromBedrockLambda.grantInvoke(webSocketHandler);
+        connectionTable.grantReadWriteData(webSocketHandler);
 
         // Grant Amazon Translate permissions to web-socket-handler
         webSocketHandler.addToRolePolicy(new iam.PolicyStatement({
@@ -0,0 +1,63 @@
+# Offline build of the local knowledge base index used by the Lambda functions (see lambda/shared/python/local_index.py).
+# Reads the markdown/text documents of the knowledge base, e.g. after `aws s3 sync s3://<DocumentBucketName> kb-docs`,
+# splits them into overlapping chunks per markdown section and writes the index into the shared layer, so that
+# the next `cdk deploy` ships it. Rebuild it whenever the knowledge base documents change.
+# Usage: python scripts/build_kb_index.py kb-docs [--output lambda/shared/python/kb_index.bin] [--chunk-words 200]
+import argparse
+import os
+import re
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "lambda", "shared", "python"))
+
+from local_index import write_index
+
+DOCUMENT_EXTENSIONS = (".md", ".markdown", ".txt")
+HEADING_PATTERN = re.compile(r'^#{1,6}\s', re.MULTILINE)
+
+# Function to split a document into sections at its markdown headings
+def sections(text):
+    starts = [match.start() for match in HEADING_PATTERN.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)]) if text[start:end].strip()]
+
+# Function to split a section into windows of chunk_words words that overlap by overlap_words
+def windows(section, chunk_words, overlap_words):
+    words = section.split()
+    if len(words) <= chunk_words:
+        return [section]
+    step = max(1, chunk_words - overlap_words)
+    return [" ".join(words[start:start + chunk_words]) for start in range(0, len(words) - overlap_words, step)]
+
+def read_chunks(directory, chunk_words, overlap_words):
+    chunks = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(DOCUMENT_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8", errors="replace") as document:
+                text = document.read()
+            source = os.path.relpath(path, directory)
+            for section in sections(text):
+                chunks.extend((source, chunk) for chunk in windows(section, chunk_words, overlap_words))
+    return chunks
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local knowledge base index")
+    parser.add_argument("documents", help="directory with the knowledge base documents")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "lambda", "shared", "python", "kb_index.bin"))
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--overlap-words", type=int, default=40)
+    args = parser.parse_args()
+
+    chunks = read_chunks(args.documents, args.chunk_words, args.overlap_words)
+    if not chunks:
+        sys.exit(f"No {', '.join(DOCUMENT_EXTENSIONS)} documents found in {args.documents}")
+    write_index(chunks, args.output)
+    print(f"Indexed {len(chunks)} chunks from {len({source for source, _ in chunks})} documents into {args.output} ({os.path.getsize(args.output)} bytes)")
+
+if __name__ == "__main__":
+    main()